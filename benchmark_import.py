@@ -0,0 +1,53 @@
+"""
+Benchmark do tempo de importação dos módulos de integração.
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-03
+
+Cada módulo é importado em um processo Python novo, várias vezes, e é reportada a
+mediana do tempo. Importar um módulo não deve criar clientes do BigQuery, ler a
+configuração nem executar consultas: o tempo medido deve ser apenas o das dependências.
+Uso: python benchmark_import.py [modulo ...] [--repeticoes N]
+"""
+
+import statistics
+import subprocess
+import sys
+
+MODULOS = ['omie', 'pier8', 'shopify', 'google_trends', 'facebook_diario', 'roas_inference']
+
+CODIGO = """
+import time
+inicio = time.perf_counter()
+import {modulo}
+print(time.perf_counter() - inicio)
+"""
+
+
+def medir_importacao(modulo, repeticoes = 5):
+    """
+    Retorna a lista de tempos (s) de importação do módulo, cada um em um processo novo.
+    Retorna None se o módulo não puder ser importado neste ambiente.
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        proc = subprocess.run([sys.executable, '-c', CODIGO.format(modulo = modulo)], capture_output = True, text = True)
+        if proc.returncode != 0:
+            print(f'{modulo}: erro na importação\n{proc.stderr.strip().splitlines()[-1]}')
+            return None
+        tempos.append(float(proc.stdout.strip().splitlines()[-1]))
+    return tempos
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Tempo de importação dos módulos')
+    parser.add_argument('modulos', nargs = '*', default = MODULOS)
+    parser.add_argument('--repeticoes', type = int, default = 5)
+    args = parser.parse_args()
+
+    for modulo in args.modulos:
+        tempos = medir_importacao(modulo, args.repeticoes)
+        if tempos is not None:
+            print(f'{modulo:<20} mediana: {statistics.median(tempos)*1000:8.1f} ms | min: {min(tempos)*1000:8.1f} ms')
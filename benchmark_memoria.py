@@ -0,0 +1,136 @@
+"""
+Benchmark do pico de memória das transformações de notas fiscais (pandas x Arrow).
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-15
+
+Cada variante (omie.notas_fiscais_df e omie.notas_fiscais_arrow) roda em um processo
+Python novo sobre os mesmos registros, lidos do arquivo de respostas (omie_arquivo) ou
+gerados sinteticamente. É reportado o pico da transformação: tracemalloc (objetos
+Python e arrays NumPy) + pool de memória do Arrow, e o aumento do RSS máximo do processo.
+O tempo é medido em uma segunda execução, sem tracemalloc (que deixa a transformação muito
+mais lenta, sobretudo a versão pandas).
+Uso:
+    python benchmark_memoria.py --arquivo cache/arquivo_omie [--de DD/MM/YYYY] [--ate DD/MM/YYYY]
+    python benchmark_memoria.py --sinteticas 50000
+    (--warehouse warehouse.duckdb usa o backend local para ler o schema da tabela notas_fiscais)
+"""
+
+import json
+import random
+import subprocess
+import sys
+
+VARIANTES = {'pandas': 'notas_fiscais_df', 'arrow': 'notas_fiscais_arrow'}
+
+CODIGO = """
+import json, sys, time, tracemalloc
+import pyarrow as pa
+try:
+    import resource
+    def rss_maximo_kb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+except ImportError:
+    # Windows (sem o módulo resource): pico do working set via psutil.
+    import psutil
+    def rss_maximo_kb():
+        return psutil.Process().memory_info().peak_wset // 1024
+from benchmark_memoria import carregar_registros
+from omie import omie
+
+args = json.loads(sys.argv[1])
+gbq = None
+if args['warehouse']:
+    from local_warehouse import LocalBigQuery
+    gbq = LocalBigQuery(args['warehouse'])
+OMIE = omie('', '', gbq = gbq)
+OMIE._schema('notas_fiscais')
+nfs = carregar_registros(args)
+
+rss_inicial = rss_maximo_kb()
+arrow_inicial = pa.default_memory_pool().max_memory() or 0
+tracemalloc.start()
+resultado = getattr(OMIE, args['metodo'])(nfs)
+_, pico_python = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+pico_arrow = (pa.default_memory_pool().max_memory() or 0) - arrow_inicial
+rss = rss_maximo_kb() - rss_inicial
+del resultado
+inicio = time.perf_counter()
+resultado = getattr(OMIE, args['metodo'])(nfs)
+tempo = time.perf_counter() - inicio
+print(json.dumps({'linhas': len(resultado), 'pico_python': pico_python, 'pico_arrow': pico_arrow, 'rss_kb': rss, 'tempo_s': tempo}))
+"""
+
+CFOPS = ['5.102', '5.405', '6.102', '6.108', '5.910', '6.910']
+UFS = ['SP', 'RJ', 'MG', 'PR', 'SC', 'RS', 'BA', 'PE', 'GO', 'DF']
+
+
+def gerar_notas_fiscais(quantidade, itens_por_nf = 3, seed = 0):
+    """
+    Gera NFs sintéticas com a estrutura da resposta de ListarNF (campos usados pelas transformações),
+    com a mesma repetição de códigos (CFOP, NCM, UF, CNPJ) dos dados reais.
+    """
+    rnd = random.Random(seed)
+    ncms = [f'{rnd.randrange(10**7, 10**8)}' for _ in range(300)]
+    cnpjs = [f'{rnd.randrange(10**13, 10**14)}' for _ in range(2000)]
+    nfs = []
+    for i in range(quantidade):
+        data = f'{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/{rnd.choice([2020, 2021, 2022])}'
+        nfs.append({
+            'compl': {'nIdNF': 10**9 + i, 'cChaveNFe': f'{rnd.getrandbits(160):044d}'[:44], 'nIdPedido': 10**8 + i},
+            'info': {'dInc': data, 'hInc': '10:00:00', 'uInc': 'WEBSERVICE', 'cImpAPI': 'S'},
+            'ide': {'nNF': str(100000 + i), 'serie': '1', 'dEmi': data, 'tpNF': '1', 'finNFe': '1'},
+            'nfDestInt': {'cnpj_cpf': rnd.choice(cnpjs), 'cUF': rnd.choice(UFS), 'cCidade': 'SAO PAULO'},
+            'nfEmitInt': {'cnpj_emit': '12345678000199', 'cUF_emit': 'SP'},
+            'total': {'ICMSTot': {'vNF': round(rnd.uniform(10, 5000), 2), 'vICMS': round(rnd.uniform(0, 500), 2)},
+                      'ISSQNtot': {}, 'retTrib': {}},
+            'pedido': {'nCodPed': 10**8 + i}, 'titulos': {}, 'prod': {},
+            'det': [{
+                'nfProdInt': {'nCodItem': 10**7 * i + j, 'nCodProd': rnd.randrange(1, 500)},
+                'prod': {'CFOP': rnd.choice(CFOPS), 'NCM': rnd.choice(ncms), 'qCom': rnd.randint(1, 10),
+                         'vProd': round(rnd.uniform(1, 1000), 2), 'uCom': 'UN'},
+            } for j in range(itens_por_nf)],
+        })
+    return nfs
+
+
+def carregar_registros(args):
+    """ Registros de NF do benchmark: arquivo de respostas (faixa de datas) ou sintéticos. """
+    if args.get('arquivo'):
+        from omie_arquivo import ArquivoRespostas
+        return ArquivoRespostas(args['arquivo']).ler('nfCadastro', args.get('de'), args.get('ate'))
+    return gerar_notas_fiscais(args['sinteticas'])
+
+
+def medir_variante(variante, args):
+    """ Executa a variante em um processo novo. Saída: dict com linhas, picos de memória (bytes / KB de RSS) e tempo (s). """
+    parametros = dict(args, metodo = VARIANTES[variante])
+    proc = subprocess.run([sys.executable, '-c', CODIGO, json.dumps(parametros)], capture_output = True, text = True)
+    if proc.returncode != 0:
+        print(f'{variante}: erro\n{proc.stderr.strip().splitlines()[-1]}')
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Pico de memória das transformações de NF')
+    parser.add_argument('--arquivo', default = None)
+    parser.add_argument('--de', default = None)
+    parser.add_argument('--ate', default = None)
+    parser.add_argument('--sinteticas', type = int, default = 50000)
+    parser.add_argument('--warehouse', default = None)
+    args = vars(parser.parse_args())
+
+    resultados = {}
+    for variante in VARIANTES:
+        r = medir_variante(variante, args)
+        if r is not None:
+            resultados[variante] = r
+            pico = (r['pico_python'] + r['pico_arrow']) / 2**20
+            print(f"{variante:<8} linhas: {r['linhas']:>9} | pico: {pico:9.1f} MB | RSS: +{r['rss_kb']/1024:9.1f} MB | tempo: {r['tempo_s']:7.2f} s")
+    if len(resultados) == 2:
+        pico = {v: r['pico_python'] + r['pico_arrow'] for v, r in resultados.items()}
+        print(f"Redução do pico: {pico['pandas'] / max(pico['arrow'], 1):.1f}x")
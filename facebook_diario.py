@@ -0,0 +1,136 @@
+"""
+Agregação diária dos dados do Facebook Ads direto no BigQuery, com cache local.
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-02-10
+
+A agregação (filtro de impressões, soma de custo/cliques/impressões e média do CPM)
+é feita no warehouse, de forma que apenas uma linha por dia é transferida.
+Os dias já agregados ficam salvos em um arquivo parquet local, e apenas as datas
+que faltam no cache são consultadas no BigQuery. Os últimos JANELA_RECENTE dias são
+sempre consultados novamente, pois o Facebook ainda ajusta as métricas (conversões
+atribuídas, gasto) de dias já fechados.
+
+A tabela de origem é a mesma lida por GoogleBigQuery.obter_dados_facebook() (integração
+Stitch) e deve ser informada em FACEBOOK_ADS_TABELA (ex.: dataset.ads_insights) ou no
+argumento tabela; sem ela, obter_facebook_diario levanta ValueError. Cada sequência contínua
+de dias faltantes é consultada separadamente, sem reler os dias do cache entre elas.
+"""
+
+import os
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+# Tabela de origem dos dados de anúncios do Facebook (integração Stitch), para a agregação no BigQuery.
+TABELA_FACEBOOK = os.environ.get('FACEBOOK_ADS_TABELA')
+CACHE_PATH = os.path.join('cache', 'facebook_diario.parquet')
+# Dias recentes consultados novamente a cada execução (janela de atribuição do Facebook).
+JANELA_RECENTE = 28
+
+QUERY_FACEBOOK_DIARIO = """
+    select
+        date(date_start) date_start,
+        sum(impressions) impressions,
+        sum(inline_clicks) clicks,
+        sum(spend) cost,
+        avg(spend/impressions*1000) cpm_avg
+    from {tabela}
+    where impressions >= 1
+        and date(date_start) between @data_inicio and @data_fim
+    group by 1
+    order by 1
+"""
+
+COLUNAS = ['impressions', 'clicks', 'cost', 'cpm_avg']
+
+
+def _para_data(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return datetime.strptime(valor, '%Y-%m-%d').date()
+
+
+def consultar_facebook_diario(client, data_inicio, data_fim, tabela):
+    """
+    Consulta a agregação diária do Facebook no BigQuery para um intervalo de datas.
+    Entradas:
+        client: google.cloud.bigquery.Client
+        data_inicio, data_fim (str YYYY-MM-DD ou date): intervalo fechado de datas.
+        tabela (str): tabela de anúncios do Facebook (ver FACEBOOK_ADS_TABELA).
+    Saída: Pandas DataFrame indexado por date_start, com uma linha por dia.
+    """
+    from google.cloud import bigquery
+
+    job_config = bigquery.QueryJobConfig(query_parameters = [
+        bigquery.ScalarQueryParameter('data_inicio', 'DATE', _para_data(data_inicio)),
+        bigquery.ScalarQueryParameter('data_fim', 'DATE', _para_data(data_fim)),
+    ])
+    df = client.query(QUERY_FACEBOOK_DIARIO.format(tabela = tabela), job_config = job_config).to_dataframe()
+    df['date_start'] = pd.to_datetime(df['date_start'])
+    return df.set_index('date_start')[COLUNAS]
+
+
+def _intervalos(datas):
+    """ Divide datas diárias ordenadas em intervalos contínuos. Saída: lista de tuplas (inicio, fim). """
+    intervalos = []
+    for data in datas:
+        if intervalos and data - intervalos[-1][1] == pd.Timedelta(days = 1):
+            intervalos[-1] = (intervalos[-1][0], data)
+        else:
+            intervalos.append((data, data))
+    return intervalos
+
+
+def obter_facebook_diario(client, data_inicio, data_fim = None, cache_path = CACHE_PATH, tabela = TABELA_FACEBOOK,
+                          janela_recente = JANELA_RECENTE):
+    """
+    Retorna a agregação diária do Facebook, consultando apenas as datas ausentes no cache e os
+    últimos janela_recente dias (que ainda podem mudar). O dia corrente nunca é salvo no cache.
+    Entradas:
+        client: google.cloud.bigquery.Client
+        data_inicio, data_fim (str YYYY-MM-DD ou date): intervalo fechado. data_fim padrão é hoje.
+        cache_path (str): arquivo parquet com os dias já agregados.
+        tabela (str): tabela de anúncios do Facebook (ver FACEBOOK_ADS_TABELA). Obrigatória.
+        janela_recente (int): dias anteriores a hoje que são sempre consultados novamente.
+    Saída: Pandas DataFrame indexado por date_start com as colunas impressions, clicks, cost e cpm_avg.
+    """
+    if not tabela:
+        raise ValueError('Informe a tabela de anúncios do Facebook (FACEBOOK_ADS_TABELA ou argumento tabela), '
+                         'a mesma lida por GoogleBigQuery.obter_dados_facebook()')
+    hoje = date.today()
+    data_inicio = _para_data(data_inicio)
+    data_fim = _para_data(data_fim) if data_fim is not None else hoje
+
+    if os.path.exists(cache_path):
+        cache = pd.read_parquet(cache_path)
+    else:
+        cache = pd.DataFrame(columns = COLUNAS, index = pd.DatetimeIndex([], name = 'date_start'))
+
+    # Datas solicitadas que ainda não constam no cache, mais os dias recentes. Dias sem anúncios
+    # também são registrados no cache (com zeros) para não serem consultados novamente.
+    datas = pd.date_range(data_inicio, data_fim, freq = 'D')
+    recentes = datas[datas >= pd.Timestamp(hoje - timedelta(days = janela_recente))]
+    faltantes = datas.difference(cache.index).union(recentes)
+
+    if len(faltantes) > 0:
+        intervalos = _intervalos(faltantes)
+        print(f'Facebook: consultando {len(faltantes)} dias ({len(recentes)} recentes) em {len(intervalos)} intervalos')
+        novos = pd.concat([consultar_facebook_diario(client, inicio, fim, tabela) for inicio, fim in intervalos])
+        novos = novos.reindex(faltantes)
+        novos[['impressions', 'clicks', 'cost']] = novos[['impressions', 'clicks', 'cost']].fillna(0)
+
+        fechados = novos[novos.index < pd.Timestamp(hoje)]
+        if len(fechados) > 0:
+            # Dias recentes já no cache são substituídos pela nova consulta.
+            cache = pd.concat([cache.drop(cache.index.intersection(fechados.index)), fechados]).sort_index()
+            os.makedirs(os.path.dirname(cache_path) or '.', exist_ok = True)
+            cache.to_parquet(cache_path)
+        resultado = pd.concat([cache, novos[novos.index >= pd.Timestamp(hoje)]])
+    else:
+        resultado = cache
+
+    resultado = resultado.loc[(resultado.index >= pd.Timestamp(data_inicio)) & (resultado.index <= pd.Timestamp(data_fim))]
+    return resultado[resultado['impressions'] > 0].astype('float64')
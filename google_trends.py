@@ -1,134 +1,125 @@
-# connect to google 
+# connect to google
 
-from pytrends.request import TrendReq
 import numpy as np
 import pandas as pd
 import sys
 import os
-import matplotlib.pyplot as plt
 
 sys.path.append(os.path.dirname(os.getcwd()))
-from shared.src import bigquery
+import facebook_diario
+from trends_feature_store import FeatureStore
 
-bq = bigquery.GoogleBigQuery(os.path.join(os.path.dirname(os.getcwd()), "evi-stitch-3e0baed4ba0a.json"))
-facebook = bq.obter_dados_facebook()
+ecommerce_kw = ["mercado livre", "magazine luiza", "OLX", "shopee", "belezanaweb"] # list of keywords to get data
+beauty_kw = ["boticario", "natura", "avon", "sallve"] # list of keywords to get data
+moment_kw = ["skincare", "sérum", "creme rosto", "hialurônico"] # list of keywords to get data
 
-facebook = facebook[facebook['impressions'] >= 1]
+# Clientes criados apenas no primeiro uso: importar o módulo não autentica no BigQuery nem no Google Trends.
+_bq = None
+_pytrends = None
 
-facebook['cpm'] = facebook['spend']/facebook['impressions']*1000
-pytrends = TrendReq(hl='pt-BR', tz=180) 
 
+def get_bq():
+    global _bq
+    if _bq is None:
+        from shared.src import bigquery
+        _bq = bigquery.GoogleBigQuery(os.path.join(os.path.dirname(os.getcwd()), "evi-stitch-3e0baed4ba0a.json"))
+    return _bq
+
+
+def get_pytrends():
+    global _pytrends
+    if _pytrends is None:
+        from pytrends.request import TrendReq
+        _pytrends = TrendReq(hl='pt-BR', tz=180)
+    return _pytrends
 
 
 def get_trends(kw_list, name_avg = 'avg'):
-        
-    pytrends.build_payload(kw_list, cat=0, timeframe='today 5-y', geo = 'BR') 
+    pytrends = get_pytrends()
+    pytrends.build_payload(kw_list, cat=0, timeframe='today 5-y', geo = 'BR')
 
     #1 Interest over Time
-    data = pytrends.interest_over_time() 
+    data = pytrends.interest_over_time()
 
     scale_data = data / data.mean()
     scale_data = scale_data.drop('isPartial', axis = 1)
     scale_data[name_avg] = np.mean(scale_data, axis = 1)
-    scale_data = scale_data[scale_data.index > '2021-01-01']
     # scale_data.reset_index(inplace=True)
     # scale_data['date'] = pd.to_datetime(scale_data['date']).dt.date
     return scale_data
 
-ecommerce_kw = ["mercado livre", "magazine luiza", "OLX", "shopee", "belezanaweb"] # list of keywords to get data 
-ecom_data = get_trends(ecommerce_kw, 'ecom_avg'); ecom_data
-# ecom_data.plot()
-# plt.show()
-
-beauty_kw = ["boticario", "natura", "avon", "sallve"] # list of keywords to get data 
-beauty_data = get_trends(beauty_kw, 'beauty_avg')
-# beauty_data.plot()
-# plt.show()
-
-moment_kw = ["skincare", "sérum", "creme rosto", "hialurônico"] # list of keywords to get data 
-moment_data = get_trends(moment_kw, 'moment_avg')
-# moment_data.plot()
-# plt.show()
-
-
-####
 
+def get_facebook():
+    # Agregação diária feita no BigQuery; apenas os dias ausentes no cache local são consultados.
+    fb = facebook_diario.obter_facebook_diario(get_bq().client, '2020-01-01')
+    fb['cpm_mean'] = fb['cost']/fb['impressions']*1000
+    fb['cpm_mean_mean'] = fb['cpm_mean']/np.mean(fb['cpm_mean'])
+    fb['cpm_avg_mean'] = fb['cpm_avg']/np.mean(fb['cpm_avg'])
+    return fb
 
-fb = facebook.groupby('date_start').agg(
-    impressions = pd.NamedAgg(column = 'impressions', aggfunc = sum),
-    clicks = pd.NamedAgg(column = 'inline_clicks', aggfunc = sum),
-    cost = pd.NamedAgg(column = 'spend', aggfunc = sum),
-    cpm_avg = pd.NamedAgg(column = 'cpm', aggfunc = np.mean)
-)
 
-fb['cpm_mean'] = fb['cost']/fb['impressions']*1000
-fb['cpm_mean_mean'] = fb['cpm_mean']/np.mean(fb['cpm_mean'])
-fb['cpm_avg_mean'] = fb['cpm_avg']/np.mean(fb['cpm_avg'])
-fb.index = pd.to_datetime(fb.index)
-# fb.index.name = 'date'
-# fb.reset_index(inplace=True)
-
-# fb2 = fb.merge(ecom_data, on = 'date').merge(beauty_data, on = 'date').merge(moment_data, on = 'date')
-
-# fb2 = fb2.loc[:,['date', 'cpm_mean_mean', 'cpm_avg_mean','avg_x', 'avg_y', 'avg']]
-
-# fb2['avg_of_avgs'] = fb2.loc[:,['avg', 'avg_x','avg_y']].mean(axis = 1)
-
-# fb2['avg_of_avgs'] = fb2['avg']*0.1 + fb2['avg_x']*-0.2 + fb2['avg_y']*0.5
-# fb2['avg_of_avgs'] = fb2['avg_of_avgs']/np.mean(fb2['avg_of_avgs'])
-# fb2.corr()
+def calc_residuals(avg_of_avgs, cpm_avg_mean):
+    residuals = avg_of_avgs - cpm_avg_mean
+    res = np.sum(residuals[residuals > 0]**2)
+    return(res)
 
-# fb2.loc[:,['cpm_mean_mean','avg_of_avgs', 'cpm_avg_mean']].plot()
-# plt.show()
 
-def calc_residuals(result):
-    residuals = (result['avg_of_avgs']-result['cpm_avg_mean'])
-    res = sum((residuals[residuals > 0])**2)
-    return(res)
+def build_store(fb, ecom_data, beauty_data, moment_data):
+    # Séries alinhadas no mesmo índice diário (a partir de 2021-01-02), com os trends já interpolados.
+    store = FeatureStore('2021-01-02')
+    store.adicionar('facebook', fb[['cpm_mean_mean', 'cpm_avg_mean']], interpolar = False)
+    store.adicionar('ecom', ecom_data[['ecom_avg']])
+    store.adicionar('beauty', beauty_data[['beauty_avg']])
+    store.adicionar('moment', moment_data[['moment_avg']])
+    return store
 
-result = pd.concat([fb[fb.index > '2021-01-01'], ecom_data], axis=1)
-result = pd.concat([result, beauty_data], axis=1)
-result = pd.concat([result, moment_data], axis=1)
 
-result.loc[:,['ecom_avg', 'beauty_avg','moment_avg']] = result.loc[:,['ecom_avg', 'beauty_avg','moment_avg']].interpolate(method='linear')
-result['avg_of_avgs'] = result['ecom_avg']*-0.34 + result['beauty_avg']*0.87 + result['moment_avg']*0.21
-result['avg_of_avgs'] = result['avg_of_avgs']/np.mean(result['avg_of_avgs'])
-# result['avg_of_avgs'] = (result['avg_of_avgs'] - 1)*1 + 1
-# result.loc[:,['cpm_mean_mean', 'cpm_avg_mean','ecom_avg', 'beauty_avg','moment_avg', 'avg_of_avgs']].corr()
-calc_residuals(result)
+def grid_search(store, grid = np.arange(-1, 1.25, 0.26)):
+    # Grid de pesos avaliado de uma vez: cada linha de `pesos` gera uma combinação dos três trends.
+    cpm_avg_mean = store.coluna('cpm_avg_mean')
+    trends = store.matriz(['ecom_avg', 'beauty_avg', 'moment_avg'])
+    pesos = np.array(np.meshgrid(grid, grid, grid, indexing = 'ij')).reshape(3, -1).T
+    combinacoes = pesos @ trends
+    combinacoes = combinacoes/np.nanmean(combinacoes, axis = 1, keepdims = True)
+    residuos = combinacoes - cpm_avg_mean
+    residuos = np.where(residuos > 0, residuos, 0)
+    res = pd.DataFrame(pesos, columns = ['w1','w2','w3'])
+    res['residuals'] = np.nansum(residuos**2, axis = 1)
+    return res
 
-result.loc[:,['cpm_avg_mean', 'avg_of_avgs']].plot()
-plt.show()
 
+def main():
+    import matplotlib.pyplot as plt
 
-res = pd.DataFrame(columns = ['w1','w2','w3','residuals'])
-for x1 in np.arange(-1, 1.25, 0.26):
-    for x2 in np.arange(-1, 1.25, 0.26):
-        for x3 in np.arange(-1, 1.25, 0.26):
-            result.loc[:,['ecom_avg', 'beauty_avg','moment_avg']] = result.loc[:,['ecom_avg', 'beauty_avg','moment_avg']].interpolate(method='linear')
-            result['avg_of_avgs'] = result['ecom_avg']*x1 + result['beauty_avg']*x2 + result['moment_avg']*x3
-            result['avg_of_avgs'] = result['avg_of_avgs']/np.mean(result['avg_of_avgs'])
-            # result['avg_of_avgs'] = (result['avg_of_avgs'] - 1)*1 + 1
-            # result.loc[:,['cpm_mean_mean', 'cpm_avg_mean','ecom_avg', 'beauty_avg','moment_avg', 'avg_of_avgs']].corr()
-            res = res.append({'w1':x1, 'w2':x2, 'w3':x3, 'residuals':calc_residuals(result)}, ignore_index=True)
-            
-x1 = res['w3']
-y = np.log(res['residuals'])
+    fb = get_facebook()
+    ecom_data = get_trends(ecommerce_kw, 'ecom_avg')
+    beauty_data = get_trends(beauty_kw, 'beauty_avg')
+    moment_data = get_trends(moment_kw, 'moment_avg')
 
-# create the plot
-plt.plot(x1, y, 'o')
-plt.show()
+    store = build_store(fb, ecom_data, beauty_data, moment_data)
+    cpm_avg_mean = store.coluna('cpm_avg_mean')
+    trends = store.matriz(['ecom_avg', 'beauty_avg', 'moment_avg'])
 
-res[res['residuals'] == res['residuals'].min()]
+    avg_of_avgs = np.array([-0.34, 0.87, 0.21]) @ trends
+    avg_of_avgs = avg_of_avgs/np.nanmean(avg_of_avgs)
+    print(calc_residuals(avg_of_avgs, cpm_avg_mean))
 
+    result = pd.DataFrame({'cpm_avg_mean': cpm_avg_mean, 'avg_of_avgs': avg_of_avgs}, index = store.datas)
+    result.plot()
+    plt.show()
 
-residuals = (result['avg_of_avgs']-result['cpm_avg_mean'])
+    res = grid_search(store)
 
-result['res'] = residuals
+    x1 = res['w3']
+    y = np.log(res['residuals'])
 
-sum((residuals[residuals > 0])**2)
+    # create the plot
+    plt.plot(x1, y, 'o')
+    plt.show()
 
+    print(res[res['residuals'] == res['residuals'].min()])
+    return result, res
 
-residuals.isnull()
 
-np.nan
+if __name__ == '__main__':
+    main()
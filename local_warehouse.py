@@ -0,0 +1,243 @@
+"""
+Backend local (DuckDB) com a mesma interface do GoogleBigQuery
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-10
+
+Permite executar e medir as rotinas de integração sem acesso à nuvem. Cada dataset do
+BigQuery vira um schema no arquivo DuckDB, e as consultas são traduzidas do dialeto do
+BigQuery para o do DuckDB nos pontos usados pelos módulos (split()[offset()],
+parse_date, cast para STRING/INT64/FLOAT64, select * except, date_add, crases).
+
+Uso:
+    from local_warehouse import LocalBigQuery
+    GBQ = LocalBigQuery('warehouse.duckdb')
+    with GBQ.instalar_to_gbq():  # DataFrame.to_gbq grava no DuckDB dentro do bloco
+        OMIE = omie(key, secret, gbq = GBQ)
+        OMIE.atualizacao_diaria_notas_fiscais()
+"""
+
+import re
+from contextlib import contextmanager
+
+import duckdb
+import pandas as pd
+
+# Tipos do DuckDB -> tipos do BigQuery (para get_table().schema).
+_TIPOS_BQ = {
+    'VARCHAR': 'STRING', 'BIGINT': 'INT64', 'INTEGER': 'INT64', 'SMALLINT': 'INT64', 'TINYINT': 'INT64',
+    'HUGEINT': 'INT64', 'DOUBLE': 'FLOAT64', 'FLOAT': 'FLOAT64', 'BOOLEAN': 'BOOL', 'DATE': 'DATE',
+    'TIMESTAMP': 'DATETIME', 'TIMESTAMP WITH TIME ZONE': 'TIMESTAMP',
+}
+
+_TRADUCOES = [
+    # split(x, '/')[offset(n)] -> str_split(x, '/')[n + 1]  (listas do DuckDB começam em 1)
+    (re.compile(r"split\(([^,()]+),\s*('[^']*')\)\[offset\((\d+)\)\]", re.I),
+        lambda m: f"str_split({m.group(1)}, {m.group(2)})[{int(m.group(3)) + 1}]"),
+    (re.compile(r"parse_date\(\s*('[^']*')\s*,\s*([^()]+?)\)", re.I),
+        lambda m: f"strptime({m.group(2)}, {m.group(1)})::DATE"),
+    (re.compile(r"date_add\((.+?),\s*interval\s+(-?\d+)\s+(\w+)\)", re.I),
+        lambda m: f"({m.group(1)} + interval ({m.group(2)}) {m.group(3)})"),
+    (re.compile(r"\bcurrent_date\(\)", re.I), lambda m: 'current_date'),
+    (re.compile(r"\bin\s+unnest\((@\w+)\)", re.I), lambda m: f"in (select unnest({m.group(1)}))"),
+    (re.compile(r"\*\s*except\s*\(", re.I), lambda m: '* exclude ('),
+    (re.compile(r"\bas\s+STRING\b", re.I), lambda m: 'as VARCHAR'),
+    (re.compile(r"\bas\s+INT64\b", re.I), lambda m: 'as BIGINT'),
+    (re.compile(r"\bas\s+FLOAT64\b", re.I), lambda m: 'as DOUBLE'),
+    (re.compile(r"`"), lambda m: '"'),
+]
+
+
+def traduzir_sql(query):
+    """ Traduz as construções do dialeto do BigQuery usadas nos módulos para o DuckDB. """
+    for padrao, substituicao in _TRADUCOES:
+        query = padrao.sub(substituicao, query)
+    return query
+
+
+def _dividir_comandos(query):
+    # Divide um script em comandos por ';', ignorando ';' dentro de strings.
+    comandos, atual, aspas = [], [], None
+    for c in query:
+        if aspas:
+            if c == aspas:
+                aspas = None
+        elif c in ("'", '"'):
+            aspas = c
+        elif c == ';':
+            comandos.append(''.join(atual))
+            atual = []
+            continue
+        atual.append(c)
+    comandos.append(''.join(atual))
+    return [comando for comando in comandos if comando.strip()]
+
+
+def _parametros(comando):
+    # Troca @nome por $nome (parâmetro do DuckDB) fora de strings; devolve o comando e os nomes usados.
+    partes, nomes, aspas, i = [], [], None, 0
+    while i < len(comando):
+        c = comando[i]
+        if aspas:
+            if c == aspas:
+                aspas = None
+        elif c in ("'", '"'):
+            aspas = c
+        elif c == '@':
+            m = re.match(r'@(\w+)', comando[i:])
+            if m:
+                nomes.append(m.group(1))
+                partes.append('$' + m.group(1))
+                i += len(m.group(0))
+                continue
+        partes.append(c)
+        i += 1
+    return ''.join(partes), nomes
+
+
+class _Campo:
+    def __init__(self, name, field_type):
+        self.name = name
+        self.field_type = field_type
+
+
+class _Tabela:
+    def __init__(self, schema):
+        self.schema = schema
+        self.num_rows = None
+
+
+class _Job:
+    """ Equivalente mínimo de um QueryJob/LoadJob do BigQuery. """
+
+    def __init__(self, resultado = None):
+        self._resultado = resultado
+        self.total_bytes_processed = 0
+        self.slot_millis = 0
+        self.state = 'DONE'
+        self.error_result = None
+
+    def result(self):
+        return self
+
+    def done(self):
+        return True
+
+    def to_dataframe(self):
+        return self._resultado if self._resultado is not None else pd.DataFrame()
+
+
+class _Cliente:
+    """ Subconjunto de google.cloud.bigquery.Client usado pelos módulos. """
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.project = backend.project
+
+    def query(self, query, job_config = None):
+        params = {}
+        if job_config is not None:
+            for p in getattr(job_config, 'query_parameters', None) or []:
+                # ScalarQueryParameter tem .value; ArrayQueryParameter, .values.
+                params[p.name] = p.values if hasattr(p, 'values') else p.value
+        return _Job(self._backend.executar_query(query, params))
+
+    def get_table(self, tabela_id):
+        tabela_id = self._backend._nome(tabela_id)
+        schema, tabela = tabela_id.split('.')
+        colunas = self._backend.con.execute(
+            'select column_name, data_type from information_schema.columns '
+            'where table_schema = ? and table_name = ? order by ordinal_position', [schema, tabela]).fetchall()
+        if not colunas:
+            raise ValueError(f'Tabela {tabela_id} não encontrada')
+        return _Tabela([_Campo(nome, _TIPOS_BQ.get(tipo, 'STRING')) for nome, tipo in colunas])
+
+    def list_datasets(self):
+        return [r[0] for r in self._backend.con.execute(
+            "select schema_name from information_schema.schemata where catalog_name = current_database()").fetchall()]
+
+    def load_table_from_file(self, arquivo, tabela_id, job_config = None):
+        import pyarrow.parquet as pq
+
+        substituir = job_config is not None and getattr(job_config, 'write_disposition', None) == 'WRITE_TRUNCATE'
+        self._backend._gravar(pq.read_table(arquivo), tabela_id, substituir)
+        return _Job()
+
+
+class LocalBigQuery:
+    """
+    Backend local com a interface de modulos.integracoes.storage.google_bigquery.GoogleBigQuery:
+    executar_query, dataframe_to_bq e .client.
+    """
+
+    def __init__(self, path = 'warehouse.duckdb', project = 'evi-stitch'):
+        self.path = path
+        self.project = project
+        self.con = duckdb.connect(path)
+        self.client = _Cliente(self)
+
+    def _nome(self, tabela_id):
+        # Aceita 'projeto.dataset.tabela' e 'dataset.tabela'.
+        partes = tabela_id.replace('`', '').split('.')
+        return '.'.join(partes[-2:])
+
+    def _gravar(self, dados, tabela_id, substituir):
+        schema, tabela = self._nome(tabela_id).split('.')
+        self.con.execute(f'create schema if not exists "{schema}"')
+        self.con.register('_dados_carga', dados)
+        try:
+            existe = self.con.execute(
+                'select count(*) from information_schema.tables where table_schema = ? and table_name = ?',
+                [schema, tabela]).fetchone()[0]
+            if substituir or not existe:
+                self.con.execute(f'create or replace table "{schema}"."{tabela}" as select * from _dados_carga')
+            else:
+                self.con.execute(f'insert into "{schema}"."{tabela}" by name select * from _dados_carga')
+        finally:
+            self.con.unregister('_dados_carga')
+
+    def executar_query(self, query, params = None):
+        """
+        Executa uma consulta (ou script com vários comandos separados por ';') no dialeto do BigQuery.
+        Parâmetros @nome (fora de strings) são substituídos por $nome do DuckDB.
+        Saída: Pandas DataFrame com o resultado do último comando.
+        """
+        resultado = None
+        for comando in _dividir_comandos(traduzir_sql(query)):
+            comando, nomes = _parametros(comando)
+            cursor = self.con.execute(comando, {n: params[n] for n in nomes} if nomes else None)
+            if cursor.description is not None:
+                resultado = cursor.df()
+        return resultado if resultado is not None else pd.DataFrame()
+
+    def dataframe_to_bq(self, dataframe, dataset, tabela):
+        """ Substitui a tabela dataset.tabela pelo DataFrame. """
+        self._gravar(dataframe, f'{dataset}.{tabela}', substituir = True)
+        return f'Adicionar {dataset}.{tabela} ao BQ: OK'
+
+    def to_gbq(self, dataframe, destination_table, project_id = None, chunksize = None, if_exists = 'fail', **kwargs):
+        """ Mesma assinatura de pandas.DataFrame.to_gbq, gravando no DuckDB. """
+        schema, tabela = self._nome(destination_table).split('.')
+        existe = self.con.execute(
+            'select count(*) from information_schema.tables where table_schema = ? and table_name = ?',
+            [schema, tabela]).fetchone()[0]
+        if existe and if_exists == 'fail':
+            raise ValueError(f'Tabela {destination_table} já existe')
+        self._gravar(dataframe, destination_table, substituir = if_exists == 'replace')
+
+    @contextmanager
+    def instalar_to_gbq(self):
+        """
+        Faz DataFrame.to_gbq gravar neste backend dentro do bloco with (os módulos usam df.to_gbq
+        diretamente); ao sair, o DataFrame.to_gbq original é restaurado.
+        """
+        backend = self
+        original = pd.DataFrame.__dict__.get('to_gbq')
+        pd.DataFrame.to_gbq = lambda df, destination_table, *args, **kwargs: backend.to_gbq(df, destination_table, *args, **kwargs)
+        try:
+            yield self
+        finally:
+            if original is None:
+                del pd.DataFrame.to_gbq
+            else:
+                pd.DataFrame.to_gbq = original
@@ -0,0 +1,87 @@
+"""
+Content-addressed results cache for the NN architecture sweeps.
+Created by: Danilo Steckelberg
+Created for: IBM Deep Learning course final project (nn_optimization / nn_optimization_reg notebooks)
+Created on: 2023-02-20
+
+Each trial is identified by a hash of everything that determines its outcome:
+architecture, activations, optimizer, loss, epochs, seed and a fingerprint of
+the data. Metrics and weights are written as soon as a trial finishes, so an
+interrupted sweep (or a wider search space) only trains the trials not yet cached.
+
+Layout: <root>/<key[:2]>/<key>/metrics.json and weights.npz
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+def dataset_fingerprint(*arrays) -> str:
+    """ sha256 of the shape, dtype and contents of the given arrays. """
+    h = hashlib.sha256()
+    for a in arrays:
+        a = np.ascontiguousarray(np.asarray(a))
+        h.update(f'{a.shape}|{a.dtype.str}|'.encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def trial_key(spec: dict, optimizer: str, loss: str, epochs: int, seed: int, dataset: str) -> str:
+    """ sha256 of the canonical JSON of everything that defines a trial. """
+    payload = {
+        'layers': list(spec['layers']),
+        'input_shape': list(spec['input_shape']),
+        'hidden_layer_activation': spec['hidden_layer_activation'],
+        'num_nodes_at_output': spec['num_nodes_at_output'],
+        'output_layer_activation': spec['output_layer_activation'],
+        'optimizer': optimizer,
+        'loss': loss,
+        'epochs': epochs,
+        'seed': seed,
+        'dataset': dataset,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys = True).encode()).hexdigest()
+
+
+class TrialCache:
+
+    def __init__(self, root: str = 'sweep_cache'):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self._path(key), 'metrics.json'))
+
+    def get(self, key: str) -> dict:
+        """ Metrics row of a cached trial, or None. """
+        try:
+            with open(os.path.join(self._path(key), 'metrics.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load_weights(self, key: str) -> list:
+        """ Weights of a cached trial, in the order of model.get_weights(). """
+        with np.load(os.path.join(self._path(key), 'weights.npz')) as npz:
+            return [npz[f'w{i}'] for i in range(len(npz.files))]
+
+    def put(self, key: str, metrics: dict, weights: list = None):
+        """
+        Stores a finished trial. Weights are written before metrics.json, and each file is
+        written to a temporary name and renamed, so a trial is only visible once complete.
+        """
+        path = self._path(key)
+        os.makedirs(path, exist_ok = True)
+        if weights is not None:
+            with tempfile.NamedTemporaryFile(dir = path, suffix = '.npz', delete = False) as f:
+                np.savez(f, **{f'w{i}': w for i, w in enumerate(weights)})
+            os.replace(f.name, os.path.join(path, 'weights.npz'))
+        with tempfile.NamedTemporaryFile('w', dir = path, suffix = '.json', delete = False) as f:
+            json.dump({k: (v.item() if isinstance(v, np.generic) else v) for k, v in metrics.items()}, f)
+        os.replace(f.name, os.path.join(path, 'metrics.json'))
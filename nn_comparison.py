@@ -0,0 +1,237 @@
+"""
+Cross-validated comparison of the ROAS regression models of nn_models.ipynb.
+Created by: Danilo Steckelberg
+Created for: IBM Deep Learning course final project (nn_models notebook)
+Created on: 2023-02-27
+
+Every candidate (the Random Forest baseline and the four Keras architectures)
+is evaluated with k-fold cross-validation instead of a single split. The forest
+is trained first with n_jobs=-1 (all cores); the Keras (model, fold) jobs then
+run across a process pool with pinned TF threads. All out-of-fold predictions
+are kept in one matrix (models x samples), saved to disk, and every metric,
+table and chart is computed from it with vectorized NumPy operations.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import nn_sweep
+from nn_sweep import make_executor, iter_completed
+from nn_dataset import SOURCE_PATH
+
+
+def _model_1(input_vars):
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense
+    from tensorflow.keras.optimizers import RMSprop
+
+    model = Sequential()
+    model.add(Dense(12, input_shape = (input_vars,), activation = 'tanh'))
+    model.add(Dense(8, activation = 'relu'))
+    model.add(Dense(3, activation = 'relu'))
+    model.add(Dense(3, activation = 'sigmoid'))
+    model.add(Dense(1, activation = 'linear'))
+    model.compile(RMSprop(learning_rate=0.001), "mean_absolute_error", metrics=["mean_absolute_error"])
+    return model, 100
+
+
+def _model_2(input_vars):
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense
+    from tensorflow.keras.optimizers import RMSprop
+
+    model = Sequential()
+    model.add(Dense(12, input_shape = (input_vars,), activation = 'tanh'))
+    model.add(Dense(16, activation = 'relu'))
+    model.add(Dense(8, activation = 'relu'))
+    model.add(Dense(4, activation = 'sigmoid'))
+    model.add(Dense(1, activation = 'linear'))
+    model.compile(RMSprop(learning_rate=0.001), "mean_absolute_error", metrics=["mean_absolute_error"])
+    return model, 50
+
+
+def _model_3(input_vars):
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense
+    from tensorflow.keras.optimizers import Adam
+
+    model = Sequential()
+    model.add(Dense(120, input_shape = (input_vars,), activation = 'elu'))
+    model.add(Dense(32, activation = 'tanh'))
+    model.add(Dense(32, activation = 'relu'))
+    model.add(Dense(1, activation = 'linear'))
+    model.compile(Adam(learning_rate=0.0005), "mean_squared_error", metrics=["mean_squared_error"])
+    return model, 100
+
+
+def _model_4(input_vars):
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense
+    from tensorflow.keras.optimizers import Adam
+
+    model = Sequential()
+    model.add(Dense(12, input_shape = (input_vars,), activation = 'elu'))
+    model.add(Dense(16, activation = 'tanh'))
+    model.add(Dense(16, activation = 'relu'))
+    model.add(Dense(1, activation = 'linear'))
+    model.compile(Adam(learning_rate=0.0005), "mean_squared_error", metrics=["mean_squared_error"])
+    return model, 100
+
+
+# Keras candidates of nn_models.ipynb: builder(input_vars) -> (compiled model, epochs).
+NN_MODELS = {
+    'NN 1': _model_1,
+    'NN 2': _model_2,
+    'NN 3': _model_3,
+    'NN 4': _model_4,
+}
+
+
+def _fit_predict_fold(job: tuple) -> np.array:
+    """ Trains one Keras candidate on one fold inside a worker and predicts the held-out rows. """
+    name, train_idx, test_idx = job
+    d = nn_sweep._worker_data
+    X, y = d['X_train'], d['y_train']
+    model, epochs = NN_MODELS[name](X.shape[1])
+    model.fit(X[train_idx], y[train_idx], epochs = epochs, verbose = 0)
+    return model.predict(X[test_idx], verbose = 0)[:, 0]
+
+
+def cross_validate(X: np.array,
+                   y: np.array,
+                   n_splits: int = 5,
+                   n_estimators: int = 300,
+                   n_workers: int = None,
+                   threads_per_worker: int = 1,
+                   predictions_path: str = None,
+                   seed: int = 42) -> tuple:
+    """
+    Out-of-fold predictions of every candidate.
+    Inputs:
+        X, y: full dataset (features and target yvar).
+        n_splits: number of folds of the KFold split (shuffled with seed).
+        predictions_path: .npz file where the prediction matrix and fold ids are saved.
+    Output: (names, predictions (models x samples), fold id of each sample).
+    """
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.model_selection import KFold
+
+    X = np.asarray(X, dtype = np.float32)
+    y = np.asarray(y, dtype = np.float32)
+    if n_workers is None:
+        n_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+    folds = list(KFold(n_splits = n_splits, shuffle = True, random_state = seed).split(X))
+    fold_id = np.empty(len(y), dtype = np.int16)
+    for k, (_, test_idx) in enumerate(folds):
+        fold_id[test_idx] = k
+
+    names = ['RF', *NN_MODELS]
+    predictions = np.full((len(names), len(y)), np.nan, dtype = np.float32)
+
+    # The forest already uses every core, so its folds run one after the other.
+    for k, (train_idx, test_idx) in enumerate(folds):
+        print(f'RF: fold {k + 1} of {n_splits}')
+        rf_model = RandomForestRegressor(n_estimators = n_estimators, n_jobs = -1, random_state = seed)
+        rf_model.fit(X[train_idx], y[train_idx])
+        predictions[0, test_idx] = rf_model.predict(X[test_idx])
+
+    jobs = [(name, train_idx, test_idx) for name in NN_MODELS for train_idx, test_idx in folds]
+    with make_executor(X, y, None, None, 'regression', None, n_workers, threads_per_worker, seed) as executor:
+        for (name, _, test_idx), pred, error in iter_completed(executor, _fit_predict_fold, jobs, max_pending = 2 * n_workers):
+            if error is not None:
+                print(f'{name} --> {str(error)}')
+                continue
+            print(f'{name}: fold {fold_id[test_idx[0]] + 1} of {n_splits}')
+            predictions[names.index(name), test_idx] = pred
+
+    if predictions_path is not None:
+        np.savez(predictions_path, names = np.array(names), predictions = predictions, fold_id = fold_id, y = y)
+    return names, predictions, fold_id
+
+
+def comparison_table(names: list, predictions: np.array, y: np.array, fold_id: np.array) -> pd.DataFrame:
+    """
+    MSE and MAE of each model (mean and standard deviation across folds),
+    computed from the prediction matrix without Python loops over samples.
+    """
+    errors = predictions - np.asarray(y)[None, :]
+    n_splits = fold_id.max() + 1
+    # One-hot fold membership (folds x samples) turns per-fold means into matrix products.
+    membership = (fold_id[None, :] == np.arange(n_splits)[:, None]).astype(np.float64)
+    counts = membership.sum(axis = 1)
+    fold_mse = (errors**2) @ membership.T / counts
+    fold_mae = np.abs(errors) @ membership.T / counts
+
+    return pd.DataFrame({
+        'model': names,
+        'mse': fold_mse.mean(axis = 1),
+        'mse_std': fold_mse.std(axis = 1),
+        'mae': fold_mae.mean(axis = 1),
+        'mae_std': fold_mae.std(axis = 1),
+    })
+
+
+def plot_comparison(table: pd.DataFrame, suptitle: str = 'Models comparison (cross-validated)'):
+    """ Same bar charts as the notebook, with the fold standard deviation as error bars. """
+    import matplotlib.pyplot as plt
+
+    y_pos = np.arange(len(table))
+    fig, (ax1, ax2) = plt.subplots(1, 2)
+    fig.suptitle(suptitle)
+    fig.tight_layout(pad=1.7)
+
+    for ax, metric, title, decimals in [(ax1, 'mse', 'Mean Squared Error', 4), (ax2, 'mae', 'Mean Average Error', 3)]:
+        values = table[metric].round(decimals).to_numpy()
+        ax.bar(y_pos, values, yerr = table[f'{metric}_std'], capsize = 3)
+        ax.set_title(title)
+        ax.set_ylabel(metric.upper())
+        ax.set_xticks(y_pos)
+        ax.set_xticklabels(table['model'])
+        for i in range(len(y_pos)):
+            ax.text(y_pos[i], values[i], values[i], ha = 'center', va = 'bottom')
+
+    return fig
+
+
+def plot_model_errors(obs, pred, suptitle):
+    """ Prediction vs. observation scatter and error histogram (as in nn_models.ipynb). """
+    import matplotlib.pyplot as plt
+
+    fig, (ax1, ax2) = plt.subplots(1, 2)
+    fig.suptitle(suptitle)
+    fig.tight_layout(pad=1.0)
+
+    ax1.scatter(obs, pred)
+    ax1.set_title('Prediction vs. Observations')
+    ax1.set_xlabel('Observations'); ax1.set_ylabel('Predictions')
+
+    ax2.hist(x = pred - obs, bins = 30)
+    ax2.set_title('Histogram of Errors')
+    ax2.set_xlabel('Errors'); ax2.set_ylabel('Counts')
+
+    fig.set_size_inches(7, 4.8)
+    lims = [
+        np.min([ax1.get_xlim(), ax1.get_ylim()]),
+        np.max([ax1.get_xlim(), ax1.get_ylim()]),
+    ]
+    ax1.plot(lims, lims, 'k-', alpha=0.75, zorder=0)
+    return fig
+
+
+if __name__ == '__main__':
+    dados_entrada = pd.read_csv(SOURCE_PATH)
+    X = dados_entrada.drop(['yvar'], axis = 1)
+    y = dados_entrada['yvar'].values
+
+    names, predictions, fold_id = cross_validate(X, y, predictions_path = os.path.join('output', 'cv_predictions.npz'))
+    table = comparison_table(names, predictions, y, fold_id)
+    print(table)
+
+    fig = plot_comparison(table)
+    fig.savefig(os.path.join('output', 'models_comparison_cv.png'), dpi=100)
+    for name, pred in zip(names, predictions):
+        fig = plot_model_errors(y, pred, f'{name} (out-of-fold)')
+        fig.savefig(os.path.join('output', f'{name.lower().replace(" ", "")}_cv_errors.png'), dpi=100)
@@ -0,0 +1,129 @@
+"""
+Cached, preprocessed dataset artifact for data/nn_input.csv.
+Created by: Danilo Steckelberg
+Created for: IBM Deep Learning course final project (nn_models / nn_optimization / nn_optimization_reg notebooks)
+Created on: 2023-02-24
+
+The notebooks all read nn_input.csv and repeat the same preparation (dropna,
+target derivation, column drops and train_test_split(random_state=42)).
+prepare_dataset runs that preparation once and stores X/y train/test as float32
+.npy files plus a meta.json with the column names, in a directory named after a
+hash of the source file and of the preparation config. load_dataset opens the
+arrays memory-mapped, so several (parallel) workers share the same pages.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+SOURCE_PATH = os.path.join('data', 'nn_input.csv')
+PREPARED_DIR = os.path.join('data', 'prepared')
+
+# Preparation of each notebook.
+PREP_CONFIGS = {
+    # nn_models.ipynb
+    'models': {
+        'dropna': False,
+        'target': 'yvar',
+        'threshold': None,
+        'drop_columns': ['yvar'],
+        'test_size': 0.25,
+        'random_state': 42,
+    },
+    # nn_optimization.ipynb
+    'classification': {
+        'dropna': True,
+        'target': 'yvar',
+        'threshold': 0.3,
+        'drop_columns': ['views_5s_x_days', 'yvar', 'publico_cat_AdvShp', 'publico_cat_Amplo',
+            'publico_cat_erro_taxonomia', 'publico_cat_Interesses',
+            'publico_cat_Reeng', 'publico_cat_Rmkt', 'formato_ad_Carr',
+            'formato_ad_erro_taxonomia', 'formato_ad_Est', 'formato_ad_Gif'],
+        'test_size': 0.2,
+        'random_state': 42,
+    },
+    # nn_optimization_reg.ipynb
+    'regression': {
+        'dropna': True,
+        'target': 'yvar',
+        'threshold': None,
+        'drop_columns': ['views_5s_x_days', 'yvar'],
+        'test_size': 0.2,
+        'random_state': 42,
+    },
+}
+
+ARRAYS = ['X_train', 'X_test', 'y_train', 'y_test']
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def dataset_key(source: str, config: dict) -> str:
+    """ Hash of the source file contents and of the preparation config. """
+    payload = json.dumps({'source': _file_hash(source), 'config': config}, sort_keys = True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _prepare(source: str, config: dict) -> tuple:
+    from sklearn.model_selection import train_test_split
+
+    df = pd.read_csv(source)
+    if config['dropna']:
+        df = df.dropna()
+
+    y = df[config['target']]
+    if config['threshold'] is not None:
+        y = (y >= config['threshold']).astype(int)
+    X = df.drop(config['drop_columns'], axis = 1)
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size = config['test_size'], random_state = config['random_state'])
+    return list(X.columns), X_train, X_test, y_train, y_test
+
+
+def prepare_dataset(config = 'regression', source: str = SOURCE_PATH, prepared_dir: str = PREPARED_DIR) -> str:
+    """
+    Prepares the dataset (or reuses an existing artifact) and returns its directory.
+    Inputs:
+        config: name in PREP_CONFIGS or a config dict with the same keys.
+        source: CSV file with the model inputs.
+    Output: directory with X_train/X_test/y_train/y_test .npy files and meta.json.
+    """
+    if isinstance(config, str):
+        config = PREP_CONFIGS[config]
+    key = dataset_key(source, config)
+    path = os.path.join(prepared_dir, key)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return path
+
+    columns, X_train, X_test, y_train, y_test = _prepare(source, config)
+    os.makedirs(path, exist_ok = True)
+    for name, data in zip(ARRAYS, [X_train, X_test, y_train, y_test]):
+        np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(data.to_numpy(dtype = np.float32)))
+
+    # meta.json is written last: its presence marks a complete artifact.
+    meta = {'key': key, 'source': source, 'config': config, 'columns': columns,
+            'n_train': len(X_train), 'n_test': len(X_test)}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 2)
+    return path
+
+
+def load_dataset(path: str, mmap: bool = True) -> dict:
+    """
+    Opens a prepared dataset. With mmap=True the arrays are read-only memory maps (no copy).
+    Output: dict with X_train, X_test, y_train, y_test and meta.
+    """
+    data = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode = 'r' if mmap else None) for name in ARRAYS}
+    with open(os.path.join(path, 'meta.json')) as f:
+        data['meta'] = json.load(f)
+    return data
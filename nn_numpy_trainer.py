@@ -0,0 +1,169 @@
+"""
+Batched multi-model NumPy trainer for the small dense networks of the NN sweeps.
+Created by: Danilo Steckelberg
+Created for: IBM Deep Learning course final project (nn_optimization / nn_optimization_reg notebooks)
+Created on: 2023-02-22
+
+The sweep architectures are tiny (5-20 units per layer, one output), so training
+them one by one in Keras is dominated by graph building and per-step overhead.
+Here all architectures of the same depth are stacked into padded weight tensors
+of shape (models, inputs, outputs) and trained together with vectorized forward
+and backward passes and Adam. Padded units have their weights masked to zero, so
+each model trains exactly as if it were alone.
+
+The training setup mirrors the Keras defaults used in the notebooks: Glorot
+uniform weights, zero biases, Adam(lr=0.001), batch_size=32, shuffled epochs.
+"""
+
+import numpy as np
+import pandas as pd
+
+from nn_sweep import evaluate
+
+_ACTIVATIONS = {
+    'linear': (lambda z: z, lambda z, a: np.ones_like(a)),
+    'relu': (lambda z: np.maximum(z, 0), lambda z, a: (z > 0).astype(a.dtype)),
+    'tanh': (np.tanh, lambda z, a: 1 - a**2),
+    'sigmoid': (lambda z: 1 / (1 + np.exp(-z)), lambda z, a: a * (1 - a)),
+    'elu': (lambda z: np.where(z > 0, z, np.expm1(np.minimum(z, 0))), lambda z, a: np.where(z > 0, 1, a + 1).astype(a.dtype)),
+}
+
+
+class _ModelStack:
+    """ Padded and masked weights of a group of same-depth MLPs. """
+
+    def __init__(self, specs: list, rng: np.random.Generator, dtype = np.float32):
+        self.specs = specs
+        n_models = len(specs)
+        sizes = np.array([[s['input_shape'][-1], *s['layers'], s['num_nodes_at_output']] for s in specs])
+        max_sizes = sizes.max(axis = 0)
+
+        self.weights, self.biases, self.masks = [], [], []
+        for l in range(sizes.shape[1] - 1):
+            n_in, n_out = max_sizes[l], max_sizes[l + 1]
+            in_mask = np.arange(n_in)[None, :] < sizes[:, l][:, None]
+            out_mask = np.arange(n_out)[None, :] < sizes[:, l + 1][:, None]
+            mask = (in_mask[:, :, None] & out_mask[:, None, :]).astype(dtype)
+
+            # Glorot uniform with the real fan-in/fan-out of each model.
+            limit = np.sqrt(6 / (sizes[:, l] + sizes[:, l + 1])).astype(dtype)
+            w = rng.uniform(-1, 1, size = (n_models, n_in, n_out)).astype(dtype) * limit[:, None, None]
+            self.weights.append(w * mask)
+            self.biases.append(np.zeros((n_models, n_out), dtype = dtype))
+            self.masks.append(mask)
+
+        self.params = self.weights + self.biases
+        self._m = [np.zeros_like(p) for p in self.params]
+        self._v = [np.zeros_like(p) for p in self.params]
+        self._t = 0
+
+    def forward(self, X: np.array, hidden_activation: str, output_activation: str) -> tuple:
+        """ Returns pre-activations and activations of each layer, shape (models, batch, units). """
+        zs, acts = [], [X]
+        n_layers = len(self.weights)
+        for l, (w, b) in enumerate(zip(self.weights, self.biases)):
+            h = acts[-1]
+            if h.ndim == 2:
+                z = np.einsum('bi,mio->mbo', h, w) + b[:, None, :]
+            else:
+                z = np.matmul(h, w) + b[:, None, :]
+            act = output_activation if l == n_layers - 1 else hidden_activation
+            zs.append(z)
+            acts.append(_ACTIVATIONS[act][0](z))
+        return zs, acts
+
+    def backward(self, zs: list, acts: list, dz: np.array, hidden_activation: str) -> list:
+        """ Gradients of the weights and biases, given dLoss/dz of the output layer. """
+        grads_w, grads_b = [None] * len(self.weights), [None] * len(self.weights)
+        for l in range(len(self.weights) - 1, -1, -1):
+            h = acts[l]
+            if h.ndim == 2:
+                grads_w[l] = np.einsum('bi,mbo->mio', h, dz) * self.masks[l]
+            else:
+                grads_w[l] = np.matmul(h.transpose(0, 2, 1), dz) * self.masks[l]
+            grads_b[l] = dz.sum(axis = 1) * self.masks[l].max(axis = 1)
+            if l > 0:
+                dh = np.matmul(dz, self.weights[l].transpose(0, 2, 1))
+                dz = dh * _ACTIVATIONS[hidden_activation][1](zs[l - 1], acts[l])
+        return grads_w + grads_b
+
+    def adam_step(self, grads: list, learning_rate: float, beta_1 = 0.9, beta_2 = 0.999, epsilon = 1e-7):
+        self._t += 1
+        lr_t = learning_rate * np.sqrt(1 - beta_2**self._t) / (1 - beta_1**self._t)
+        for p, g, m, v in zip(self.params, grads, self._m, self._v):
+            m *= beta_1
+            m += (1 - beta_1) * g
+            v *= beta_2
+            v += (1 - beta_2) * g**2
+            p -= lr_t * m / (np.sqrt(v) + epsilon)
+
+
+def _train_group(specs, X_train, y_train, X_test, task, epochs, batch_size, learning_rate, rng):
+    hidden_activation = specs[0]['hidden_layer_activation']
+    output_activation = specs[0]['output_layer_activation']
+    stack = _ModelStack(specs, rng)
+
+    n = X_train.shape[0]
+    for _ in range(epochs):
+        order = rng.permutation(n)
+        for start in range(0, n, batch_size):
+            idx = order[start:start + batch_size]
+            X_b, y_b = X_train[idx], y_train[idx]
+            zs, acts = stack.forward(X_b, hidden_activation, output_activation)
+            out = acts[-1]
+            if task == 'classification':
+                # Binary cross-entropy on a sigmoid output: dL/dz = (p - y) / batch.
+                dz = (out - y_b[None, :, :]) / len(idx)
+            else:
+                # Mean squared error: dL/dout = 2 (out - y) / batch.
+                dz = 2 * (out - y_b[None, :, :]) / len(idx)
+                dz = dz * _ACTIVATIONS[output_activation][1](zs[-1], out)
+            stack.adam_step(stack.backward(zs, acts, dz, hidden_activation), learning_rate)
+
+    _, acts = stack.forward(X_test, hidden_activation, output_activation)
+    return acts[-1]
+
+
+def train_batched(specs,
+                  X_train: np.array,
+                  y_train: np.array,
+                  X_test: np.array,
+                  y_test: np.array,
+                  task: str = 'regression',
+                  epochs: int = 50,
+                  batch_size: int = 32,
+                  learning_rate: float = 0.001,
+                  models_per_group: int = 256,
+                  seed: int = 42) -> pd.DataFrame:
+    """
+    Trains all architecture specs with the batched NumPy engine.
+    Inputs:
+        specs: iterable of architecture specs, e.g. a SearchSpace (see nn_search_space).
+        task: 'regression' (MSE loss) or 'classification' (binary cross-entropy, sigmoid output).
+        models_per_group: maximum number of models stacked together; bounds peak memory.
+    Output: pandas DataFrame with the same columns as `optimize` in the notebooks.
+    """
+    rng = np.random.default_rng(seed)
+    X_train = np.asarray(X_train, dtype = np.float32)
+    X_test = np.asarray(X_test, dtype = np.float32)
+    y_train = np.asarray(y_train, dtype = np.float32).reshape(len(X_train), -1)
+    y_test = np.asarray(y_test)
+
+    # Only models with the same depth and activations can share the stacked tensors.
+    groups = {}
+    for spec in specs:
+        if spec['num_nodes_at_output'] != 1:
+            raise ValueError(f'{spec["model_name"]}: only single-output models are supported')
+        key = (len(spec['layers']), spec['hidden_layer_activation'], spec['output_layer_activation'])
+        groups.setdefault(key, []).append(spec)
+
+    results = []
+    for key, group_specs in groups.items():
+        for start in range(0, len(group_specs), models_per_group):
+            chunk = group_specs[start:start + models_per_group]
+            print(f'Training {len(chunk)} models with {key[0]} hidden layers...')
+            preds = _train_group(chunk, X_train, y_train, X_test, task, epochs, batch_size, learning_rate, rng)
+            for spec, pred in zip(chunk, preds):
+                results.append({'model_name': spec['model_name'], **evaluate(task, y_test, pred)})
+
+    return pd.DataFrame(results)
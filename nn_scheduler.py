@@ -0,0 +1,159 @@
+"""
+Successive-halving scheduler for the NN architecture sweeps.
+Created by: Danilo Steckelberg
+Created for: IBM Deep Learning course final project (nn_optimization / nn_optimization_reg notebooks)
+Created on: 2023-02-17
+
+Every candidate starts with a small epoch budget. After each rung only the best
+1/eta candidates by validation metric (MSE for regression, F1 for classification)
+are kept, and their budget grows eta times, resuming from the weights of the
+previous rung. Each training run also stops early when the validation loss stalls.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import nn_sweep
+from nn_sweep import build_model, compile_model, evaluate, make_executor, iter_completed, _ResultsWriter
+
+# Validation metric used to rank candidates, and whether higher is better.
+RANKING_METRIC = {
+    'regression': ('val_mse', False),
+    'classification': ('val_f1', True),
+}
+
+
+def _epochs_trained(initial_epoch: int, val_loss: list, stopped_early: bool) -> int:
+    """
+    Epoch of the weights a run ends with. When EarlyStopping stops the run, restore_best_weights
+    rolls the model back to the epoch with the lowest val_loss, not the last epoch run.
+    """
+    if stopped_early:
+        return initial_epoch + int(np.argmin(val_loss)) + 1
+    return initial_epoch + len(val_loss)
+
+
+def rank_results(rows: list, task: str) -> pd.DataFrame:
+    """ Candidates that survived more rungs first, then by validation metric. """
+    metric, higher_is_better = RANKING_METRIC[task]
+    results = pd.DataFrame(rows)
+    return results.sort_values(by = ['rung', metric], ascending = [False, not higher_is_better]).reset_index(drop = True)
+
+
+def _train_rung(job: tuple) -> dict:
+    """ Trains one candidate from initial_epoch up to epochs, inside a worker. """
+    import tensorflow as tf
+
+    spec, weights, initial_epoch, epochs, patience = job
+    d = nn_sweep._worker_data
+
+    model = compile_model(build_model(spec), d['task'])
+    if weights is not None:
+        model.set_weights(weights)
+
+    early_stopping = tf.keras.callbacks.EarlyStopping(
+        monitor = 'val_loss', patience = patience, restore_best_weights = True)
+    hist = model.fit(d['X_train'], d['y_train'],
+        validation_data = (d['X_val'], d['y_val']),
+        initial_epoch = initial_epoch, epochs = epochs,
+        callbacks = [early_stopping], verbose = 0)
+
+    epochs_run = len(hist.history['loss'])
+    stopped_early = early_stopping.stopped_epoch > 0
+    val_metrics = evaluate(d['task'], d['y_val'], model.predict(d['X_val'], verbose = 0))
+    test_metrics = evaluate(d['task'], d['y_test'], model.predict(d['X_test'], verbose = 0))
+    return {
+        'weights': model.get_weights(),
+        'epochs_trained': _epochs_trained(initial_epoch, hist.history['val_loss'], stopped_early),
+        'epochs_run': epochs_run,
+        'stopped_early': stopped_early,
+        **{f'val_{k.replace("test_", "")}': v for k, v in val_metrics.items()},
+        **test_metrics,
+    }
+
+
+def successive_halving(specs,
+                       X_train: np.array,
+                       y_train: np.array,
+                       X_test: np.array,
+                       y_test: np.array,
+                       task: str = 'regression',
+                       min_epochs: int = 3,
+                       max_epochs: int = 50,
+                       eta: int = 3,
+                       patience: int = 5,
+                       validation_size: float = 0.2,
+                       n_workers: int = None,
+                       threads_per_worker: int = 1,
+                       results_path: str = None,
+                       seed: int = 42) -> pd.DataFrame:
+    """
+    Runs a successive-halving sweep over the architecture specs.
+    Inputs:
+        specs: iterable of architecture specs, e.g. a SearchSpace (see nn_search_space).
+        min_epochs: budget of the first rung; rung r trains up to min_epochs * eta**r epochs.
+        max_epochs: maximum budget of any candidate (the epochs=50 of the notebooks).
+        eta: only the best 1/eta candidates of each rung are promoted.
+        patience: epochs without val_loss improvement before a training run stops.
+        validation_size: fraction of X_train held out to rank candidates; X_test is only reported.
+    Output: pandas DataFrame with the last rung survived by each candidate, best candidates first.
+        epochs_trained is the epoch of the weights kept (after restore_best_weights).
+    """
+    from sklearn.model_selection import train_test_split
+
+    if n_workers is None:
+        n_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    metric, higher_is_better = RANKING_METRIC[task]
+
+    X_fit, X_val, y_fit, y_val = train_test_split(
+        np.asarray(X_train, dtype = np.float32), np.asarray(y_train, dtype = np.float32),
+        test_size = validation_size, random_state = seed)
+    X_test, y_test = np.asarray(X_test, dtype = np.float32), np.asarray(y_test)
+
+    # State of each candidate: spec, last weights and last metrics row.
+    candidates = {spec['model_name']: {'spec': spec, 'weights': None, 'row': None} for spec in specs}
+    survivors = list(candidates)
+    writer = _ResultsWriter(results_path) if results_path else None
+
+    with make_executor(X_fit, y_fit, X_test, y_test, task, max_epochs, n_workers, threads_per_worker, seed,
+                       X_val = X_val, y_val = y_val) as executor:
+        rung = 0
+        budget = min(min_epochs, max_epochs)
+        while survivors:
+            # Every survivor reaches this rung, including those that stopped early and are not retrained.
+            for name in survivors:
+                if candidates[name]['row'] is not None:
+                    candidates[name]['row']['rung'] = rung
+            # Candidates that already stopped early are not retrained, only ranked again.
+            jobs = []
+            for name in survivors:
+                c = candidates[name]
+                if c['row'] is None or not c['row']['stopped_early']:
+                    initial_epoch = c['row']['epochs_trained'] if c['row'] is not None else 0
+                    jobs.append((c['spec'], c['weights'], initial_epoch, budget, patience))
+            print(f'Rung {rung}: {len(survivors)} candidates, {budget} epochs')
+
+            for job, res, error in iter_completed(executor, _train_rung, jobs, max_pending = 2 * n_workers):
+                name = job[0]['model_name']
+                if error is not None:
+                    print(f'{name} --> {str(error)}')
+                    survivors.remove(name)
+                    continue
+                candidates[name]['weights'] = res.pop('weights')
+                candidates[name]['row'] = {'model_name': name, 'rung': rung, **res}
+                if writer is not None:
+                    writer.write(candidates[name]['row'])
+
+            if budget >= max_epochs or len(survivors) <= 1:
+                break
+            ranked = sorted(survivors, key = lambda n: candidates[n]['row'][metric], reverse = higher_is_better)
+            survivors = ranked[:max(1, len(ranked) // eta)]
+            rung += 1
+            budget = min(budget * eta, max_epochs)
+
+    if writer is not None:
+        writer.close()
+
+    return rank_results([c['row'] for c in candidates.values() if c['row'] is not None], task)
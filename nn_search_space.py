@@ -0,0 +1,114 @@
+"""
+Lazy search space of dense architectures for the NN sweeps.
+Created by: Danilo Steckelberg
+Created for: IBM Deep Learning course final project (nn_optimization / nn_optimization_reg notebooks)
+Created on: 2023-02-16
+
+Architectures are enumerated on demand as lightweight specs (plain dicts that
+nn_sweep.build_model turns into Keras models). Parameter counts and FLOPs are
+computed analytically from the layer sizes, so filtering and sorting a large
+search space never builds a model.
+"""
+
+import itertools
+
+
+def count_params(spec: dict) -> int:
+    """ Trainable parameters (weights + biases) of the dense stack described by spec. """
+    sizes = [spec['input_shape'][-1], *spec['layers'], spec['num_nodes_at_output']]
+    return sum(n_in * n_out + n_out for n_in, n_out in zip(sizes[:-1], sizes[1:]))
+
+
+def count_flops(spec: dict) -> int:
+    """
+    Forward-pass FLOPs per sample: each multiply-accumulate counts as 2 FLOPs,
+    plus one addition per bias. Activations are not counted.
+    """
+    sizes = [spec['input_shape'][-1], *spec['layers'], spec['num_nodes_at_output']]
+    return sum(2 * n_in * n_out + n_out for n_in, n_out in zip(sizes[:-1], sizes[1:]))
+
+
+class SearchSpace:
+    """
+    Every combination of `num_layers` hidden layers with node counts in
+    range(min_nodes_per_layer, max_nodes_per_layer + 1, node_step_size),
+    the same space as `get_models` in the notebooks.
+    """
+
+    def __init__(self, num_layers: int,
+        min_nodes_per_layer: int,
+        max_nodes_per_layer: int,
+        node_step_size: int,
+        input_shape: tuple,
+        hidden_layer_activation: str = 'relu',
+        num_nodes_at_output: int = 1,
+        output_layer_activation: str = 'sigmoid'):
+        self.num_layers = num_layers
+        self.node_options = list(range(min_nodes_per_layer, max_nodes_per_layer + 1, node_step_size))
+        self.input_shape = tuple(input_shape)
+        self.hidden_layer_activation = hidden_layer_activation
+        self.num_nodes_at_output = num_nodes_at_output
+        self.output_layer_activation = output_layer_activation
+        self._filters = []
+        self._sort_key = None
+        self._reverse = False
+
+    def __len__(self):
+        if not self._filters:
+            return len(self.node_options) ** self.num_layers
+        return sum(1 for _ in self)
+
+    def _spec(self, layers: tuple) -> dict:
+        return {
+            'model_name': '_'.join(f'dense{nodes_at_layer}' for nodes_at_layer in layers),
+            'layers': layers,
+            'input_shape': self.input_shape,
+            'hidden_layer_activation': self.hidden_layer_activation,
+            'num_nodes_at_output': self.num_nodes_at_output,
+            'output_layer_activation': self.output_layer_activation,
+        }
+
+    def _iter_specs(self):
+        for layers in itertools.product(self.node_options, repeat = self.num_layers):
+            spec = self._spec(layers)
+            if all(f(spec) for f in self._filters):
+                yield spec
+
+    def __iter__(self):
+        if self._sort_key is None:
+            return self._iter_specs()
+        # Sorting needs the whole (filtered) space, but only the small spec dicts are held.
+        return iter(sorted(self._iter_specs(), key = self._sort_key, reverse = self._reverse))
+
+    def _copy(self):
+        other = object.__new__(SearchSpace)
+        other.__dict__.update(self.__dict__)
+        other._filters = list(self._filters)
+        return other
+
+    def filter(self, max_params: int = None, max_flops: int = None, predicate = None):
+        """ New search space restricted by a parameter and/or FLOPs budget, or any spec predicate. """
+        other = self._copy()
+        if max_params is not None:
+            other._filters.append(lambda spec: count_params(spec) <= max_params)
+        if max_flops is not None:
+            other._filters.append(lambda spec: count_flops(spec) <= max_flops)
+        if predicate is not None:
+            other._filters.append(predicate)
+        return other
+
+    def sort(self, by: str = 'params', reverse: bool = False):
+        """ New search space enumerated in order of 'params' or 'flops'. """
+        other = self._copy()
+        other._sort_key = {'params': count_params, 'flops': count_flops}[by]
+        other._reverse = reverse
+        return other
+
+    def summary(self):
+        """ pandas DataFrame with model_name, params and flops of each architecture. """
+        import pandas as pd
+
+        return pd.DataFrame([
+            {'model_name': spec['model_name'], 'params': count_params(spec), 'flops': count_flops(spec)}
+            for spec in self
+        ])
@@ -0,0 +1,324 @@
+"""
+Parallel architecture sweep for the ROAS neural network models.
+Created by: Danilo Steckelberg
+Created for: IBM Deep Learning course final project (nn_optimization / nn_optimization_reg notebooks)
+Created on: 2023-02-15
+
+Each candidate architecture is trained in a separate process. Workers pin the
+TensorFlow intra/inter-op thread pools so that N workers on N cores do not
+oversubscribe the CPU, and every finished trial is appended to a CSV file
+as soon as it completes.
+"""
+
+import os
+import csv
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+
+from nn_search_space import SearchSpace
+from nn_cache import TrialCache, dataset_fingerprint, trial_key
+from nn_dataset import prepare_dataset, load_dataset
+
+# Worker state, set once per process by _init_worker.
+_worker_data = {}
+
+
+def get_architectures(num_layers: int,
+    min_nodes_per_layer: int,
+    max_nodes_per_layer: int,
+    node_step_size: int,
+    input_shape: tuple,
+    hidden_layer_activation: str = 'relu',
+    num_nodes_at_output: int = 1,
+    output_layer_activation: str = 'sigmoid') -> SearchSpace:
+    """
+    Same search space as `get_models` in the notebooks, enumerated lazily as
+    picklable architecture specs instead of built Keras models.
+    """
+    return SearchSpace(num_layers, min_nodes_per_layer, max_nodes_per_layer, node_step_size,
+        input_shape, hidden_layer_activation, num_nodes_at_output, output_layer_activation)
+
+
+def build_model(spec: dict):
+    """ Builds the tf.keras.Sequential model described by an architecture spec. """
+    import tensorflow as tf
+
+    model = tf.keras.Sequential()
+    model.add(tf.keras.layers.InputLayer(input_shape = spec['input_shape']))
+    for nodes_at_layer in spec['layers']:
+        model.add(tf.keras.layers.Dense(nodes_at_layer, activation = spec['hidden_layer_activation']))
+    model.add(tf.keras.layers.Dense(spec['num_nodes_at_output'], activation = spec['output_layer_activation']))
+    model._name = spec['model_name']
+    return model
+
+
+def _init_worker(X_train, y_train, X_test, y_test, task, epochs, threads_per_worker, seed, X_val = None, y_val = None,
+                 dataset_dir = None):
+    # Thread pools must be configured before TensorFlow creates its runtime.
+    os.environ['OMP_NUM_THREADS'] = str(threads_per_worker)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads_per_worker)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads_per_worker)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    tf.random.set_seed(seed)
+
+    if dataset_dir is not None:
+        # Prepared datasets are memory-mapped: all workers share the same pages.
+        data = load_dataset(dataset_dir)
+        X_train, y_train, X_test, y_test = data['X_train'], data['y_train'], data['X_test'], data['y_test']
+
+    _worker_data.update({
+        'X_train': X_train, 'y_train': y_train,
+        'X_test': X_test, 'y_test': y_test,
+        'X_val': X_val, 'y_val': y_val,
+        'task': task, 'epochs': epochs,
+    })
+
+
+def evaluate(task: str, y_test, preds) -> dict:
+    """ Test metrics used by the notebooks for each task ('classification' or 'regression'). """
+    if task == 'classification':
+        from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+        prediction_classes = (np.ravel(preds) > 0.5).astype(int)
+        return {
+            'test_accuracy': accuracy_score(y_test, prediction_classes),
+            'test_precision': precision_score(y_test, prediction_classes),
+            'test_recall': recall_score(y_test, prediction_classes),
+            'test_f1': f1_score(y_test, prediction_classes),
+        }
+
+    from sklearn.metrics import mean_squared_error, r2_score
+    return {
+        'mse': mean_squared_error(y_test, preds),
+        'r_square': r2_score(y_test, preds),
+    }
+
+
+# Optimizer and loss used by compile_model for each task (also part of the trial cache key).
+TRAINING_CONFIG = {
+    'regression': {'optimizer': 'adam', 'loss': 'mean_squared_error'},
+    'classification': {'optimizer': 'adam', 'loss': 'binary_crossentropy'},
+}
+
+
+def compile_model(model, task: str):
+    import tensorflow as tf
+
+    if task == 'classification':
+        model.compile(
+            loss=tf.keras.losses.binary_crossentropy,
+            optimizer=tf.keras.optimizers.Adam(),
+            metrics=[tf.keras.metrics.BinaryAccuracy(name='accuracy')]
+        )
+    else:
+        model.compile(
+            loss=tf.keras.losses.mean_squared_error,
+            optimizer=tf.keras.optimizers.Adam(),
+            metrics=[tf.keras.metrics.mean_squared_error]
+        )
+    return model
+
+
+def _fit(spec: dict):
+    d = _worker_data
+    model = compile_model(build_model(spec), d['task'])
+    model.fit(d['X_train'], d['y_train'], epochs = d['epochs'], verbose = 0)
+    preds = model.predict(d['X_test'], verbose = 0)
+    return {'model_name': spec['model_name'], **evaluate(d['task'], d['y_test'], preds)}, model
+
+
+def train_spec(spec: dict) -> dict:
+    """ Trains one architecture inside a worker and returns its metrics row. """
+    return _fit(spec)[0]
+
+
+def _train_and_cache(job: tuple) -> dict:
+    """ Trains one architecture and checkpoints metrics and weights in the trial cache. """
+    spec, key, cache_root = job
+    res, model = _fit(spec)
+    TrialCache(cache_root).put(key, res, model.get_weights())
+    return res
+
+
+class _ResultsWriter:
+    """
+    Appends result rows to a CSV file, flushing after each row.
+    Rows already in the file (e.g. cached trials reported again on a rerun) are not written twice.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._writer = None
+        self._written = set()
+
+    @staticmethod
+    def _row_key(values):
+        # Same text the csv module writes for each cell (None is written as an empty cell).
+        return tuple('' if v is None else str(v) for v in values)
+
+    def write(self, row: dict):
+        if self._writer is None:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            if not new_file:
+                with open(self.path, newline = '') as f:
+                    self._written = {self._row_key(r.get(c) for c in row) for r in csv.DictReader(f)}
+            self._file = open(self.path, 'a', newline = '')
+            self._writer = csv.DictWriter(self._file, fieldnames = list(row))
+            if new_file:
+                self._writer.writeheader()
+        key = self._row_key(row.values())
+        if key in self._written:
+            return
+        self._written.add(key)
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def make_executor(X_train, y_train, X_test, y_test, task, epochs, n_workers, threads_per_worker, seed,
+                  X_val = None, y_val = None, dataset_dir = None) -> ProcessPoolExecutor:
+    """
+    Process pool whose workers hold the datasets and have pinned TF thread pools.
+    With dataset_dir (see nn_dataset) the workers open the prepared arrays themselves
+    and the X/y arguments are ignored.
+    """
+    # TensorFlow is not fork-safe, so workers are always started with 'spawn'.
+    return ProcessPoolExecutor(
+        max_workers = n_workers,
+        mp_context = mp.get_context('spawn'),
+        initializer = _init_worker,
+        initargs = (X_train, y_train, X_test, y_test, task, epochs, threads_per_worker, seed, X_val, y_val, dataset_dir))
+
+
+def iter_completed(executor, fn, items, max_pending: int):
+    """
+    Submits fn(item) for each item lazily, keeping at most max_pending tasks in flight,
+    and yields (item, result, exception) as tasks complete.
+    """
+    pending = {}
+    items_iter = iter(items)
+    while True:
+        for item in items_iter:
+            pending[executor.submit(fn, item)] = item
+            if len(pending) >= max_pending:
+                break
+        if not pending:
+            return
+        done, _ = wait(pending, return_when = FIRST_COMPLETED)
+        for future in done:
+            item = pending.pop(future)
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
+
+
+def run_sweep(specs: list,
+              X_train: np.array = None,
+              y_train: np.array = None,
+              X_test: np.array = None,
+              y_test: np.array = None,
+              task: str = 'regression',
+              epochs: int = 50,
+              n_workers: int = None,
+              threads_per_worker: int = 1,
+              results_path: str = None,
+              cache_dir: str = None,
+              dataset_dir: str = None,
+              seed: int = 42) -> pd.DataFrame:
+    """
+    Trains every architecture spec across a process pool.
+    Inputs:
+        specs: iterable of architecture specs, e.g. a SearchSpace (see nn_search_space).
+        task: 'regression' (mse, r_square) or 'classification' (accuracy, precision, recall, f1).
+        n_workers: number of processes; default is os.cpu_count() // threads_per_worker.
+        results_path: CSV file where each finished trial is appended as it completes.
+        cache_dir: trial cache directory (see nn_cache). Trials already cached are not
+            retrained, and each new trial is checkpointed as soon as it finishes.
+        dataset_dir: prepared dataset (see nn_dataset.prepare_dataset) used instead of X/y arrays;
+            workers open it memory-mapped instead of receiving a copy of the data.
+    Output: pandas DataFrame with one row per trained model.
+    """
+    if n_workers is None:
+        n_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+    if dataset_dir is None:
+        X_train, X_test = np.asarray(X_train, dtype = np.float32), np.asarray(X_test, dtype = np.float32)
+        y_train, y_test = np.asarray(y_train, dtype = np.float32), np.asarray(y_test)
+
+    total = len(specs) if hasattr(specs, '__len__') else '?'
+    results = []
+    writer = _ResultsWriter(results_path) if results_path else None
+    cache = TrialCache(cache_dir) if cache_dir else None
+    if cache is not None:
+        if dataset_dir is not None:
+            dataset = load_dataset(dataset_dir)['meta']['key']
+        else:
+            dataset = dataset_fingerprint(X_train, y_train, X_test, y_test)
+        training = TRAINING_CONFIG[task]
+
+    def pending_jobs():
+        # Cached trials are reported directly; only the missing ones go to the pool.
+        for spec in specs:
+            if cache is None:
+                yield spec
+                continue
+            key = trial_key(spec, training['optimizer'], training['loss'], epochs, seed, dataset)
+            cached = cache.get(key)
+            if cached is not None:
+                results.append(cached)
+                if writer is not None:
+                    writer.write(cached)
+            else:
+                yield (spec, key, cache.root)
+
+    fn = _train_and_cache if cache is not None else train_spec
+    with make_executor(X_train, y_train, X_test, y_test, task, epochs, n_workers, threads_per_worker, seed,
+                       dataset_dir = dataset_dir) as executor:
+        # Specs are submitted lazily, keeping at most two pending trials per worker,
+        # so a large search space is never materialized.
+        completed = iter_completed(executor, fn, pending_jobs(), max_pending = 2 * n_workers)
+        for i, (job, res, error) in enumerate(completed, start = 1):
+            spec = job[0] if cache is not None else job
+            if error is not None:
+                print(f'{spec["model_name"]} --> {str(error)}')
+                continue
+            print(f'{i} trained ({len(results) + 1} out of {total}): {spec["model_name"]}')
+            results.append(res)
+            if writer is not None:
+                writer.write(res)
+
+    if writer is not None:
+        writer.close()
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    dataset_dir = prepare_dataset('regression')
+    n_features = len(load_dataset(dataset_dir)['meta']['columns'])
+
+    specs = get_architectures(
+        num_layers=4,
+        min_nodes_per_layer=5,
+        max_nodes_per_layer=20,
+        node_step_size=5,
+        input_shape=(n_features,),
+        hidden_layer_activation='relu',
+        output_layer_activation='linear'
+    )
+    print(f'# of models: {len(specs)}')
+    print(specs.summary().describe())
+
+    optimization_results = run_sweep(specs, dataset_dir = dataset_dir, task = 'regression',
+        results_path = 'optimization_results_4layers_relu.csv', cache_dir = 'sweep_cache')
+    print(optimization_results.sort_values(by = 'r_square', ascending=False))
@@ -9,11 +9,12 @@ Referência da API Omie: https://developer.omie.com.br/service-list/
 import requests
 import pandas as pd
 import json
-from modulos.utils.projeto import get_config
+import os
+import hashlib
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from modulos.integracoes.storage import google_bigquery
-
-config = get_config()
+from omie_indice_chaves import IndiceChaves, lock_arquivo
+from omie_schema import schema_tabela, tipar_dataframe, para_arrow, carregar_arrow
 
 
 def normalizar_colunas(dataframe, colunas_desejadas):
@@ -43,6 +44,24 @@ def unique_columns(df, columns):
     df_unique_sel = df_unique[columns]
     return(df_unique_sel)
 
+def hash_dataframe(dataframe):
+    """
+    Função para obter uma impressão digital (sha256) do conteúdo de um DataFrame,
+    independente da ordem das linhas e das colunas.
+    Entrada: Pandas DataFrame.
+    Saída: string com o hash hexadecimal.
+    """
+    dataframe = dataframe[sorted(dataframe.columns)]
+    linhas = sorted(json.dumps(registro, sort_keys = True, default = str) for registro in dataframe.to_dict('records'))
+    return hashlib.sha256('\n'.join(linhas).encode()).hexdigest()
+
+def carga_ok(msg):
+    """
+    Indica se uma carga terminou bem a partir da mensagem retornada: os métodos de carga
+    (e o GoogleBigQuery.dataframe_to_bq) retornam '... NÃO OK' em vez de levantar exceção.
+    """
+    return 'NÃO OK' not in str(msg)
+
 class omie:
     
     headers = {'Content-type': 'application/json'}
@@ -53,6 +72,8 @@ class omie:
     PRODUTOS_URL = 'geral/produtos/'
     CATEGORIAS_URL = 'geral/categorias/'
     ESTOQUE_URL = 'estoque/consulta/'
+    # Arquivo com o hash da última carga de cada tabela de referência (dimensão).
+    HASHES_DIMENSOES_PATH = os.path.join('cache', 'omie_hashes_dimensoes.json')
 
     def _config_api(self):
 
@@ -64,12 +85,88 @@ class omie:
         return api_config_data
 
 
-    def __init__(self, key, secret, dataset = 'omie'):
+    def __init__(self, key, secret, dataset = 'omie', gbq = None, arquivo = None, limitador = None):
+        """
+        Entradas:
+            key, secret (string): credenciais da API Omie.
+            dataset (string): dataset do BigQuery onde os dados são carregados.
+            gbq: backend com a interface do GoogleBigQuery (ex.: local_warehouse.LocalBigQuery).
+                Se não informado, o GoogleBigQuery é criado no primeiro uso.
+            arquivo (omie_arquivo.ArquivoRespostas): se informado, cada página bruta retornada pela API
+                é arquivada, permitindo refazer as transformações sem nova consulta à API.
+            limitador (omie_multicontas.OrcamentoRequisicoes): se informado, cada requisição à API aguarda
+                o orçamento de requisições (da conta e global) antes de ser enviada.
+        """
         self.app_key = key
         self.app_secret = secret
         self.dataset = dataset
-        self.GBQ = google_bigquery.GoogleBigQuery()
-        self.client = self.GBQ.client
+        self._GBQ = gbq
+        self.arquivo = arquivo
+        self.limitador = limitador
+        self._indices = {}
+        self._schemas = {}
+
+    @property
+    def GBQ(self):
+        """
+        Cliente do BigQuery, criado apenas no primeiro uso, para que chamadas que
+        não acessam o BigQuery não paguem pela autenticação.
+        """
+        if self._GBQ is None:
+            # Importado apenas aqui: importar o módulo não carrega o cliente do BigQuery.
+            from modulos.integracoes.storage import google_bigquery
+            self._GBQ = google_bigquery.GoogleBigQuery()
+        return self._GBQ
+
+    @property
+    def client(self):
+        return self.GBQ.client
+
+    # Índices locais de chaves já carregadas: nome -> (tipo, query que obtém todas as chaves no BigQuery).
+    INDICES = {
+        'nf_numero_cnpj': ('texto', "select distinct concat(nNF, cnpj_cpf) chave from {dataset}.notas_fiscais where nNF is not null and cnpj_cpf is not null"),
+        'recebimentos_id': ('inteiro', "select distinct cabec_nIdReceb chave from {dataset}.recebimentos where cabec_nIdReceb is not null"),
+    }
+
+    def _schema(self, tabela):
+        """
+        Retorna o schema (lista de tuplas coluna, tipo) de uma tabela do dataset,
+        consultado uma única vez por instância.
+        """
+        if tabela not in self._schemas:
+            self._schemas[tabela] = schema_tabela(self.client, f'{self.dataset}.{tabela}')
+        return self._schemas[tabela]
+
+    def _indice(self, nome):
+        """
+        Retorna o índice local de chaves (ver omie_indice_chaves). Na primeira utilização
+        (arquivo inexistente) o índice é construído a partir do BigQuery; depois disso é
+        mantido em sincronia a cada carga feita por esta classe.
+        """
+        if nome not in self._indices:
+            tipo, query = self.INDICES[nome]
+            indice = IndiceChaves(os.path.join('cache', f'omie_indice_{self.dataset}_{nome}.npy'), tipo)
+            if not indice.existe:
+                print(f'Construindo índice local {nome} a partir do BigQuery')
+                indice.reconstruir(self.GBQ.executar_query(query.format(dataset = self.dataset))['chave'])
+            self._indices[nome] = indice
+        return self._indices[nome]
+
+    def reconstruir_indices(self):
+        """
+        Função para reconstruir os índices locais a partir do BigQuery,
+        caso as tabelas tenham sido alteradas fora desta classe.
+        """
+        for nome, (tipo, query) in self.INDICES.items():
+            self._indice(nome).reconstruir(self.GBQ.executar_query(query.format(dataset = self.dataset))['chave'])
+
+    def _arquivar(self, chave, registros):
+        """ Grava uma página bruta no arquivo de respostas (apenas entidades arquivadas). """
+        if self.arquivo is None:
+            return
+        from omie_arquivo import ENTIDADES
+        if chave in ENTIDADES:
+            self.arquivo.gravar_pagina(chave, registros)
 
     def _criar_parametros(self, attributes, chamado):
         """ 
@@ -94,6 +191,12 @@ class omie:
 
         return data
 
+    def _post(self, url, data):
+        """ Envia a requisição à API, respeitando o orçamento de requisições (se houver). """
+        if self.limitador is not None:
+            self.limitador.aguardar()
+        return requests.post(url, headers=self.headers, data = data)
+
     def _requisicao_api(self, url, attributes,  chamado):
         """
         Função para simplificar requisição de APIs Omie.
@@ -104,7 +207,7 @@ class omie:
         Saída: resposta da requisição com os parâmetros selecionados.
         """
         data = json.dumps(self._criar_parametros(attributes, chamado))
-        resposta = requests.post(url, headers=self.headers, data = data)  
+        resposta = self._post(url, data)
         if not resposta.ok:
             print(f'Erro na requisicao de API.\nURL: {url}\nHeaders: {self.headers}')
         return resposta
@@ -125,7 +228,7 @@ class omie:
                 "param":[attributes]
                 }
         
-        resposta_api = requests.post(url, headers=self.headers, data = json.dumps(data))
+        resposta_api = self._post(url, json.dumps(data))
         resposta = resposta_api.json()
         if not resposta_api.ok:
             print(f'Erro na requisicao de API.\nURL: {url}\nHeaders: {self.headers}')
@@ -137,13 +240,15 @@ class omie:
         # O stop precisa do +1 pois a função range não inclui o stop, e precisamos inclusive da n-ésima página.
         pags = range(2,resposta[chave_tot_pags]+1)
         dados_json = resposta[chave]
+        self._arquivar(chave, resposta[chave])
         print(f"Pág: 1 de um total de {resposta[chave_tot_pags]}")
 
         # Iteração para obtermos todas as páginas de pedidos do período selecionado
         for p in pags:
             print(f"Pág: {p} de um total de {resposta[chave_tot_pags]}")
             attributes.update({chave_pagina:p})
-            resposta = requests.post(url, headers=self.headers, data = json.dumps(data)).json()
+            resposta = self._post(url, json.dumps(data)).json()
+            self._arquivar(chave, resposta[chave])
             dados_json.extend(resposta[chave])
 
         # Transformar o output em Pandas DataFrame.
@@ -262,13 +367,16 @@ class omie:
         # O stop precisa do +1 pois a função range não inclui o stop, e precisamos inclusive da n-ésima página.
         pags = range(2,retorno_api['total_de_paginas']+1)
         notas_fiscais = retorno_api['nfCadastro']
+        self._arquivar('nfCadastro', retorno_api['nfCadastro'])
         print(f"Pág: 1 de um total de {retorno_api['total_de_paginas']}")
 
         # Iteração para obtermos todas as páginas de pedidos do período selecionado
         for p in pags:
             print(f"Pág: {p} de um total de {retorno_api['total_de_paginas']}")
             attributes.update({"pagina":p})
-            notas_fiscais.extend(self.obter_notas_fiscais(attributes)['nfCadastro'])
+            pagina = self.obter_notas_fiscais(attributes)['nfCadastro']
+            self._arquivar('nfCadastro', pagina)
+            notas_fiscais.extend(pagina)
 
         # Transformar o output em Pandas DataFrame.
         # notas_fiscais_df = self.notas_fiscais_df(notas_fiscais)
@@ -276,18 +384,25 @@ class omie:
         print('Execução NF OK!')
         return notas_fiscais
 
+    def notas_fiscais_arrow(self, notas_fiscais):
+        """
+        Equivalente colunar de notas_fiscais_df: colunas com os tipos da tabela notas_fiscais
+        e códigos repetidos (CFOP, NCM, UF, CNPJ...) codificados como dicionário.
+        Entradas: Dados de notas fiscais em JSON.
+        Saída: pyarrow.Table (use omie_arrow.para_pandas para obter um DataFrame).
+        """
+        from omie_arrow import notas_fiscais_arrow
+        return notas_fiscais_arrow(notas_fiscais, self._schema('notas_fiscais'))
+
     def adicionar_notas_fiscais_por_data_bq(self, data_inicio, data_fim, nome_tabela):
         
         nfs = self.obter_notas_fiscais_por_data(data_inicio = data_inicio,data_fim = data_fim,filtrar_apenas_alteracao="S", apenas_importado_api="N")
-        df = self.notas_fiscais_df(nfs)
+        tabela = self.notas_fiscais_arrow(nfs)
+        del nfs
 
-        # gbq = self.GBQ.client()
         try:
-            df.to_gbq(
-                f'{self.dataset}.{nome_tabela}',
-                'evi-stitch',
-                chunksize=None,
-                if_exists='replace')
+            # Tabela temporária com o mesmo schema de notas_fiscais, carregada direto da tabela Arrow.
+            carregar_arrow(self.client, tabela, f'{self.dataset}.{nome_tabela}', substituir = True)
 
             msg = 'Adicionar NF ao BQ: OK'
         except: 
@@ -302,13 +417,132 @@ class omie:
         hoje = datetime.today().strftime('%d/%m/%Y')
         print(hoje)
         print(penultima_data_format)
-        qr = self.adicionar_notas_fiscais_por_data_bq(penultima_data_format,hoje,'notas_fiscais_temp')
-        self.GBQ.executar_query(f"""
-            insert into {self.dataset}.notas_fiscais
-            (select * from {self.dataset}.notas_fiscais_temp where nfProdInt_nCodItem not in (select nfProdInt_nCodItem from {self.dataset}.notas_fiscais));
-            drop table {self.dataset}.notas_fiscais_temp
-        """)
-        return qr
+        nfs = self.obter_notas_fiscais_por_data(data_inicio = penultima_data_format, data_fim = hoje, filtrar_apenas_alteracao="S", apenas_importado_api="N")
+        return self.carregar_notas_fiscais(nfs)
+
+    def carregar_notas_fiscais(self, notas_fiscais, tabela_temp = 'notas_fiscais_temp', governador = None):
+        """
+        Função para incluir na tabela notas_fiscais os itens de NF ainda não carregados.
+        Usada pela atualização diária e pelo recebimento de webhooks (omie_webhook).
+        Entradas:
+            notas_fiscais: Dados de notas fiscais em JSON.
+            tabela_temp (string): tabela temporária usada na carga.
+            governador (omie_memoria.GovernadorMemoria): se informado, mede a memória das etapas.
+        Saída: mensagem da carga.
+        """
+        etapa = self._etapa(governador)
+        with etapa('achatar', registros = len(notas_fiscais)):
+            tabela = self.notas_fiscais_arrow(notas_fiscais)
+        if tabela.num_rows == 0:
+            return 'Adicionar NF ao BQ: OK (sem NFs)'
+
+        # Chaves (número da NF + CNPJ) calculadas da tabela Arrow, antes da carga (mesma regra do concat no SQL).
+        nnf, cnpj = tabela.column('nNF').to_pandas(), tabela.column('cnpj_cpf').to_pandas()
+        validas = nnf.notna() & cnpj.notna()
+        chaves_nf = (nnf[validas].astype(str) + cnpj[validas].astype(str)).unique()
+
+        try:
+            with etapa('carregar', linhas = tabela.num_rows):
+                carregar_arrow(self.client, tabela, f'{self.dataset}.{tabela_temp}', substituir = True)
+                self.GBQ.executar_query(f"""
+                    insert into {self.dataset}.notas_fiscais
+                    (select * from {self.dataset}.{tabela_temp} where nfProdInt_nCodItem not in (select nfProdInt_nCodItem from {self.dataset}.notas_fiscais));
+                    drop table {self.dataset}.{tabela_temp}
+                """)
+            msg = 'Adicionar NF ao BQ: OK'
+        except: 
+            return 'Adicionar NF ao BQ: NÃO OK'
+
+        # A carga já foi feita: uma falha ao atualizar o índice local é apenas reportada.
+        try:
+            self._indice('nf_numero_cnpj').adicionar(chaves_nf)
+        except Exception as e:
+            print(f'Aviso: carga OK, mas o índice nf_numero_cnpj não foi atualizado ({e!r})')
+        return msg
+
+    @staticmethod
+    def _etapa(governador):
+        # Medição de memória das etapas quando há governador; sem governador, não mede nada.
+        return governador.etapa if governador is not None else (lambda nome, **info: nullcontext())
+
+    def carregar_por_lotes(self, entidade, data_inicio, data_fim, governador, registros_por_pag = 500):
+        """
+        Função para obter e carregar NFs ou pedidos de um intervalo longo em lotes de páginas,
+        com o tamanho de cada lote ajustado pelo governador de memória (ver omie_memoria).
+        Cada lote é achatado e carregado (carregar_notas_fiscais / carregar_pedidos) antes de
+        as próximas páginas serem consultadas, de forma que a memória não cresce com o intervalo.
+        Entradas:
+            entidade (string): 'notas_fiscais' ou 'pedidos'.
+            data_inicio, data_fim (string DD/MM/YYYY)
+            governador (omie_memoria.GovernadorMemoria)
+        Saída: lista com as mensagens da carga de cada lote.
+        """
+        obter, chave, carregar = {
+            'notas_fiscais': (self.obter_notas_fiscais, 'nfCadastro', self.carregar_notas_fiscais),
+            'pedidos': (self.obter_pedidos, 'pedido_venda_produto', self.carregar_pedidos),
+        }[entidade]
+        attributes = {
+            "pagina":1,
+            "registros_por_pagina":f"{registros_por_pag}",
+            "ordenar_por":"CODIGO",
+            "apenas_importado_api":"N",
+            "filtrar_apenas_inclusao":"N",
+            "filtrar_apenas_alteracao":"S",
+            "filtrar_por_data_de": f"{data_inicio}",
+            "filtrar_por_data_ate":f"{data_fim}"
+            }
+
+        msgs = []
+        p, total_paginas = 1, None
+        with governador:
+            while total_paginas is None or p <= total_paginas:
+                # Consulta as páginas do lote; o total de páginas vem na primeira consulta.
+                registros, lote, paginas = [], governador.tamanho_lote(), 0
+                while paginas < lote and (total_paginas is None or p <= total_paginas):
+                    with governador.etapa('api', pagina = p):
+                        attributes.update({"pagina":p})
+                        retorno_api = obter(attributes)
+                    if total_paginas is None:
+                        total_paginas = retorno_api.get('total_de_paginas', 0)
+                    self._arquivar(chave, retorno_api.get(chave, []))
+                    registros.extend(retorno_api.get(chave, []))
+                    del retorno_api
+                    paginas += 1
+                    p += 1
+                print(f'Lote de {paginas} páginas ({len(registros)} registros); páginas lidas: {p - 1} de {total_paginas}')
+                if registros:
+                    msgs.append(carregar(registros, governador = governador))
+                del registros
+                governador.ajustar()
+        print(f'Memória por etapa: {governador.resumo()}')
+        return msgs
+
+    def _consultar_registro(self, url, attributes, chamado, campo_obrigatorio):
+        """
+        Consulta um único registro (Consultar*). Levanta RuntimeError se a requisição falhar, se a API
+        responder com faultstring ou se o registro não tiver campo_obrigatorio, para que quem chama
+        (ex.: omie_webhook) trate a falha em vez de carregar um registro vazio.
+        Saída: registro em JSON (dict).
+        """
+        resposta = self._requisicao_api(url, attributes, chamado)
+        try:
+            registro = resposta.json()
+        except ValueError:
+            registro = None
+        if not resposta.ok or not isinstance(registro, dict) or 'faultstring' in registro:
+            erro = registro.get('faultstring') if isinstance(registro, dict) else None
+            raise RuntimeError(f'{chamado} {attributes}: HTTP {resposta.status_code} {erro or resposta.text[:200]}')
+        if campo_obrigatorio not in registro:
+            raise RuntimeError(f'{chamado} {attributes}: resposta sem {campo_obrigatorio}')
+        return registro
+
+    def consultar_nota_fiscal(self, nIdNF):
+        """
+        Retorna uma única NF pelo id, no mesmo formato dos registros de ListarNF.
+        Levanta RuntimeError se a consulta falhar (ver _consultar_registro).
+        Ref: https://app.omie.com.br/api/v1/produtos/nfconsultar/#ConsultarNF
+        """
+        return self._consultar_registro(f'{self.BASE_URL}{self.NF_URL}', {"nIdNF": int(nIdNF)}, 'ConsultarNF', 'det')
 
 
     def obter_pedidos(self, attributes):
@@ -367,13 +601,16 @@ class omie:
         # O stop precisa do +1 pois a função range não inclui o stop, e precisamos inclusive da n-ésima página.
         pags = range(2,retorno_api['total_de_paginas']+1)
         pedidos = retorno_api['pedido_venda_produto']
+        self._arquivar('pedido_venda_produto', retorno_api['pedido_venda_produto'])
         print(f"Pág: 1 de um total de {retorno_api['total_de_paginas']}")
 
         # Iteração para obtermos todas as páginas de pedidos do período selecionado
         for p in pags:
             print(f"Pág: {p} de um total de {retorno_api['total_de_paginas']}")
             attributes.update({"pagina":p})
-            pedidos.extend(self.obter_pedidos(attributes)['pedido_venda_produto'])
+            pagina = self.obter_pedidos(attributes)['pedido_venda_produto']
+            self._arquivar('pedido_venda_produto', pagina)
+            pedidos.extend(pagina)
 
         # Transformar o output em Pandas DataFrame.
         # notas_fiscais_df = self.notas_fiscais_df(notas_fiscais)
@@ -412,27 +649,33 @@ class omie:
         # # Concatenar em um único df.
         pedidos_df = pd.concat([det_limpo,cabecalho, total_pedido, lista_parcelas, frete, infoCadastro, informacoes_adicionais, observacoes],axis=1)
 
-        # Obter os nomes das colunas para normalizar o DF obtido e garantir que as colunas sejam as mesmas
-        keys_info = self.GBQ.executar_query(f'select * from {self.dataset}.pedidos limit 0').keys()
-        cols = list(keys_info)
-     
-        pedidos_out = normalizar_colunas(pedidos_df,cols)
-        pedidos_out[['dCan', 'hCan', 'uCan', 'cImpAPI']] = pedidos_out[['dCan', 'hCan', 'uCan', 'cImpAPI']].astype(str)
+        # Normalizar colunas e tipos conforme o schema da tabela de pedidos
+        pedidos_out = tipar_dataframe(pedidos_df, self._schema('pedidos'))
+        # Nulos dessas colunas continuam gravados como 'nan', como nas linhas já existentes.
+        from omie_arrow import COLUNAS_NAN_PEDIDOS
+        colunas_nan = [coluna for coluna in COLUNAS_NAN_PEDIDOS if coluna in pedidos_out.columns]
+        pedidos_out[colunas_nan] = pedidos_out[colunas_nan].fillna('nan')
         return(pedidos_out)
 
+    def pedidos_arrow(self, pedidos):
+        """
+        Equivalente colunar de pedidos_df: colunas com os tipos da tabela pedidos
+        e códigos repetidos (etapa, CFOP, NCM, categoria...) codificados como dicionário.
+        Entradas: Dados de pedidos em JSON.
+        Saída: pyarrow.Table (use omie_arrow.para_pandas para obter um DataFrame).
+        """
+        from omie_arrow import pedidos_arrow
+        return pedidos_arrow(pedidos, self._schema('pedidos'))
+
     def adicionar_pedidos_por_data_bq(self, data_inicio, data_fim, nome_tabela):
         
         pedidos = self.obter_pedidos_por_data(data_inicio = data_inicio,data_fim = data_fim,filtrar_apenas_alteracao="S", apenas_importado_api="N")
-        df = self.pedidos_df(pedidos)
+        tabela = self.pedidos_arrow(pedidos)
+        del pedidos
 
-        # gbq = self.GBQ.client()
         try:
-            df.to_gbq(
-                f'{self.dataset}.{nome_tabela}',
-                'evi-stitch',
-                chunksize=None,
-                if_exists='replace',
-                location = 'southamerica-east1')
+            # Tabela temporária com o mesmo schema de pedidos, carregada direto da tabela Arrow.
+            carregar_arrow(self.client, tabela, f'{self.dataset}.{nome_tabela}', substituir = True)
 
             msg = 'Adicionar Pedidos ao BQ: OK'
         except: 
@@ -444,13 +687,57 @@ class omie:
         penultima_data = ultima_data + timedelta(days = -1)
         penultima_data_format = penultima_data.strftime('%d/%m/%Y')
         hoje = datetime.today().strftime('%d/%m/%Y')
-        qr = self.adicionar_pedidos_por_data_bq(penultima_data_format,hoje,'pedidos_temp')
-        self.GBQ.executar_query(f"""
-            insert into {self.dataset}.pedidos
-            (select * from {self.dataset}.pedidos_temp where ide_codigo_item not in (select ide_codigo_item from {self.dataset}.pedidos));
-            drop table {self.dataset}.pedidos_temp
-        """)
-        return qr  
+        pedidos = self.obter_pedidos_por_data(data_inicio = penultima_data_format, data_fim = hoje, filtrar_apenas_alteracao="S", apenas_importado_api="N")
+        return self.carregar_pedidos(pedidos)
+
+    def carregar_pedidos(self, pedidos, tabela_temp = 'pedidos_temp', governador = None, substituir_existentes = False):
+        """
+        Função para incluir na tabela pedidos os itens de pedido ainda não carregados.
+        Usada pela atualização diária e pelo recebimento de webhooks (omie_webhook).
+        Entradas:
+            pedidos: Dados de pedidos em JSON.
+            tabela_temp (string): tabela temporária usada na carga.
+            governador (omie_memoria.GovernadorMemoria): se informado, mede a memória das etapas.
+            substituir_existentes (bool): se True, os pedidos já carregados (mesmo codigo_pedido) são
+                substituídos pela versão recebida, em vez de ignorados (pedidos alterados).
+        Saída: mensagem da carga.
+        """
+        etapa = self._etapa(governador)
+        with etapa('achatar', registros = len(pedidos)):
+            tabela = self.pedidos_arrow(pedidos)
+        if tabela.num_rows == 0:
+            return 'Adicionar Pedidos ao BQ: OK (sem pedidos)'
+        if substituir_existentes:
+            query = f"""
+                begin transaction;
+                delete from {self.dataset}.pedidos where codigo_pedido in (select codigo_pedido from {self.dataset}.{tabela_temp});
+                insert into {self.dataset}.pedidos (select * from {self.dataset}.{tabela_temp});
+                commit transaction;
+                drop table {self.dataset}.{tabela_temp}
+            """
+        else:
+            query = f"""
+                insert into {self.dataset}.pedidos
+                (select * from {self.dataset}.{tabela_temp} where ide_codigo_item not in (select ide_codigo_item from {self.dataset}.pedidos));
+                drop table {self.dataset}.{tabela_temp}
+            """
+        try:
+            with etapa('carregar', linhas = tabela.num_rows):
+                carregar_arrow(self.client, tabela, f'{self.dataset}.{tabela_temp}', substituir = True)
+            self.GBQ.executar_query(query)
+            msg = 'Adicionar Pedidos ao BQ: OK'
+        except: 
+            msg = 'Adicionar Pedidos ao BQ: NÃO OK'
+        return msg
+
+    def consultar_pedido(self, codigo_pedido):
+        """
+        Retorna um único pedido pelo código, no mesmo formato dos registros de ListarPedidos.
+        Levanta RuntimeError se a consulta falhar (ver _consultar_registro).
+        Ref: https://app.omie.com.br/api/v1/produtos/pedido/#ConsultarPedido
+        """
+        return self._consultar_registro(f'{self.BASE_URL}{self.PEDIDO_URL}', {"codigo_pedido": int(codigo_pedido)},
+            'ConsultarPedido', 'pedido_venda_produto')['pedido_venda_produto']
     
     
     def obter_produtos(self, attributes):
@@ -525,13 +812,16 @@ class omie:
         # O stop precisa do +1 pois a função range não inclui o stop, e precisamos inclusive da n-ésima página.
         pags = range(2,retorno_api['total_de_paginas']+1)
         produtos = retorno_api['produto_servico_cadastro']
+        self._arquivar('produto_servico_cadastro', retorno_api['produto_servico_cadastro'])
         print(f"Pág: 1 de um total de {retorno_api['total_de_paginas']}")
 
         # Iteração para obtermos todas as páginas de pedidos do período selecionado
         for p in pags:
             print(f"Pág: {p} de um total de {retorno_api['total_de_paginas']}")
             attributes.update({"pagina":p})
-            produtos.extend(self.obter_produtos(attributes)['produto_servico_cadastro'])
+            pagina = self.obter_produtos(attributes)['produto_servico_cadastro']
+            self._arquivar('produto_servico_cadastro', pagina)
+            produtos.extend(pagina)
 
         # Transformar o output em Pandas DataFrame.
         # produtos_df = self.produtos_df(produtos)
@@ -615,8 +905,8 @@ class omie:
         # Obter os dados de recebimentos de forma recorrente, para todas as páginas existentes.
         # A API obtém resultados apenas a partir da data considerada de início.
 
-        recebimentos = OMIE._requisicao_api_recorrente(
-            url = f'{OMIE.BASE_URL}produtos/recebimentonfe/', 
+        recebimentos = self._requisicao_api_recorrente(
+            url = f'{self.BASE_URL}produtos/recebimentonfe/', 
             attributes = {"nPagina": 1, "nRegistrosPorPagina": 500, "dtEmissaoDe":data_inicio, "dtEmissaoAte":data_fim},  
             chamado = "ListarRecebimentos", 
             chave = 'recebimentos', 
@@ -648,100 +938,124 @@ class omie:
         hoje = datetime.today().strftime('%d/%m/%Y')
         recebimentos = self.obter_recebimentos_por_data(penultima_data_format,hoje)
         print(f'Quant. Recebimentos: {len(recebimentos)}')
+
+        # Pré-filtro com os índices locais: descarta recebimentos de NFs já existentes em notas_fiscais
+        # e recebimentos já carregados, reduzindo o volume enviado. Chaves nulas nunca são descartadas aqui.
+        validas = recebimentos['cabec_cNumeroNFe'].notna() & recebimentos['cabec_cCNPJ_CPF'].notna()
+        chaves_nf = (recebimentos['cabec_cNumeroNFe'].astype(str) + recebimentos['cabec_cCNPJ_CPF'].astype(str)).where(validas)
+        duplicados = self._indice('nf_numero_cnpj').contem(chaves_nf)
+        duplicados |= self._indice('recebimentos_id').contem(recebimentos['cabec_nIdReceb'])
+        recebimentos = recebimentos[~duplicados]
+        print(f'Quant. Recebimentos novos: {len(recebimentos)}')
+        if len(recebimentos) == 0:
+            return 'Adicionar Recebimentos ao BQ: OK (sem recebimentos novos)'
+
         try:
-            recebimentos.to_gbq(
-                f'{self.dataset}.recebimentos_temp',
-                'evi-stitch',
-                chunksize=None,
-                if_exists='replace',
-                location = 'southamerica-east1')
-            
-            msg = 'Adicionar Recebimentos ao BQ: OK'
-            print(msg)
+            # Colunas convertidas no cliente para os tipos da tabela. Os índices locais podem estar
+            # desatualizados (outros processos/máquinas), então a inserção mantém a verificação no BigQuery.
+            tabela_arrow = para_arrow(recebimentos, self._schema('recebimentos'))
+            carregar_arrow(self.client, tabela_arrow, f'{self.dataset}.recebimentos_temp', substituir = True)
             self.GBQ.executar_query(f"""
-                delete from {self.dataset}.recebimentos_temp where concat(cabec_cNumeroNFE,cabec_cCNPJ_CPF) in (select concat(nNF, cnpj_cpf) from {self.dataset}.notas_fiscais);
+                delete from {self.dataset}.recebimentos_temp where concat(cabec_cNumeroNFe,cabec_cCNPJ_CPF) in (select concat(nNF, cnpj_cpf) from {self.dataset}.notas_fiscais);
                 insert into {self.dataset}.recebimentos
-                (select 
-                    cast(cabec_cCNPJ_CPF as	STRING) cabec_cCNPJ_CPF,
-                    cast(cabec_cChaveNFe as	STRING) cabec_cChaveNFe,
-                    cast(cabec_cEtapa as	STRING) cabec_cEtapa,
-                    cast(cabec_cModeloNFe as	STRING) cabec_cModeloNFe,
-                    cast(cabec_cNome as	STRING) cabec_cNome,
-                    cast(cabec_cNumeroNFe as	STRING) cabec_cNumeroNFe,
-                    cast(cabec_cRazaoSocial as	STRING) cabec_cRazaoSocial,
-                    cast(cabec_cSerieNFe as	STRING) cabec_cSerieNFe,
-                    cast(cabec_dEmissaoNFe as	STRING) cabec_dEmissaoNFe,
-                    cast(cabec_nIdFornecedor as	INT64) cabec_nIdFornecedor,
-                    cast(cabec_nIdReceb as	INT64) cabec_nIdReceb,
-                    cast(cabec_nValorNFe as	FLOAT64) cabec_nValorNFe,
-                    cast(infoAdicionais_cCategCompra as	STRING) infoAdicionais_cCategCompra,
-                    cast(infoAdicionais_dRegistro as	STRING) infoAdicionais_dRegistro,
-                    cast(infoAdicionais_nIdConta as	INT64) infoAdicionais_nIdConta,
-                    cast(parcelas_cCodParcela as	STRING) parcelas_cCodParcela,
-                    cast(parcelas_nQtdParcela as	INT64) parcelas_nQtdParcela,
-                    cast(totais_vAproxTributos as	FLOAT64) totais_vAproxTributos,
-                    cast(totais_vTotalCOFINS as	FLOAT64) totais_vTotalCOFINS,
-                    cast(totais_vTotalNFe as	FLOAT64) totais_vTotalNFe,
-                    cast(totais_vTotalPIS as	FLOAT64) totais_vTotalPIS,
-                    cast(totais_vTotalProdutos as	FLOAT64) totais_vTotalProdutos,
-                    cast(transporte_cTipoFrete as	STRING) transporte_cTipoFrete,
-                    cast(transporte_cEspecieVolume as	STRING) transporte_cEspecieVolume,
-                    cast(transporte_cMarcaVolume as	STRING) transporte_cMarcaVolume,
-                    cast(transporte_cNumeroVolume as	STRING) transporte_cNumeroVolume,
-                    cast(transporte_nIdTransportador as	FLOAT64) transporte_nIdTransportador,
-                    cast(transporte_nPesoBruto as	FLOAT64) transporte_nPesoBruto,
-                    cast(transporte_nPesoLiquido as	FLOAT64) transporte_nPesoLiquido,
-                    cast(transporte_nQtdeVolume as	STRING) transporte_nQtdeVolume,
-                    cast(totais_bcICMS as	FLOAT64) totais_bcICMS,
-                    cast(totais_vICMS as	FLOAT64) totais_vICMS,
-                    cast(totais_vTotalIPI as	FLOAT64) totais_vTotalIPI,
-                    cast(totais_vFrete as	FLOAT64) totais_vFrete,
-                    cast(totais_bcICMSST as	FLOAT64) totais_bcICMSST,
-                    cast(totais_vICMSSubstituicao as	FLOAT64) totais_vICMSSubstituicao,
-                    cast(transporte_cPlacaVeiculo as	STRING) transporte_cPlacaVeiculo,
-                    cast(transporte_cRNTRC as	STRING) transporte_cRNTRC,
-                    cast(transporte_cUFVeiculo as	STRING) transporte_cUFVeiculo,
-                    cast(totais_vTotalDescontos as	FLOAT64) totais_vTotalDescontos,
-                from {self.dataset}.recebimentos_temp
-                where cabec_nIdReceb not in (select cabec_nIdReceb from {self.dataset}.recebimentos)
-                );
-                drop table {self.dataset}.recebimentos_temp;
+                (select * from {self.dataset}.recebimentos_temp where cabec_nIdReceb is null
+                    or cabec_nIdReceb not in (select cabec_nIdReceb from {self.dataset}.recebimentos where cabec_nIdReceb is not null));
+                drop table {self.dataset}.recebimentos_temp
             """)
-            print('Exclusão recebimentos duplicados OK')
+            msg = 'Adicionar Recebimentos ao BQ: OK'
+            print(msg)
         except: 
-            msg = 'Adicionar Recebimentos ao BQ: NÃO OK'
+            return 'Adicionar Recebimentos ao BQ: NÃO OK'
+
+        try:
+            self._indice('recebimentos_id').adicionar(recebimentos['cabec_nIdReceb'])
+        except Exception as e:
+            print(f'Aviso: carga OK, mas o índice recebimentos_id não foi atualizado ({e!r})')
         return msg
         
-    def obter_cod_etapas_pedidos(self):
+    def _atualizar_dimensao(self, dataframe, tabela, carregar, forcar = False):
+        """
+        Função para atualizar tabelas de referência que raramente mudam.
+        Compara o hash do DataFrame normalizado com o hash da última carga da tabela e
+        só executa a carga no BigQuery se o conteúdo mudou (ou se forcar = True).
+        Entradas:
+            dataframe (Pandas DataFrame): dados normalizados da tabela.
+            tabela (string): nome da tabela no dataset.
+            carregar (função): recebe o DataFrame e executa a carga, retornando a mensagem.
+                O hash só é gravado se a carga não levantar exceção e a mensagem não indicar falha (carga_ok).
+        Saída: mensagem da carga, ou de que a carga foi ignorada.
+        """
+        chave = f'{self.dataset}.{tabela}'
+        hash_atual = hash_dataframe(dataframe)
+        if not forcar and self._ler_hashes_dimensoes().get(chave) == hash_atual:
+            msg = f'Tabela {chave} sem alterações: carga ignorada'
+            print(msg)
+            return msg
+
+        try:
+            msg = carregar(dataframe)
+        except Exception as e:
+            msg = f'Adicionar {chave} ao BQ: NÃO OK ({e!r})'
+        if not carga_ok(msg):
+            print(msg)
+            return msg
+
+        # Leitura e gravação sob lock (outras contas/processos podem gravar o mesmo arquivo);
+        # a gravação é atômica (arquivo temporário + rename).
+        with lock_arquivo(self.HASHES_DIMENSOES_PATH):
+            hashes = self._ler_hashes_dimensoes()
+            hashes[chave] = hash_atual
+            tmp = f'{self.HASHES_DIMENSOES_PATH}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(hashes, f, indent = 2)
+            os.replace(tmp, self.HASHES_DIMENSOES_PATH)
+        return msg
+
+    def _ler_hashes_dimensoes(self):
+        """ Hashes da última carga de cada dimensão. Arquivo ausente ou corrompido: nenhum hash (tudo é recarregado). """
+        try:
+            with open(self.HASHES_DIMENSOES_PATH) as f:
+                hashes = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f'Aviso: {self.HASHES_DIMENSOES_PATH} ilegível ({e!r}); as dimensões serão recarregadas')
+            return {}
+        return hashes if isinstance(hashes, dict) else {}
+
+    def obter_cod_etapas_pedidos(self, forcar = False):
         """
         Função para obter código das etapas de pedidos.
         """ 
         etapas = self.obter_dados_gerais('produtos/etapafat/','ListarEtapasFaturamento',{"pagina": 1, "registros_por_pagina": 100},'cadastros')
         etapas_df = pd.json_normalize(list(filter(None, etapas)), record_path = ['etapas'], meta = ['cCodOperacao','cDescOperacao'],sep = '_')
-        out = self.GBQ.dataframe_to_bq(etapas_df, self.dataset,'cod_etapas_pedidos')
+        out = self._atualizar_dimensao(etapas_df, 'cod_etapas_pedidos',
+            lambda df: self.GBQ.dataframe_to_bq(df, self.dataset,'cod_etapas_pedidos'), forcar)
         return out
 
-    def obter_situcao_trib_icms(self):
+    def obter_situcao_trib_icms(self, forcar = False):
         """
         Função para obter dados da situação tributária do ICMS.
         Ref: https://app.omie.com.br/api/v1/produtos/icmscst/#ListarCST
         """ 
         sit_trib_icms = self.obter_dados_gerais('produtos/icmscst/','ListarCST',{"pagina": 1, "registros_por_pagina": 100},'cadastros')
         sit_trib_icms_df = pd.json_normalize(sit_trib_icms,sep = '_')
-        out = self.GBQ.dataframe_to_bq(sit_trib_icms_df, self.dataset,'sit_trib_icms')
+        out = self._atualizar_dimensao(sit_trib_icms_df, 'sit_trib_icms',
+            lambda df: self.GBQ.dataframe_to_bq(df, self.dataset,'sit_trib_icms'), forcar)
         return out
 
-    def obter_categorias_nf(self):
+    def obter_categorias_nf(self, forcar = False):
         """
         Função para obter categorias das notas fiscais.
         Ref: https://app.omie.com.br/api/v1/geral/categorias/#ListarCategorias
         """ 
         categorias = self.obter_dados_gerais('geral/categorias/','ListarCategorias',{"pagina": 1, "registros_por_pagina": 500},'categoria_cadastro')
         categorias_df = pd.json_normalize(categorias,sep = '_')
-        out = self.GBQ.dataframe_to_bq(categorias_df, self.dataset,'categorias_nf')
+        out = self._atualizar_dimensao(categorias_df, 'categorias_nf',
+            lambda df: self.GBQ.dataframe_to_bq(df, self.dataset,'categorias_nf'), forcar)
         return out
 
-    def obter_cfop(self):
+    def obter_cfop(self, forcar = False):
         """
         Função para obter dados do CFOP dos produtos.
         Ref: https://app.omie.com.br/api/v1/produtos/cfop/#ListarCFOP
@@ -756,6 +1070,9 @@ class omie:
         cfop_keys = self.GBQ.executar_query(f'select * from {self.dataset}.cfop limit 0').keys()
         cols = list(cfop_keys)
         cfop_norm = normalizar_colunas(cfop_df, cols)
+        return self._atualizar_dimensao(cfop_norm, 'cfop', self._carregar_cfop, forcar)
+
+    def _carregar_cfop(self, cfop_norm):
         try:
             cfop_norm.to_gbq(
                 f'{self.dataset}.cfop',
@@ -790,17 +1107,21 @@ class omie:
             chave_tot_pags = 'total_de_paginas', 
             chave_total_registros = 'total_de_registros')
 
-        df = pd.json_normalize(clientes, sep = '_')
-        df['info_dAlt'] = pd.to_datetime(df['info_dAlt'], format='%d/%m/%Y')
-        df['info_dInc'] = pd.to_datetime(df['info_dInc'], format='%d/%m/%Y')
-        keys_info = self.GBQ.executar_query(f'select * from {self.dataset}.clientes limit 0').keys()
-        cols = list(keys_info)
-        
-        out = normalizar_colunas(df, cols)
-        print(out.keys())
+        # Normalizar colunas e tipos (inclusive datas DD/MM/YYYY) conforme o schema da tabela de clientes
+        return self.clientes_df(clientes)
 
-        out = df
-        return out
+    def clientes_df(self, clientes):
+        """ Converte os clientes em JSON para Pandas DataFrame, com os tipos da tabela de clientes. """
+        return tipar_dataframe(pd.json_normalize(clientes, sep = '_'), self._schema('clientes'))
+
+    def consultar_cliente(self, codigo_cliente_omie):
+        """
+        Retorna um único cliente pelo código, no mesmo formato dos registros de ListarClientes.
+        Levanta RuntimeError se a consulta falhar (ver _consultar_registro).
+        Ref: https://app.omie.com.br/api/v1/geral/clientes/#ConsultarCliente
+        """
+        return self._consultar_registro(f'{self.BASE_URL}geral/clientes/', {"codigo_cliente_omie": int(codigo_cliente_omie)},
+            'ConsultarCliente', 'codigo_cliente_omie')
 
     def atualizacao_diaria_clientes(self):
         """
@@ -819,44 +1140,55 @@ class omie:
         hoje = datetime.today().strftime('%d/%m/%Y')
         # hoje = '30/07/2021'
         clientes = self.obter_clientes_por_data(penultima_data_format,hoje)
-        keys_info = self.GBQ.executar_query(f'select * from {self.dataset}.clientes limit 0').keys()
-        cols = list(keys_info)
-        
-        clientes = normalizar_colunas(clientes, cols)
-        print(clientes.keys())
-        
+        return self.carregar_clientes(clientes)
+
+    def carregar_clientes(self, clientes, substituir_existentes = False):
+        """
+        Função para incluir na tabela clientes os clientes ainda não carregados.
+        Usada pela atualização diária e pelo recebimento de webhooks (omie_webhook).
+        Entradas:
+            clientes (Pandas DataFrame, ver obter_clientes_por_data / clientes_df).
+            substituir_existentes (bool): se True, os clientes já carregados (mesmo codigo_cliente_omie)
+                são substituídos pela versão recebida, em vez de ignorados (clientes alterados).
+        Saída: mensagem da carga.
+        """
         print(f'Quant. Clientes: {len(clientes)}')
+
+        if substituir_existentes:
+            # Sem o código não há o que substituir: linhas sem codigo_cliente_omie não são carregadas.
+            clientes = clientes[clientes['codigo_cliente_omie'].notna()]
+            query = f"""
+                begin transaction;
+                delete from {self.dataset}.clientes where codigo_cliente_omie in (select codigo_cliente_omie from {self.dataset}.clientes_temp);
+                insert into {self.dataset}.clientes (select * from {self.dataset}.clientes_temp);
+                commit transaction;
+                drop table {self.dataset}.clientes_temp
+            """
+        else:
+            query = f"""
+                insert into {self.dataset}.clientes
+                (select * from {self.dataset}.clientes_temp where codigo_cliente_omie is null
+                    or codigo_cliente_omie not in (select codigo_cliente_omie from {self.dataset}.clientes where codigo_cliente_omie is not null));
+                drop table {self.dataset}.clientes_temp
+            """
+        if len(clientes) == 0:
+            return 'Adicionar clientes ao BQ: OK (sem clientes)'
+
         try:
-            clientes.to_gbq(
-                f'{self.dataset}.clientes_temp',
-                'evi-stitch',
-                chunksize=None,
-                if_exists='replace',
-                location = 'southamerica-east1')
-            
+            # Colunas já tipadas conforme a tabela (ver obter_clientes_por_data).
+            carregar_arrow(self.client, para_arrow(clientes, self._schema('clientes')), f'{self.dataset}.clientes_temp', substituir = True)
+            self.GBQ.executar_query(query)
             msg = 'Adicionar clientes ao BQ: OK'
             print(msg)
-            self.GBQ.executar_query(f"""
-            insert into {self.dataset}.clientes
-            (select * except(cnae, fax_ddd, fax_numero, telefone2_ddd, telefone2_numero, optante_simples_nacional),
-            cast(cnae as string) cnae,
-            cast(fax_ddd as string) fax_ddd,
-            cast(fax_numero as string) fax_numero,
-            cast(telefone2_ddd as string) telefone2_ddd,
-            cast(telefone2_numero as string) telefone2_numero,
-            cast(optante_simples_nacional as string) optante_simples_nacional 
-            from {self.dataset}.clientes_temp where codigo_cliente_omie not in (select codigo_cliente_omie from {self.dataset}.clientes));
-            drop table {self.dataset}.clientes_temp
-        """)
-            print('Exclusão clientes duplicados OK')
         except: 
             msg = 'Adicionar clientes ao BQ: NÃO OK'
-            
         return msg
 
 if __name__ == '__main__':
+    from modulos.utils.projeto import get_config
     import time
     start = time.time()
+    config = get_config()
     OMIE =  omie(key = config['omie_estoca']['key'], secret = config['omie_estoca']['secret'])
     nfs = OMIE.obter_notas_fiscais_por_data('06/05/2022','16/10/2022')
     ped = OMIE.obter_pedidos_por_data('06/05/2020','16/10/2022')
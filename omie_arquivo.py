@@ -0,0 +1,193 @@
+"""
+Arquivo das respostas brutas da API Omie (JSON-lines comprimido com zstd) com índice
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-13
+
+Cada página retornada pela API é gravada, sem transformação, como um frame zstd
+independente (um registro JSON por linha) anexado ao segmento atual da entidade.
+Um índice SQLite ao lado dos segmentos guarda, para cada registro, a entidade, a data,
+o id e a posição do frame. Assim as transformações (*_df) podem ser refeitas sobre
+qualquer intervalo de datas lendo apenas os frames necessários, sem consultar a API.
+Vários processos podem gravar no mesmo arquivo: cada gravação (anexar o frame ao segmento
+e atualizar o índice) é feita sob um lock de arquivo (omie_indice_chaves.lock_arquivo).
+
+Estrutura:
+    <root>/indice.sqlite
+    <root>/<entidade>/<segmento>.jsonl.zst
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import zstandard
+
+from omie_indice_chaves import lock_arquivo
+
+# Entidades arquivadas (chave da resposta da API): caminho do id e da data de referência de cada registro.
+ENTIDADES = {
+    'nfCadastro': {'id': ['compl', 'nIdNF'], 'data': ['ide', 'dEmi']},
+    'pedido_venda_produto': {'id': ['cabecalho', 'codigo_pedido'], 'data': ['infoCadastro', 'dInc']},
+    'produto_servico_cadastro': {'id': ['codigo_produto'], 'data': ['info', 'dInc']},
+    'recebimentos': {'id': ['cabec', 'nIdReceb'], 'data': ['cabec', 'dEmissaoNFe']},
+    'clientes_cadastro': {'id': ['codigo_cliente_omie'], 'data': ['info', 'dInc']},
+}
+
+# Quantidade de ids por consulta ao índice (o SQLite limita o número de parâmetros por comando).
+IDS_POR_CONSULTA = 500
+
+
+def _campo(registro, caminho):
+    for chave in caminho:
+        if not isinstance(registro, dict):
+            return None
+        registro = registro.get(chave)
+    return registro
+
+
+def _id(registro, caminho):
+    # Registros sem id são indexados com id nulo (e não com o texto 'None').
+    valor = _campo(registro, caminho)
+    return None if valor is None else str(valor)
+
+
+def _data_iso(valor):
+    # Datas do Omie vêm em DD/MM/YYYY; o índice usa YYYY-MM-DD para permitir comparação por intervalo.
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%d/%m/%Y').strftime('%Y-%m-%d')
+    except ValueError:
+        return str(valor)[:10]
+
+
+def _data_param(valor):
+    # Aceita DD/MM/YYYY (padrão da API) ou YYYY-MM-DD.
+    return _data_iso(valor) if '/' in valor else valor
+
+
+class ArquivoRespostas:
+
+    def __init__(self, root = os.path.join('cache', 'arquivo_omie'), tamanho_segmento = 256 * 1024 * 1024, nivel = 10):
+        """
+        Entradas:
+            root (string): diretório do arquivo.
+            tamanho_segmento (int): tamanho (bytes) a partir do qual um novo segmento é iniciado.
+            nivel (int): nível de compressão zstd.
+        """
+        self.root = root
+        self.tamanho_segmento = tamanho_segmento
+        self._compressor = zstandard.ZstdCompressor(level = nivel)
+        os.makedirs(root, exist_ok = True)
+        # Páginas podem ser gravadas por várias threads (ex.: omie_backfill) e por vários processos:
+        # as gravações são serializadas pelo lock da instância e pelo lock de arquivo do índice.
+        self._lock = threading.Lock()
+        self._indice_path = os.path.join(root, 'indice.sqlite')
+        self._db = sqlite3.connect(self._indice_path, check_same_thread = False)
+        self._db.executescript("""
+            create table if not exists registros (
+                entidade text, id text, data text, segmento text,
+                inicio integer, tamanho integer, gravado_em text);
+            create index if not exists idx_entidade_data on registros (entidade, data);
+            create index if not exists idx_entidade_id on registros (entidade, id);
+        """)
+
+    def _segmento_atual(self, entidade):
+        pasta = os.path.join(self.root, entidade)
+        os.makedirs(pasta, exist_ok = True)
+        segmentos = sorted(s for s in os.listdir(pasta) if s.endswith('.jsonl.zst'))
+        if segmentos and os.path.getsize(os.path.join(pasta, segmentos[-1])) < self.tamanho_segmento:
+            return os.path.join(entidade, segmentos[-1])
+        return os.path.join(entidade, f'{len(segmentos):06d}.jsonl.zst')
+
+    def gravar_pagina(self, entidade, registros):
+        """
+        Anexa uma página de registros brutos ao arquivo da entidade e atualiza o índice.
+        Entradas: entidade (string, ver ENTIDADES); registros (lista de dicts da resposta da API).
+        """
+        if not registros:
+            return
+        conf = ENTIDADES[entidade]
+        frame = self._compressor.compress(
+            ''.join(json.dumps(r, ensure_ascii = False) + '\n' for r in registros).encode('utf-8'))
+
+        agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock, lock_arquivo(self._indice_path):
+            segmento = self._segmento_atual(entidade)
+            with open(os.path.join(self.root, segmento), 'ab') as f:
+                inicio = f.tell()
+                f.write(frame)
+
+            self._db.executemany('insert into registros values (?, ?, ?, ?, ?, ?, ?)', [
+                (entidade, _id(r, conf['id']), _data_iso(_campo(r, conf['data'])), segmento, inicio, len(frame), agora)
+                for r in registros
+            ])
+            self._db.commit()
+
+    def _ler_frame(self, segmento, inicio, tamanho):
+        with open(os.path.join(self.root, segmento), 'rb') as f:
+            f.seek(inicio)
+            dados = zstandard.ZstdDecompressor().decompress(f.read(tamanho))
+        return [json.loads(linha) for linha in dados.decode('utf-8').splitlines()]
+
+    def ler(self, entidade, data_de = None, data_ate = None, ids = None, ultima_versao = True):
+        """
+        Lê os registros brutos arquivados de uma entidade, descomprimindo apenas os frames necessários.
+        Entradas:
+            data_de, data_ate (string DD/MM/YYYY ou YYYY-MM-DD): intervalo fechado da data de referência.
+            ids (lista): filtra por ids específicos.
+            ultima_versao (bool): mantém apenas a versão mais recente de cada id
+                (registros sem id são sempre mantidos, ao final da lista).
+        Saída: lista de dicts, no mesmo formato da resposta da API (entrada dos métodos *_df).
+        """
+        conf = ENTIDADES[entidade]
+        filtros, params = ['entidade = ?'], [entidade]
+        if data_de is not None:
+            filtros.append('data >= ?'); params.append(_data_param(data_de))
+        if data_ate is not None:
+            filtros.append('data <= ?'); params.append(_data_param(data_ate))
+        consulta = f'select distinct segmento, inicio, tamanho from registros where {" and ".join(filtros)}'
+
+        # Com ids, a consulta é repetida por blocos de IDS_POR_CONSULTA ids e os frames são unidos.
+        frames = set()
+        with self._lock:
+            if ids is None:
+                frames.update(self._db.execute(consulta, params).fetchall())
+            else:
+                ids = list(dict.fromkeys(str(i) for i in ids))
+                for i in range(0, len(ids), IDS_POR_CONSULTA):
+                    bloco = ids[i:i + IDS_POR_CONSULTA]
+                    frames.update(self._db.execute(
+                        consulta + f' and id in ({",".join("?" * len(bloco))})', params + bloco).fetchall())
+        frames = sorted(frames, key = lambda f: (f[0], f[1]))
+
+        data_de = _data_param(data_de) if data_de is not None else None
+        data_ate = _data_param(data_ate) if data_ate is not None else None
+        ids = set(ids) if ids is not None else None
+        registros = {} if ultima_versao else []
+        sem_id = []
+        for segmento, inicio, tamanho in frames:
+            for r in self._ler_frame(segmento, inicio, tamanho):
+                data = _data_iso(_campo(r, conf['data']))
+                id_registro = _id(r, conf['id'])
+                if data_de is not None and (data is None or data < data_de):
+                    continue
+                if data_ate is not None and (data is None or data > data_ate):
+                    continue
+                if ids is not None and id_registro not in ids:
+                    continue
+                if not ultima_versao:
+                    registros.append(r)
+                elif id_registro is None:
+                    # Sem id não há como identificar versões: todos os registros são mantidos.
+                    sem_id.append(r)
+                else:
+                    registros.pop(id_registro, None)
+                    registros[id_registro] = r
+        return list(registros.values()) + sem_id if ultima_versao else registros
+
+    def fechar(self):
+        self._db.close()
@@ -0,0 +1,141 @@
+"""
+Representação colunar (Arrow) dos registros do Omie
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-15
+
+Os métodos *_df achatam os registros em DataFrames largos de strings (dtype object),
+e cada etapa (pd.Series por campo, concat, normalizar_colunas) copia o DataFrame
+inteiro. Aqui os registros são achatados linha a linha em dicts que apenas referenciam
+os valores do JSON, e cada coluna do schema da tabela de destino é convertida
+isoladamente para o tipo Arrow nativo (inteiros, decimais, datas). Colunas de texto
+com poucos valores distintos (CFOP, NCM, UF, CNPJ, etapa, categoria) são codificadas
+como dicionário. A conversão para pandas só acontece nas pontas (para_pandas).
+"""
+
+import pandas as pd
+import pyarrow as pa
+
+from omie_schema import converter_coluna
+
+# Metas de cada entidade que são expandidas em colunas (mesma ordem dos métodos *_df).
+META_NOTAS_FISCAIS = ['compl', 'info', 'ide', 'prod', ['total', 'ICMSTot'], ['total', 'ISSQNtot'], ['total', 'retTrib'],
+    'nfDestInt', 'nfEmitInt', 'pedido', 'titulos']
+META_PEDIDOS = ['cabecalho', 'total_pedido', 'lista_parcelas', 'frete', 'infoCadastro', 'informacoes_adicionais', 'observacoes']
+
+# Colunas de pedidos que sempre foram gravadas com astype(str): os nulos ficam como o texto 'nan',
+# mesma representação das linhas já existentes na tabela pedidos (e dos filtros = 'nan').
+COLUNAS_NAN_PEDIDOS = ['dCan', 'hCan', 'uCan', 'cImpAPI']
+
+TIPOS_ARROW = {
+    'STRING': pa.string(), 'INT64': pa.int64(), 'INTEGER': pa.int64(),
+    'FLOAT64': pa.float64(), 'FLOAT': pa.float64(), 'NUMERIC': pa.float64(),
+    'BOOL': pa.bool_(), 'BOOLEAN': pa.bool_(), 'DATE': pa.date32(),
+    'DATETIME': pa.timestamp('us'), 'TIMESTAMP': pa.timestamp('us', tz = 'UTC'),
+}
+
+# Uma coluna de texto é codificada como dicionário se tiver no máximo esta fração de valores distintos.
+FRACAO_DICIONARIO = 0.5
+
+
+def _achatar(registro, prefixo = '', saida = None):
+    # Mesmo achatamento do pd.json_normalize(sep = '_'): dicts aninhados viram colunas, listas são mantidas.
+    saida = {} if saida is None else saida
+    for chave, valor in registro.items():
+        nome = f'{prefixo}{chave}'
+        if isinstance(valor, dict):
+            _achatar(valor, f'{nome}_', saida)
+        else:
+            saida[nome] = valor
+    return saida
+
+
+def _meta(registro, caminho):
+    for chave in caminho if isinstance(caminho, list) else [caminho]:
+        if not isinstance(registro, dict):
+            return None
+        registro = registro.get(chave)
+    return registro
+
+
+def achatar_itens(registros, meta, record_path = 'det'):
+    """
+    Gera uma linha (dict) por item de cada registro, como o par json_normalize + pd.Series dos métodos *_df:
+    os campos do item são achatados e os campos de cada meta são expandidos em um nível.
+    Em caso de nomes repetidos, vale a primeira ocorrência (como em normalizar_colunas).
+    Entradas: registros (lista de dicts da API); meta (lista de caminhos); record_path (string).
+    Saída: gerador de dicts.
+    """
+    for registro in registros:
+        metas = [_meta(registro, caminho) for caminho in meta]
+        for item in registro.get(record_path) or []:
+            linha = _achatar(item)
+            for valor in metas:
+                if isinstance(valor, dict):
+                    for chave, campo in valor.items():
+                        linha.setdefault(chave, campo)
+            yield linha
+
+
+def nulos_como_nan(linhas, colunas):
+    """ Substitui os nulos das colunas informadas pelo texto 'nan' em cada linha (dict). """
+    for linha in linhas:
+        for coluna in colunas:
+            valor = linha.get(coluna)
+            if valor is None or (pd.api.types.is_scalar(valor) and pd.isna(valor)):
+                linha[coluna] = 'nan'
+        yield linha
+
+
+def coluna_arrow(valores, tipo, fracao_dicionario = FRACAO_DICIONARIO):
+    """
+    Converte uma lista de valores em um array Arrow do tipo BigQuery informado.
+    Strings de baixa cardinalidade viram arrays de dicionário.
+    """
+    tipo = tipo.upper()
+    serie = converter_coluna(pd.Series(valores, dtype = 'object'), tipo)
+    array = pa.array(serie, type = TIPOS_ARROW.get(tipo, pa.string()), from_pandas = True)
+    if pa.types.is_string(array.type) and len(array) > 0:
+        codificado = array.dictionary_encode()
+        if len(codificado.dictionary) <= fracao_dicionario * len(array):
+            return codificado
+    return array
+
+
+def tabela_arrow(linhas, schema, fracao_dicionario = FRACAO_DICIONARIO):
+    """
+    Monta uma tabela Arrow com as colunas e tipos de uma tabela do BigQuery, convertendo uma coluna por vez.
+    Entradas: linhas (iterável de dicts achatados); schema: lista de tuplas (coluna, tipo BigQuery).
+    Saída: pyarrow.Table
+    """
+    linhas = list(linhas)
+    colunas, campos = [], []
+    for coluna, tipo in schema:
+        array = coluna_arrow([linha.get(coluna) for linha in linhas], tipo, fracao_dicionario)
+        colunas.append(array)
+        campos.append(pa.field(coluna, array.type))
+    return pa.Table.from_arrays(colunas, schema = pa.schema(campos))
+
+
+def notas_fiscais_arrow(notas_fiscais, schema):
+    """ Equivalente colunar de omie.notas_fiscais_df: uma linha por item (det) de cada NF. """
+    return tabela_arrow(achatar_itens(notas_fiscais, META_NOTAS_FISCAIS), schema)
+
+
+def pedidos_arrow(pedidos, schema):
+    """ Equivalente colunar de omie.pedidos_df: uma linha por item (det) de cada pedido. """
+    return tabela_arrow(nulos_como_nan(achatar_itens(pedidos, META_PEDIDOS), COLUNAS_NAN_PEDIDOS), schema)
+
+
+def sem_dicionario(tabela):
+    """ Decodifica as colunas de dicionário (para destinos que não aceitam o tipo). """
+    campos = [pa.field(c.name, c.type.value_type) if pa.types.is_dictionary(c.type) else c for c in tabela.schema]
+    return tabela.cast(pa.schema(campos))
+
+
+def para_pandas(tabela):
+    """
+    Converte a tabela Arrow em Pandas DataFrame: colunas de dicionário viram Categorical,
+    inteiros com nulos viram Int64 e datas continuam datas.
+    """
+    return tabela.to_pandas(types_mapper = {pa.int64(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype()}.get, date_as_object = False)
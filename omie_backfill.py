@@ -0,0 +1,228 @@
+"""
+Backfill do Omie em janelas de data paralelas, com checkpoint por janela
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-17
+
+Os métodos obter_*_por_data percorrem uma única sequência de páginas ordenada por
+CODIGO: registros incluídos durante a execução deslocam as páginas, e o intervalo
+não pode ser dividido entre workers. Aqui o intervalo filtrar_por_data_de/ate é
+dividido em janelas menores, com tamanho adaptado ao total_de_registros que cada
+janela informa (janelas com registros demais são divididas ao meio). As janelas são
+baixadas em paralelo e cada janela concluída é salva em disco (checkpoint), de forma
+que uma execução interrompida continua de onde parou. Plano e checkpoints mais antigos
+que max_idade_horas são refeitos (registros alterados no Omie depois do checkpoint não
+seriam vistos), e refazer = True (--refazer) ignora tudo o que está em disco. Registros
+repetidos entre janelas vizinhas são descartados pela chave da entidade.
+
+Uso:
+    backfill = BackfillOmie(OMIE, 'notas_fiscais')
+    nfs = backfill.executar('06/05/2020', '16/10/2022')
+    df = OMIE.notas_fiscais_df(nfs)
+"""
+
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+# Entidades com filtro filtrar_por_data_de/ate: endpoint, chamado, chave da lista na resposta,
+# caminho da chave primária e atributos fixos (os mesmos usados pelos métodos obter_*_por_data).
+ENTIDADES = {
+    'notas_fiscais': {
+        'url': 'produtos/nfconsultar/', 'chamado': 'ListarNF', 'chave': 'nfCadastro', 'id': ['compl', 'nIdNF'],
+        'atributos': {'ordenar_por': 'CODIGO', 'apenas_importado_api': 'N', 'filtrar_apenas_inclusao': 'N', 'filtrar_apenas_alteracao': 'S'}},
+    'pedidos': {
+        'url': 'produtos/pedido/', 'chamado': 'ListarPedidos', 'chave': 'pedido_venda_produto', 'id': ['cabecalho', 'codigo_pedido'],
+        'atributos': {'ordenar_por': 'CODIGO', 'apenas_importado_api': 'N', 'filtrar_apenas_inclusao': 'N', 'filtrar_apenas_alteracao': 'S'}},
+    'produtos': {
+        'url': 'geral/produtos/', 'chamado': 'ListarProdutos', 'chave': 'produto_servico_cadastro', 'id': ['codigo_produto'],
+        'atributos': {'apenas_importado_api': 'N', 'filtrar_apenas_omiepdv': 'N'}},
+    'clientes': {
+        'url': 'geral/clientes/', 'chamado': 'ListarClientes', 'chave': 'clientes_cadastro', 'id': ['codigo_cliente_omie'],
+        'atributos': {'filtrar_apenas_inclusao': 'N', 'filtrar_apenas_alteracao': 'N'}},
+}
+
+FORMATO_API = '%d/%m/%Y'
+
+
+def _data(valor):
+    return datetime.strptime(valor, FORMATO_API).date() if isinstance(valor, str) else valor
+
+
+def _chave(registro, caminho):
+    for campo in caminho:
+        registro = registro.get(campo) if isinstance(registro, dict) else None
+    return registro
+
+
+class BackfillOmie:
+
+    def __init__(self, omie, entidade, pasta = None, max_registros = 10000, registros_por_pagina = 500, n_workers = 4,
+                 max_idade_horas = 24):
+        """
+        Entradas:
+            omie (omie.omie): cliente da conta Omie.
+            entidade (string): ver ENTIDADES.
+            pasta (string): diretório dos checkpoints. Padrão: cache/backfill/<dataset>_<entidade>.
+            max_registros (int): quantidade máxima de registros por janela; janelas maiores são divididas.
+            registros_por_pagina (int): tamanho da página nas consultas das janelas.
+            n_workers (int): janelas consultadas em paralelo.
+            max_idade_horas (float): idade máxima do plano e dos checkpoints reaproveitados (None: sem limite).
+        """
+        self.omie = omie
+        self.entidade = entidade
+        self.conf = ENTIDADES[entidade]
+        self.pasta = pasta or os.path.join('cache', 'backfill', f'{omie.dataset}_{entidade}')
+        self.max_registros = max_registros
+        self.registros_por_pagina = registros_por_pagina
+        self.n_workers = n_workers
+        self.max_idade_horas = max_idade_horas
+
+    def _reaproveitar(self, caminho):
+        # Arquivo em disco (plano ou checkpoint) existente e dentro da idade máxima.
+        if not os.path.exists(caminho):
+            return False
+        return self.max_idade_horas is None or time.time() - os.path.getmtime(caminho) < self.max_idade_horas * 3600
+
+    def _pagina(self, de, ate, pagina, registros_por_pagina):
+        atributos = dict(self.conf['atributos'], pagina = pagina, registros_por_pagina = registros_por_pagina,
+            filtrar_por_data_de = de.strftime(FORMATO_API), filtrar_por_data_ate = ate.strftime(FORMATO_API))
+        resposta = self.omie._requisicao_api(f'{self.omie.BASE_URL}{self.conf["url"]}', atributos, self.conf['chamado']).json()
+        if self.conf['chave'] not in resposta:
+            # Janela sem registros: a API responde com faultstring em vez de uma lista vazia.
+            if 'Não existem registros' not in str(resposta.get('faultstring', '')):
+                raise RuntimeError(f'Erro na consulta {self.conf["chamado"]} ({de} a {ate}): {resposta}')
+            return {self.conf['chave']: [], 'total_de_registros': 0, 'total_de_paginas': 0}
+        return resposta
+
+    def contar(self, de, ate):
+        """ Total de registros de uma janela (consulta de uma página com um registro). """
+        return self._pagina(de, ate, 1, 1)['total_de_registros']
+
+    def _caminho_plano(self, de, ate):
+        return os.path.join(self.pasta, f'plano_{de.isoformat()}_{ate.isoformat()}.json')
+
+    def _caminho_janela(self, janela):
+        return os.path.join(self.pasta, 'janelas', f'{janela["de"]}_{janela["ate"]}.json.gz')
+
+    def planejar(self, data_de, data_ate, refazer = False):
+        """
+        Divide o intervalo em janelas com no máximo max_registros cada (ou de um único dia).
+        As contagens de cada nível da divisão são feitas em paralelo. O plano é salvo em disco
+        e reaproveitado ao retomar o mesmo intervalo (se tiver menos de max_idade_horas e refazer = False).
+        Entradas: data_de, data_ate (string DD/MM/YYYY ou date).
+        Saída: lista de janelas {'de', 'ate' (YYYY-MM-DD), 'registros'} em ordem cronológica.
+        """
+        de, ate = _data(data_de), _data(data_ate)
+        caminho = self._caminho_plano(de, ate)
+        if not refazer and self._reaproveitar(caminho):
+            with open(caminho) as f:
+                return json.load(f)
+
+        janelas, pendentes = [], [(de, ate)]
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            while pendentes:
+                contagens = list(executor.map(lambda j: self.contar(*j), pendentes))
+                proximos = []
+                for (inicio, fim), total in zip(pendentes, contagens):
+                    if total > self.max_registros and fim > inicio:
+                        meio = inicio + (fim - inicio) // 2
+                        proximos.extend([(inicio, meio), (meio + timedelta(days = 1), fim)])
+                    elif total > 0:
+                        janelas.append({'de': inicio.isoformat(), 'ate': fim.isoformat(), 'registros': total})
+                pendentes = proximos
+        janelas.sort(key = lambda j: j['de'])
+
+        os.makedirs(self.pasta, exist_ok = True)
+        with open(caminho, 'w') as f:
+            json.dump(janelas, f, indent = 1)
+        print(f'{self.entidade}: {len(janelas)} janelas, {sum(j["registros"] for j in janelas)} registros')
+        return janelas
+
+    def baixar_janela(self, janela):
+        """
+        Consulta todas as páginas de uma janela e salva o checkpoint (gravação atômica).
+        Páginas também são gravadas no arquivo de respostas do cliente, se houver.
+        Saída: quantidade de registros da janela.
+        """
+        de, ate = date.fromisoformat(janela['de']), date.fromisoformat(janela['ate'])
+        resposta = self._pagina(de, ate, 1, self.registros_por_pagina)
+        registros = list(resposta[self.conf['chave']])
+        self.omie._arquivar(self.conf['chave'], resposta[self.conf['chave']])
+        for p in range(2, resposta['total_de_paginas'] + 1):
+            pagina = self._pagina(de, ate, p, self.registros_por_pagina)[self.conf['chave']]
+            self.omie._arquivar(self.conf['chave'], pagina)
+            registros.extend(pagina)
+
+        caminho = self._caminho_janela(janela)
+        os.makedirs(os.path.dirname(caminho), exist_ok = True)
+        with gzip.open(f'{caminho}.tmp', 'wt', encoding = 'utf-8') as f:
+            json.dump(registros, f, ensure_ascii = False)
+        os.replace(f'{caminho}.tmp', caminho)
+        return len(registros)
+
+    def registros(self, janelas):
+        """
+        Junta os checkpoints das janelas, descartando registros repetidos entre janelas
+        (vale a ocorrência da janela mais recente). Registros sem chave são todos mantidos.
+        """
+        unicos, sem_chave = {}, []
+        for janela in janelas:
+            with gzip.open(self._caminho_janela(janela), 'rt', encoding = 'utf-8') as f:
+                for registro in json.load(f):
+                    chave = _chave(registro, self.conf['id'])
+                    if chave is None:
+                        sem_chave.append(registro)
+                        continue
+                    unicos.pop(chave, None)
+                    unicos[chave] = registro
+        return list(unicos.values()) + sem_chave
+
+    def executar(self, data_de, data_ate, refazer = False):
+        """
+        Planeja (ou retoma) o backfill do intervalo e baixa em paralelo as janelas sem checkpoint
+        (ou com checkpoint mais antigo que max_idade_horas).
+        Entradas:
+            data_de, data_ate (string DD/MM/YYYY ou date).
+            refazer (bool): ignora o plano e os checkpoints em disco e baixa todas as janelas novamente.
+        Saída: lista de registros únicos, no formato da API (entrada dos métodos *_df).
+        """
+        janelas = self.planejar(data_de, data_ate, refazer)
+        pendentes = [j for j in janelas if refazer or not self._reaproveitar(self._caminho_janela(j))]
+        print(f'{self.entidade}: {len(janelas) - len(pendentes)} janelas já concluídas, {len(pendentes)} pendentes')
+
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            futuros = {executor.submit(self.baixar_janela, j): j for j in pendentes}
+            for n, futuro in enumerate(as_completed(futuros), start = 1):
+                janela = futuros[futuro]
+                print(f'Janela {janela["de"]} a {janela["ate"]}: {futuro.result()} registros ({n}/{len(pendentes)})')
+
+        registros = self.registros(janelas)
+        print(f'{self.entidade}: {len(registros)} registros únicos')
+        return registros
+
+
+if __name__ == '__main__':
+    import argparse
+    from modulos.utils.projeto import get_config
+    from omie import omie
+
+    parser = argparse.ArgumentParser(description = 'Backfill do Omie em janelas de data paralelas')
+    parser.add_argument('entidade', choices = list(ENTIDADES))
+    parser.add_argument('data_de', help = 'DD/MM/YYYY')
+    parser.add_argument('data_ate', help = 'DD/MM/YYYY')
+    parser.add_argument('--conta', default = 'omie_estoca')
+    parser.add_argument('--max-registros', type = int, default = 10000)
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--max-idade-horas', type = float, default = 24)
+    parser.add_argument('--refazer', action = 'store_true', help = 'ignora o plano e os checkpoints em disco')
+    args = parser.parse_args()
+
+    config = get_config()
+    OMIE = omie(key = config[args.conta]['key'], secret = config[args.conta]['secret'])
+    backfill = BackfillOmie(OMIE, args.entidade, max_registros = args.max_registros, n_workers = args.workers,
+                            max_idade_horas = args.max_idade_horas)
+    backfill.executar(args.data_de, args.data_ate, refazer = args.refazer)
@@ -0,0 +1,157 @@
+"""
+Índice local de chaves já carregadas no BigQuery
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-06
+
+Guarda, em um array NumPy ordenado salvo em disco, as chaves que já existem em uma
+tabela do BigQuery (ex.: pares número da NF + CNPJ, ou IDs de recebimento).
+Permite descartar registros duplicados antes do upload, sem varrer a tabela inteira.
+Chaves de texto são armazenadas como hash de 64 bits; chaves inteiras, diretamente.
+
+O índice é apenas um pré-filtro: a carga continua protegida pela verificação no BigQuery.
+Como vários processos podem usar o mesmo arquivo (atualização diária, webhooks), o
+arquivo é relido quando muda em disco, e cada gravação une as chaves do arquivo às
+chaves novas, sob um lock de arquivo (fcntl no Linux/macOS, msvcrt no Windows).
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+@contextmanager
+def lock_arquivo(path):
+    """
+    Lock exclusivo entre processos sobre o arquivo `path` (usa `path`.lock).
+    fcntl.flock no Linux/macOS; msvcrt.locking no Windows.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    with open(f'{path}.lock', 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            # LK_LOCK desiste após ~10 s de espera (OSError): tenta novamente até obter o lock.
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        else:
+            raise OSError('Lock de arquivo indisponível nesta plataforma (sem fcntl e sem msvcrt)')
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class IndiceChaves:
+
+    def __init__(self, path, tipo = 'texto'):
+        """
+        Entradas:
+            path (string): arquivo .npy do índice.
+            tipo (string): 'texto' (chaves são hasheadas) ou 'inteiro'.
+        """
+        self.path = path
+        self.tipo = tipo
+        self.chaves = None
+        self._mtime = None
+        self._recarregar()
+
+    @property
+    def existe(self):
+        return self.chaves is not None
+
+    def __len__(self):
+        return 0 if self.chaves is None else len(self.chaves)
+
+    def _recarregar(self, forcar = False):
+        # Relê o arquivo se ele foi alterado (por este ou outro processo) desde a última leitura.
+        if not os.path.exists(self.path):
+            return
+        mtime = os.path.getmtime(self.path)
+        if forcar or mtime != self._mtime:
+            self.chaves = np.load(self.path)
+            self._mtime = mtime
+
+    def _lock_arquivo(self):
+        return lock_arquivo(self.path)
+
+    def _codificar(self, chaves):
+        """
+        Saída: (códigos das chaves válidas, máscara das chaves válidas).
+        Chaves nulas (ou não numéricas, no tipo 'inteiro') não são codificadas.
+        """
+        chaves = pd.Series(chaves).reset_index(drop = True)
+        if self.tipo == 'inteiro':
+            chaves = pd.to_numeric(chaves, errors = 'coerce')
+            validas = chaves.notna().to_numpy()
+            return chaves[validas].astype('int64').to_numpy(), validas
+        validas = chaves.notna().to_numpy()
+        return pd.util.hash_array(chaves[validas].astype(str).to_numpy(dtype = object)), validas
+
+    def contem(self, chaves):
+        """
+        Entrada: lista/Series de chaves.
+        Saída: array booleano indicando quais chaves já constam no índice (chaves nulas: False).
+        """
+        self._recarregar()
+        codigos, validas = self._codificar(chaves)
+        resultado = np.zeros(len(validas), dtype = bool)
+        if self.chaves is None or len(self.chaves) == 0 or len(codigos) == 0:
+            return resultado
+        pos = np.searchsorted(self.chaves, codigos)
+        pos[pos == len(self.chaves)] = 0
+        resultado[validas] = self.chaves[pos] == codigos
+        return resultado
+
+    def adicionar(self, chaves, salvar = True):
+        """
+        Inclui as chaves no índice (mantendo-o ordenado e sem repetições). Chaves nulas são ignoradas.
+        Ao salvar, as chaves gravadas no arquivo por outros processos são preservadas.
+        """
+        codigos = np.unique(self._codificar(chaves)[0])
+        if not salvar:
+            self.chaves = codigos if self.chaves is None else np.union1d(self.chaves, codigos)
+            return
+        with self._lock_arquivo():
+            # Sob o lock, sempre relê: outra gravação pode ter o mesmo mtime (resolução do sistema de arquivos).
+            self._recarregar(forcar = True)
+            self.chaves = codigos if self.chaves is None else np.union1d(self.chaves, codigos)
+            self._gravar()
+
+    def reconstruir(self, chaves):
+        """ Substitui o conteúdo do índice pelas chaves informadas (carga completa a partir do BigQuery). """
+        with self._lock_arquivo():
+            self.chaves = np.unique(self._codificar(chaves)[0])
+            self._gravar()
+
+    def salvar(self):
+        with self._lock_arquivo():
+            self._gravar()
+
+    def _gravar(self):
+        tmp = f'{self.path}.tmp.npy'
+        np.save(tmp, self.chaves)
+        os.replace(tmp, self.path)
+        self._mtime = os.path.getmtime(self.path)
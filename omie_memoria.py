@@ -0,0 +1,205 @@
+"""
+Governador de memória para as transformações e cargas do Omie
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-24
+
+O pico de memória de notas_fiscais_df / pedidos_df cresce com o intervalo de datas, e um
+backfill longo pode estourar a memória do worker. O governador mede a memória do processo
+(RSS, ou memória alocada pelo Python via tracemalloc) em uma thread de amostragem enquanto
+as etapas rodam. O orçamento vale para o crescimento da memória durante um lote, medido a
+partir da memória no início do lote: o RSS raramente volta a cair depois de um lote grande,
+e comparar o valor absoluto reduziria todos os lotes seguintes. Após cada lote, a quantidade
+de páginas do próximo lote é ajustada: reduzida pela metade quando o crescimento se aproxima
+do orçamento, aumentada aos poucos quando há folga. Como a memória retida pode subir de lote
+em lote, o lote também é reduzido pela metade quando o pico absoluto se aproxima do teto
+(teto_mb), mesmo que o crescimento do lote tenha sido pequeno. Cada execução registra um
+perfil com o pico de memória de cada etapa.
+
+Uso:
+    governador = GovernadorMemoria(orcamento_mb = 500, teto_mb = 3000)
+    OMIE.carregar_por_lotes('notas_fiscais', '01/01/2020', '31/12/2022', governador)
+    governador.salvar_perfil('cache/perfil_memoria_nf.json')
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def rss_mb():
+    """ Memória residente (RSS) atual do processo, em MB. """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        import resource
+        # Sem psutil nem /proc: usa o pico do processo (KB no Linux, bytes no macOS).
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / 2**20 if sys.platform == 'darwin' else pico / 1024
+
+
+class GovernadorMemoria:
+
+    def __init__(self, orcamento_mb, paginas_iniciais = 20, paginas_min = 1, paginas_max = 200,
+                 fracao_alerta = 0.8, medida = 'rss', intervalo = 0.05, teto_mb = None):
+        """
+        Entradas:
+            orcamento_mb (float): crescimento máximo desejado da memória durante um lote, em relação ao início
+                do lote (RSS do processo, ou memória do Python se medida = 'tracemalloc').
+            paginas_iniciais, paginas_min, paginas_max (int): páginas da API por lote.
+            fracao_alerta (float): fração do orçamento a partir da qual o lote é reduzido pela metade.
+            medida (string): 'rss' ou 'tracemalloc'. O perfil registra as duas quando tracemalloc está ativo.
+            intervalo (float): segundos entre amostras.
+            teto_mb (float): memória absoluta máxima do processo (mesma medida); acima de fracao_alerta
+                do teto o lote é reduzido pela metade. None: sem teto.
+        """
+        self.orcamento_mb = orcamento_mb
+        self.paginas = paginas_iniciais
+        self.paginas_min = paginas_min
+        self.paginas_max = paginas_max
+        self.fracao_alerta = fracao_alerta
+        self.medida = medida
+        self.intervalo = intervalo
+        self.teto_mb = teto_mb
+        self.perfil = []
+        self._base_lote = 0.0
+        self._pico_lote = 0.0
+        self._picos_etapas = []
+        self._lock = threading.Lock()
+        self._ativo = False
+        self._thread = None
+
+    def _medir(self):
+        rss = rss_mb()
+        python = tracemalloc.get_traced_memory()[0] / 2**20 if tracemalloc.is_tracing() else None
+        return rss, python
+
+    def _atual(self, rss, python):
+        return python if self.medida == 'tracemalloc' and python is not None else rss
+
+    def iniciar_lote(self):
+        """ Marca o início de um lote: o crescimento da memória passa a ser medido a partir daqui. """
+        atual = self._atual(*self._medir())
+        with self._lock:
+            self._base_lote = self._pico_lote = atual
+
+    def _registrar_amostra(self):
+        rss, python = self._medir()
+        atual = self._atual(rss, python)
+        with self._lock:
+            self._pico_lote = max(self._pico_lote, atual)
+            for pico in self._picos_etapas:
+                pico['rss'] = max(pico['rss'], rss)
+                if python is not None:
+                    pico['python'] = max(pico['python'] or 0.0, python)
+
+    def _amostrar(self):
+        while self._ativo:
+            self._registrar_amostra()
+            time.sleep(self.intervalo)
+
+    def iniciar(self):
+        """ Inicia a amostragem (e o tracemalloc, se medida = 'tracemalloc'). """
+        if self.medida == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.iniciar_lote()
+        self._ativo = True
+        self._thread = threading.Thread(target = self._amostrar, daemon = True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._ativo = False
+        if self._thread is not None:
+            self._thread.join()
+        if self.medida == 'tracemalloc' and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+    @contextmanager
+    def etapa(self, nome, **info):
+        """
+        Mede uma etapa (ex.: 'api', 'achatar', 'carregar'). O pico de RSS (e do tracemalloc, se ativo)
+        durante a etapa é registrado no perfil, com as informações extras (ex.: paginas).
+        """
+        pico = {'rss': 0.0, 'python': None}
+        with self._lock:
+            self._picos_etapas.append(pico)
+        inicio = time.time()
+        self._registrar_amostra()
+        try:
+            yield
+        finally:
+            self._registrar_amostra()
+            with self._lock:
+                self._picos_etapas.remove(pico)
+            registro = {'etapa': nome, 'duracao_s': round(time.time() - inicio, 2),
+                        'pico_rss_mb': round(pico['rss'], 1), **info}
+            if pico['python'] is not None:
+                registro['pico_python_mb'] = round(pico['python'], 1)
+            self.perfil.append(registro)
+
+    def tamanho_lote(self):
+        """ Quantidade de páginas do próximo lote. """
+        return self.paginas
+
+    def ajustar(self):
+        """
+        Ajusta o tamanho do próximo lote a partir do crescimento da memória no lote que terminou (pico menos
+        a memória no início do lote): metade das páginas se passou de fracao_alerta do orçamento; 50% a mais
+        se ficou abaixo da metade. Independente do crescimento, metade das páginas se o pico absoluto passou
+        de fracao_alerta do teto. O próximo lote é medido a partir da memória atual.
+        Saída: quantidade de páginas do próximo lote.
+        """
+        with self._lock:
+            pico = self._pico_lote
+            crescimento = max(0.0, pico - self._base_lote)
+        perto_do_teto = self.teto_mb is not None and pico >= self.fracao_alerta * self.teto_mb
+        if perto_do_teto or crescimento >= self.fracao_alerta * self.orcamento_mb:
+            novo = max(self.paginas_min, self.paginas // 2)
+        elif crescimento < 0.5 * self.orcamento_mb:
+            novo = min(self.paginas_max, max(self.paginas + 1, int(self.paginas * 1.5)))
+        else:
+            novo = self.paginas
+        if novo != self.paginas:
+            teto = f', pico {pico:.0f} MB de teto {self.teto_mb:.0f} MB' if self.teto_mb is not None else ''
+            print(f'Memória: +{crescimento:.0f} MB no lote (orçamento {self.orcamento_mb:.0f} MB{teto}); lote {self.paginas} -> {novo} páginas')
+        self.paginas = novo
+        self.iniciar_lote()
+        return novo
+
+    def resumo(self):
+        """ Pico de memória por etapa (máximo entre as execuções da etapa). """
+        resumo = {}
+        for registro in self.perfil:
+            r = resumo.setdefault(registro['etapa'], {'execucoes': 0, 'pico_rss_mb': 0.0, 'duracao_s': 0.0})
+            r['execucoes'] += 1
+            r['pico_rss_mb'] = max(r['pico_rss_mb'], registro['pico_rss_mb'])
+            r['duracao_s'] = round(r['duracao_s'] + registro['duracao_s'], 2)
+            if 'pico_python_mb' in registro:
+                r['pico_python_mb'] = max(r.get('pico_python_mb', 0.0), registro['pico_python_mb'])
+        return resumo
+
+    def salvar_perfil(self, path):
+        """ Salva o perfil da execução (etapas e resumo) em JSON. """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        with open(path, 'w') as f:
+            json.dump({'orcamento_mb': self.orcamento_mb, 'medida': self.medida,
+                       'resumo': self.resumo(), 'etapas': self.perfil}, f, indent = 1)
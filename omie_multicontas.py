@@ -0,0 +1,157 @@
+"""
+Atualização de várias contas Omie em paralelo, com orçamento de requisições compartilhado
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-20
+
+Cada conta (empresa) Omie tem as próprias credenciais e é carregada no próprio dataset
+do BigQuery. As contas rodam em paralelo (um worker por conta) e cada requisição à API
+passa por dois orçamentos: o da conta e o global, compartilhado por todas as contas.
+Assim as contas não disputam o limite de requisições da API entre si, e o tempo total
+acompanha o da maior conta em vez da soma de todas.
+
+Cada conta usa os próprios backends (BigQuery/DuckDB e arquivo de respostas): objetos como
+LocalBigQuery mantêm uma única conexão, que não pode ser usada por várias threads ao mesmo
+tempo. Por isso os backends são informados como funções que os criam (criar_gbq,
+criar_arquivo), chamadas uma vez por conta.
+
+Uso:
+    contas = [
+        {'nome': 'estoca', 'key': ..., 'secret': ..., 'dataset': 'omie'},
+        {'nome': 'outra', 'key': ..., 'secret': ..., 'dataset': 'omie_outra'},
+    ]
+    resultados = executar_contas(contas)
+    resultados = executar_contas(contas, criar_gbq = lambda conta: LocalBigQuery(f"{conta['nome']}.duckdb"))
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Rotinas executadas para cada conta, em ordem (o índice de NFs é usado pelos recebimentos).
+TAREFAS = [
+    'atualizacao_diaria_notas_fiscais',
+    'atualizacao_diaria_pedidos',
+    'atualizacao_diaria_produtos',
+    'atualizacao_diaria_recebimentos',
+    'atualizacao_diaria_clientes',
+]
+
+
+class OrcamentoRequisicoes:
+    """
+    Orçamento de requisições (token bucket): no máximo `taxa` requisições por segundo,
+    com rajadas de até `capacidade`. Se `pai` for informado, cada requisição consome
+    também o orçamento pai (ex.: orçamento da conta -> orçamento global).
+    """
+
+    def __init__(self, taxa, capacidade = None, pai = None):
+        self.taxa = taxa
+        self.capacidade = capacidade if capacidade is not None else taxa
+        self.pai = pai
+        self._fichas = self.capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self.espera_total = 0.0
+
+    def _reservar(self):
+        # Reserva uma ficha e retorna quanto tempo é preciso esperar até que ela esteja disponível.
+        with self._lock:
+            agora = time.monotonic()
+            self._fichas = min(self.capacidade, self._fichas + (agora - self._ultimo) * self.taxa)
+            self._ultimo = agora
+            self._fichas -= 1
+            espera = max(0.0, -self._fichas / self.taxa)
+            self.espera_total += espera
+            return espera
+
+    def aguardar(self):
+        """ Bloqueia até haver orçamento para uma requisição (na conta e no orçamento pai). """
+        espera = self._reservar()
+        if espera > 0:
+            time.sleep(espera)
+        if self.pai is not None:
+            self.pai.aguardar()
+
+
+def executar_conta(conta, tarefas, orcamento_global, taxa_por_conta, criar_gbq = None, criar_arquivo = None):
+    """
+    Executa as rotinas de atualização de uma conta, em sequência.
+    Entradas:
+        conta (dict): nome, key, secret e dataset da conta.
+        tarefas (lista): nomes dos métodos da classe omie a executar.
+        orcamento_global (OrcamentoRequisicoes): orçamento compartilhado entre as contas.
+        taxa_por_conta (float): requisições por segundo da conta.
+        criar_gbq, criar_arquivo (função): recebem a conta e criam o backend do BigQuery e o arquivo de
+            respostas usados apenas por esta conta. Padrão: GoogleBigQuery criado pela classe omie, sem arquivo.
+    Saída: dict com as mensagens (ou erros) de cada tarefa, o tempo total e a espera por orçamento.
+    """
+    from omie import omie
+
+    orcamento = OrcamentoRequisicoes(taxa_por_conta, pai = orcamento_global)
+    cliente = omie(key = conta['key'], secret = conta['secret'], dataset = conta['dataset'], limitador = orcamento,
+                   gbq = criar_gbq(conta) if criar_gbq is not None else None,
+                   arquivo = criar_arquivo(conta) if criar_arquivo is not None else None)
+    inicio = time.time()
+    resultado = {'tarefas': {}}
+    for tarefa in tarefas:
+        try:
+            resultado['tarefas'][tarefa] = getattr(cliente, tarefa)()
+        except Exception as e:
+            # Uma falha não interrompe as demais tarefas nem as outras contas.
+            resultado['tarefas'][tarefa] = f'ERRO: {e!r}'
+        print(f"[{conta['nome']}] {tarefa}: {resultado['tarefas'][tarefa]}")
+    resultado['tempo'] = time.time() - inicio
+    resultado['espera_orcamento'] = orcamento.espera_total
+    return resultado
+
+
+def executar_contas(contas, tarefas = TAREFAS, n_workers = None, taxa_global = 8, taxa_por_conta = 4,
+                    criar_gbq = None, criar_arquivo = None):
+    """
+    Executa as rotinas de atualização de várias contas Omie em paralelo.
+    Entradas:
+        contas (lista de dicts): nome, key, secret e dataset de cada conta.
+        tarefas (lista): nomes dos métodos da classe omie a executar para cada conta.
+        n_workers (int): contas em paralelo. Padrão: uma thread por conta.
+        taxa_global (float): requisições por segundo somando todas as contas.
+        taxa_por_conta (float): requisições por segundo de cada conta.
+        criar_gbq, criar_arquivo (função): criam os backends de cada conta (ver executar_conta).
+            Os backends não são compartilhados entre contas, que rodam em threads diferentes.
+    Saída: dict {nome da conta: resultado de executar_conta}.
+    """
+    datasets = [conta['dataset'] for conta in contas]
+    if len(set(datasets)) != len(datasets):
+        raise ValueError(f'Cada conta precisa de um dataset próprio: {datasets}')
+
+    orcamento_global = OrcamentoRequisicoes(taxa_global)
+    resultados = {}
+    inicio = time.time()
+    with ThreadPoolExecutor(n_workers or len(contas)) as executor:
+        futuros = {executor.submit(executar_conta, conta, tarefas, orcamento_global, taxa_por_conta, criar_gbq, criar_arquivo): conta['nome']
+                   for conta in contas}
+        for futuro in as_completed(futuros):
+            resultados[futuros[futuro]] = futuro.result()
+
+    print(f'Tempo total: {time.time() - inicio:.0f} s')
+    for nome, resultado in resultados.items():
+        print(f"{nome:<20} tempo: {resultado['tempo']:8.0f} s | espera por orçamento: {resultado['espera_orcamento']:8.0f} s")
+    return resultados
+
+
+if __name__ == '__main__':
+    import argparse
+    from modulos.utils.projeto import get_config
+
+    parser = argparse.ArgumentParser(description = 'Atualização diária de várias contas Omie')
+    parser.add_argument('contas', nargs = '+', help = 'chave_config:dataset (ex.: omie_estoca:omie)')
+    parser.add_argument('--taxa-global', type = float, default = 8)
+    parser.add_argument('--taxa-por-conta', type = float, default = 4)
+    args = parser.parse_args()
+
+    config = get_config()
+    contas = []
+    for item in args.contas:
+        chave, dataset = item.split(':')
+        contas.append({'nome': chave, 'key': config[chave]['key'], 'secret': config[chave]['secret'], 'dataset': dataset})
+    executar_contas(contas, taxa_global = args.taxa_global, taxa_por_conta = args.taxa_por_conta)
@@ -0,0 +1,126 @@
+"""
+Conversão tipada dos registros do Omie conforme o schema das tabelas do BigQuery
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-08
+
+Os registros achatados (json_normalize) chegam com tipos inconsistentes: números
+que às vezes vêm como texto, colunas inteiras que viram float por causa de nulos,
+datas em DD/MM/YYYY. Em vez de carregar uma tabela temporária e reescrevê-la com
+CAST em SQL, as colunas são convertidas no cliente para os tipos da tabela de
+destino (colunas Arrow) e carregadas diretamente com append.
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+
+
+def schema_tabela(client, tabela_id):
+    """
+    Função para obter o schema de uma tabela do BigQuery.
+    Entradas: client (google.cloud.bigquery.Client); tabela_id (string): 'dataset.tabela'.
+    Saída: lista de tuplas (coluna, tipo BigQuery).
+    """
+    return [(campo.name, campo.field_type) for campo in client.get_table(tabela_id).schema]
+
+
+def _para_texto(valor):
+    # Mesmo resultado de CAST(... AS STRING): floats inteiros sem ".0", booleanos em minúsculas
+    # e nulos (None, NaN, pd.NA, NaT) continuam nulos.
+    if pd.api.types.is_scalar(valor) and pd.isna(valor):
+        return None
+    if isinstance(valor, (bool, np.bool_)):
+        return 'true' if valor else 'false'
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _para_data(serie):
+    # O Omie envia datas em DD/MM/YYYY; valores já em formato ISO também são aceitos.
+    datas = pd.to_datetime(serie, format = '%d/%m/%Y', errors = 'coerce')
+    faltantes = datas.isna() & serie.notna()
+    if faltantes.any():
+        datas[faltantes] = pd.to_datetime(serie[faltantes], errors = 'coerce')
+    return datas
+
+
+def converter_coluna(serie, tipo):
+    """
+    Converte uma coluna pandas para o tipo BigQuery informado.
+    Valores que não podem ser convertidos viram nulos (como SAFE_CAST).
+    """
+    tipo = tipo.upper()
+    if tipo == 'STRING':
+        return serie.map(_para_texto, na_action = None).astype('string')
+    if tipo in ('INT64', 'INTEGER'):
+        return pd.to_numeric(serie, errors = 'coerce').round().astype('Int64')
+    if tipo in ('FLOAT64', 'FLOAT', 'NUMERIC'):
+        return pd.to_numeric(serie, errors = 'coerce').astype('float64')
+    if tipo in ('BOOL', 'BOOLEAN'):
+        return serie.map(lambda v: None if pd.isna(v) else str(v).upper() in ('S', 'SIM', 'TRUE', '1', 'T')).astype('boolean')
+    if tipo == 'DATE':
+        return _para_data(serie).dt.date
+    if tipo in ('DATETIME', 'TIMESTAMP'):
+        return _para_data(serie)
+    return serie
+
+
+def tipar_dataframe(dataframe, schema):
+    """
+    Função para converter um DataFrame para as colunas e tipos de uma tabela do BigQuery.
+    Colunas ausentes são criadas com nulos; colunas fora do schema são descartadas.
+    Entradas: dataframe (Pandas DataFrame); schema: lista de tuplas (coluna, tipo BigQuery).
+    Saída: Pandas DataFrame com as colunas na ordem do schema.
+    """
+    dataframe = dataframe.loc[:,~dataframe.columns.duplicated()]
+    colunas = {}
+    for coluna, tipo in schema:
+        serie = dataframe[coluna] if coluna in dataframe.columns else pd.Series([None] * len(dataframe), index = dataframe.index, dtype = 'object')
+        colunas[coluna] = converter_coluna(serie, tipo)
+    return pd.DataFrame(colunas, index = dataframe.index)
+
+
+def para_arrow(dataframe, schema):
+    """
+    Converte um DataFrame em uma tabela Arrow com os tipos da tabela de destino.
+    Entradas: dataframe (Pandas DataFrame); schema: lista de tuplas (coluna, tipo BigQuery).
+    Saída: pyarrow.Table
+    """
+    import pyarrow as pa
+
+    tipos_arrow = {
+        'STRING': pa.string(), 'INT64': pa.int64(), 'INTEGER': pa.int64(),
+        'FLOAT64': pa.float64(), 'FLOAT': pa.float64(), 'NUMERIC': pa.float64(),
+        'BOOL': pa.bool_(), 'BOOLEAN': pa.bool_(), 'DATE': pa.date32(),
+        'DATETIME': pa.timestamp('us'), 'TIMESTAMP': pa.timestamp('us', tz = 'UTC'),
+    }
+    tipado = tipar_dataframe(dataframe, schema)
+    arrow_schema = pa.schema([(coluna, tipos_arrow.get(tipo.upper(), pa.string())) for coluna, tipo in schema])
+    return pa.Table.from_pandas(tipado, schema = arrow_schema, preserve_index = False)
+
+
+def carregar_arrow(client, tabela_arrow, tabela_id, substituir = False):
+    """
+    Carrega uma tabela Arrow no BigQuery (via Parquet em memória), sem tabela temporária.
+    Entradas:
+        client (google.cloud.bigquery.Client)
+        tabela_arrow (pyarrow.Table)
+        tabela_id (string): 'dataset.tabela'
+        substituir (bool): WRITE_TRUNCATE em vez de WRITE_APPEND.
+    Saída: job de carga concluído.
+    """
+    import pyarrow.parquet as pq
+    from google.cloud import bigquery
+
+    buffer = io.BytesIO()
+    pq.write_table(tabela_arrow, buffer)
+    buffer.seek(0)
+    job_config = bigquery.LoadJobConfig(
+        source_format = bigquery.SourceFormat.PARQUET,
+        write_disposition = 'WRITE_TRUNCATE' if substituir else 'WRITE_APPEND')
+    job = client.load_table_from_file(buffer, tabela_id, job_config = job_config)
+    job.result()
+    return job
@@ -0,0 +1,326 @@
+"""
+Recebimento de webhooks do Omie para ingestão quase em tempo real
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-03-22
+
+Servidor HTTP local que recebe os eventos de webhook do Omie (NF autorizada, pedido
+alterado, cliente incluído/alterado). Para cada evento, apenas o registro alterado é
+consultado pelo id (ConsultarNF / ConsultarPedido / ConsultarCliente). Os registros são
+acumulados em micro-lotes por entidade e carregados pelo mesmo caminho da atualização
+diária (omie.carregar_notas_fiscais / carregar_pedidos / carregar_clientes) quando o lote
+atinge tamanho_max ids ou intervalo_max segundos. Pedidos e clientes alterados substituem a
+versão já carregada (substituir_existentes); NFs são apenas incluídas, como na atualização diária.
+
+Ids cuja consulta ou carga falha voltam para o próximo lote. Após max_tentativas falhas, o id
+é gravado no arquivo de falhas como um evento, que pode ser reenviado com reproduzir_eventos.
+
+Os eventos recebidos podem ser gravados em JSON-lines e reenviados ao servidor com
+reproduzir_eventos, para testes locais.
+
+Uso:
+    python omie_webhook.py servir --conta omie_estoca --port 8081 --gravar eventos.jsonl
+    python omie_webhook.py reproduzir eventos.jsonl --url http://127.0.0.1:8081/omie/webhook
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request
+
+# Prefixo do tópico do evento -> entidade e campos do evento que podem conter o id do registro.
+TOPICOS = {
+    'NFe.': ('notas_fiscais', ['nIdNF', 'id_nf', 'idNF', 'nfe_id']),
+    'VendaProduto.': ('pedidos', ['idPedido', 'codigo_pedido', 'id_pedido']),
+    'ClienteFornecedor.': ('clientes', ['codigo_cliente_omie', 'codigoClienteOmie', 'id_cliente']),
+}
+
+# Por entidade: método de consulta por id, chave da entidade no arquivo de respostas e carga.
+ENTIDADES = {
+    'notas_fiscais': {'consulta': 'consultar_nota_fiscal', 'chave': 'nfCadastro',
+        'carga': lambda omie, registros: omie.carregar_notas_fiscais(registros, 'notas_fiscais_webhook_temp')},
+    'pedidos': {'consulta': 'consultar_pedido', 'chave': 'pedido_venda_produto',
+        'carga': lambda omie, registros: omie.carregar_pedidos(registros, 'pedidos_webhook_temp', substituir_existentes = True)},
+    'clientes': {'consulta': 'consultar_cliente', 'chave': 'clientes_cadastro',
+        'carga': lambda omie, registros: omie.carregar_clientes(omie.clientes_df(registros), substituir_existentes = True)},
+}
+
+
+def _carga_ok(msg):
+    # Os métodos carregar_* não levantam exceção: a falha é indicada pela mensagem (mesma regra de omie.carga_ok).
+    return 'NÃO OK' not in str(msg)
+
+
+def identificar_evento(evento):
+    """
+    Identifica a entidade e o id do registro alterado em um evento de webhook do Omie.
+    Saída: tupla (entidade, id), ou None se o tópico não é tratado.
+    """
+    topico = str(evento.get('topic', ''))
+    dados = evento.get('event') or {}
+    for prefixo, (entidade, campos) in TOPICOS.items():
+        if topico.startswith(prefixo):
+            for campo in campos:
+                if dados.get(campo) not in (None, ""):
+                    return entidade, dados[campo]
+    return None
+
+
+class LotesWebhook:
+    """
+    Acumula os ids alterados por entidade e carrega cada lote quando atinge tamanho_max ids
+    ou quando o primeiro id do lote tem mais de intervalo_max segundos.
+    Ids repetidos no mesmo lote (vários eventos do mesmo registro) são consultados uma única vez.
+    Ids com falha na consulta ou na carga voltam para o próximo lote; após max_tentativas falhas,
+    são gravados em arquivo_falhas (JSON-lines, no formato de evento) e descartados.
+    """
+
+    def __init__(self, omie, tamanho_max = 100, intervalo_max = 60, max_tentativas = 5, arquivo_falhas = 'cache/webhook_falhas.jsonl'):
+        self.omie = omie
+        self.tamanho_max = tamanho_max
+        self.intervalo_max = intervalo_max
+        self.max_tentativas = max_tentativas
+        self.arquivo_falhas = arquivo_falhas
+        self._lotes = {entidade: {} for entidade in ENTIDADES}
+        self._inicio = {}
+        self._tentativas = {}
+        self._lock = threading.Lock()
+        self._carga = threading.Lock()
+        self._sinal = threading.Event()
+        self.estatisticas = {'eventos': 0, 'consultados': 0, 'erros_consulta': 0, 'erros_carga': 0, 'descartados': 0, 'lotes': 0}
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    def adicionar(self, entidade, id_registro, evento = True):
+        with self._lock:
+            self._lotes[entidade][str(id_registro)] = id_registro
+            self._inicio.setdefault(entidade, time.monotonic())
+            if evento:
+                self.estatisticas['eventos'] += 1
+            if len(self._lotes[entidade]) >= self.tamanho_max:
+                self._sinal.set()
+
+    def pendentes(self):
+        with self._lock:
+            return {entidade: len(ids) for entidade, ids in self._lotes.items()}
+
+    def resumo(self):
+        """ Cópia das estatísticas (eventos, consultas, erros, ids descartados e lotes carregados). """
+        with self._lock:
+            return dict(self.estatisticas)
+
+    def _contar(self, campo, n = 1):
+        with self._lock:
+            self.estatisticas[campo] += n
+
+    def _falhou(self, entidade, id_registro, erro):
+        # Devolve o id ao próximo lote ou, após max_tentativas, grava-o no arquivo de falhas.
+        chave = (entidade, str(id_registro))
+        with self._lock:
+            tentativas = self._tentativas.get(chave, 0) + 1
+            self._tentativas[chave] = tentativas
+        if tentativas < self.max_tentativas:
+            self.adicionar(entidade, id_registro, evento = False)
+            return
+        prefixo, campos = next((p, c) for p, (e, c) in TOPICOS.items() if e == entidade)
+        falha = {'topic': f'{prefixo}Reprocessar', 'event': {campos[0]: id_registro},
+                 'erro': erro, 'tentativas': tentativas, 'data': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with self._lock:
+            del self._tentativas[chave]
+            self.estatisticas['descartados'] += 1
+            if self.arquivo_falhas is not None:
+                os.makedirs(os.path.dirname(self.arquivo_falhas) or '.', exist_ok = True)
+                with open(self.arquivo_falhas, 'a', encoding = 'utf-8') as f:
+                    f.write(json.dumps(falha, ensure_ascii = False) + '\n')
+        print(f'Webhook {entidade} {id_registro}: descartado após {tentativas} tentativas ({erro})')
+
+    def _concluir(self, entidade, ids):
+        with self._lock:
+            for id_registro in ids:
+                self._tentativas.pop((entidade, str(id_registro)), None)
+
+    def _retirar(self, forcar = False):
+        # Retira os lotes que atingiram o tamanho ou o tempo máximo (ou todos, se forcar).
+        agora = time.monotonic()
+        prontos = {}
+        with self._lock:
+            for entidade, ids in self._lotes.items():
+                if ids and (forcar or len(ids) >= self.tamanho_max or agora - self._inicio[entidade] >= self.intervalo_max):
+                    prontos[entidade] = list(ids.values())
+                    self._lotes[entidade] = {}
+                    del self._inicio[entidade]
+        return prontos
+
+    def _carregar(self, entidade, ids):
+        conf = ENTIDADES[entidade]
+        registros, consultados = [], []
+        for id_registro in ids:
+            try:
+                registros.append(getattr(self.omie, conf['consulta'])(id_registro))
+                consultados.append(id_registro)
+            except Exception as e:
+                print(f'Webhook {entidade} {id_registro}: erro na consulta ({e!r})')
+                self._contar('erros_consulta')
+                self._falhou(entidade, id_registro, f'consulta: {e!r}')
+        if not registros:
+            return
+        self._contar('consultados', len(registros))
+        self.omie._arquivar(conf['chave'], registros)
+        try:
+            msg = conf['carga'](self.omie, registros)
+            ok = _carga_ok(msg)
+        except Exception as e:
+            msg, ok = f'ERRO: {e!r}', False
+        print(f'Webhook {entidade}: lote de {len(registros)} registros. {msg}')
+        if ok:
+            self._contar('lotes')
+            self._concluir(entidade, consultados)
+        else:
+            # Falha na carga: todos os ids do lote voltam para o próximo lote.
+            self._contar('erros_carga')
+            for id_registro in consultados:
+                self._falhou(entidade, id_registro, f'carga: {msg}')
+
+    def descarregar(self, forcar = True):
+        """ Carrega os lotes prontos (ou todos os pendentes, se forcar). """
+        with self._carga:
+            for entidade, ids in self._retirar(forcar).items():
+                self._carregar(entidade, ids)
+
+    def _run(self):
+        while True:
+            self._sinal.wait(timeout = 1)
+            self._sinal.clear()
+            try:
+                self.descarregar(forcar = False)
+            except Exception as e:
+                print(f'Webhook: erro na carga do lote ({e!r})')
+
+
+def make_handler(lotes, gravar_eventos = None):
+
+    arquivo_lock = threading.Lock()
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._reply(200, {'status': 'ok', 'pendentes': lotes.pendentes(), 'estatisticas': lotes.resumo()})
+            else:
+                self._reply(404, {'erro': 'não encontrado'})
+
+        def do_POST(self):
+            if self.path != '/omie/webhook':
+                self._reply(404, {'erro': 'não encontrado'})
+                return
+            try:
+                evento = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError as e:
+                self._reply(400, {'erro': str(e)})
+                return
+            # Eventos de outra conta são recusados; o teste de cadastro do webhook ("ping") é apenas confirmado.
+            if evento.get('appKey') and str(evento['appKey']) != str(lotes.omie.app_key):
+                self._reply(403, {'erro': 'appKey inválida'})
+                return
+            if gravar_eventos is not None:
+                with arquivo_lock, open(gravar_eventos, 'a', encoding = 'utf-8') as f:
+                    f.write(json.dumps(evento, ensure_ascii = False) + '\n')
+            identificado = identificar_evento(evento)
+            if identificado is None:
+                self._reply(200, {'status': 'ignorado'})
+                return
+            lotes.adicionar(*identificado)
+            self._reply(202, {'status': 'recebido', 'entidade': identificado[0]})
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookHandler
+
+
+def servir(omie, host = '127.0.0.1', port = 8081, tamanho_max = 100, intervalo_max = 60, gravar_eventos = None,
+           max_tentativas = 5, arquivo_falhas = 'cache/webhook_falhas.jsonl'):
+    """
+    Inicia o servidor de webhooks (bloqueante). Ao encerrar (Ctrl+C), os lotes pendentes são carregados.
+    Entradas:
+        omie (omie.omie): cliente da conta que recebe os eventos.
+        gravar_eventos (string): arquivo JSON-lines onde os eventos recebidos são gravados (para reprodução).
+        max_tentativas (int), arquivo_falhas (string): ver LotesWebhook.
+    """
+    lotes = LotesWebhook(omie, tamanho_max, intervalo_max, max_tentativas, arquivo_falhas)
+    server = ThreadingHTTPServer((host, port), make_handler(lotes, gravar_eventos))
+    print(f'Recebendo webhooks do Omie em http://{host}:{port}/omie/webhook')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        lotes.descarregar()
+    return lotes
+
+
+def reproduzir_eventos(caminho, url = 'http://127.0.0.1:8081/omie/webhook', intervalo = 0.0):
+    """
+    Reenvia ao servidor os eventos gravados em um arquivo JSON-lines (um evento por linha).
+    Entradas: intervalo (float): segundos entre eventos.
+    Saída: dict com a quantidade de respostas por status HTTP.
+    """
+    status = {}
+    with open(caminho, encoding = 'utf-8') as f:
+        for linha in f:
+            if not linha.strip():
+                continue
+            req = request.Request(url, data = linha.strip().encode('utf-8'), headers = {'Content-Type': 'application/json'})
+            try:
+                with request.urlopen(req) as resposta:
+                    codigo = resposta.status
+            except request.HTTPError as e:
+                codigo = e.code
+            status[codigo] = status.get(codigo, 0) + 1
+            if intervalo:
+                time.sleep(intervalo)
+    print(f'Eventos reenviados: {status}')
+    return status
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Webhooks do Omie')
+    sub = parser.add_subparsers(dest = 'comando', required = True)
+    p_servir = sub.add_parser('servir')
+    p_servir.add_argument('--conta', default = 'omie_estoca')
+    p_servir.add_argument('--dataset', default = 'omie')
+    p_servir.add_argument('--host', default = '127.0.0.1')
+    p_servir.add_argument('--port', type = int, default = 8081)
+    p_servir.add_argument('--tamanho-max', type = int, default = 100)
+    p_servir.add_argument('--intervalo-max', type = float, default = 60)
+    p_servir.add_argument('--gravar', default = None)
+    p_servir.add_argument('--max-tentativas', type = int, default = 5)
+    p_servir.add_argument('--falhas', default = 'cache/webhook_falhas.jsonl')
+    p_reproduzir = sub.add_parser('reproduzir')
+    p_reproduzir.add_argument('caminho')
+    p_reproduzir.add_argument('--url', default = 'http://127.0.0.1:8081/omie/webhook')
+    p_reproduzir.add_argument('--intervalo', type = float, default = 0.0)
+    args = parser.parse_args()
+
+    if args.comando == 'servir':
+        from modulos.utils.projeto import get_config
+        from omie import omie
+
+        config = get_config()
+        OMIE = omie(key = config[args.conta]['key'], secret = config[args.conta]['secret'], dataset = args.dataset)
+        servir(OMIE, args.host, args.port, args.tamanho_max, args.intervalo_max, args.gravar, args.max_tentativas, args.falhas)
+    else:
+        reproduzir_eventos(args.caminho, args.url, args.intervalo)
@@ -9,24 +9,34 @@ Referência da API Pier8: http://etracker.pier8.com.br/pier8-v3plus/developer-do
 import requests
 import pandas as pd
 import json
-from modulos.utils.projeto import get_config
 from datetime import datetime
-from modulos.integracoes.storage import google_bigquery 
 import xml.etree.ElementTree as ET
 import pytz
 
-config = get_config()
-datetime.strftime(datetime.now(),'%Y-%m-%d %H:%M:%S')
 class pier8:
     
     BASE_URL = 'https://etracker.pier8.com.br/api/v2/ws/'
     skus = ['001', '002', '003', '1549']
     
-    def __init__(self, apikey, token):
+    def __init__(self, apikey, token, gbq = None):
         self.apikey = apikey
         self.token = token
-        self.GBQ = google_bigquery.GoogleBigQuery()
-        self.client = self.GBQ.client
+        self._GBQ = gbq
+
+    @property
+    def GBQ(self):
+        """
+        Cliente do BigQuery, criado apenas no primeiro uso.
+        """
+        if self._GBQ is None:
+            # Importado apenas aqui: importar o módulo não carrega o cliente do BigQuery.
+            from modulos.integracoes.storage import google_bigquery
+            self._GBQ = google_bigquery.GoogleBigQuery()
+        return self._GBQ
+
+    @property
+    def client(self):
+        return self.GBQ.client
 
     def obter_movimentacao_estoque_sku(self, sku):
         comp_url = 'consultaEstoque.php?wsdl'
@@ -107,6 +117,8 @@ class pier8:
 
 
 if __name__ == '__main__':
-    PIER = pier8(apikei = config['pier8']['apikey'], token = config['pier8']['token'])
+    from modulos.utils.projeto import get_config
+    config = get_config()
+    PIER = pier8(apikey = config['pier8']['apikey'], token = config['pier8']['token'])
     estoque = PIER.atualizar_estoque_bigquery()
 
@@ -0,0 +1,212 @@
+"""
+Local batched inference service for the ROAS models.
+Created by: Danilo Steckelberg
+Created for: IBM Deep Learning course final project (nn_models / nn_optimization notebooks)
+Created on: 2023-03-01
+
+A trained Keras model made only of Dense layers is exported once to a .npz file
+with its weights, biases, activations and input columns. The service loads that
+file with NumPy only (no TensorFlow import at startup) and groups concurrent
+requests into micro-batches, so each request costs one small matrix product.
+
+Export (inside the notebook):
+    from roas_inference import export_model
+    export_model(model_2, 'output/roas_model.npz', columns = list(X_train.columns))
+
+Serve:
+    python roas_inference.py output/roas_model.npz --port 8080
+
+Request:
+    POST /predict  {"instances": [[...24 floats...], ...]}
+               or  {"instances": [{"coluna": valor, ...}, ...]}
+    -> {"predictions": [...]}
+"""
+
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+_ACTIVATIONS = {
+    'linear': lambda z: z,
+    'relu': lambda z: np.maximum(z, 0),
+    'tanh': np.tanh,
+    'sigmoid': lambda z: 1 / (1 + np.exp(-z)),
+    'elu': lambda z: np.where(z > 0, z, np.expm1(np.minimum(z, 0))),
+}
+
+
+def export_model(model, path: str, columns: list = None):
+    """
+    Saves the Dense layers of a Keras model as plain NumPy arrays.
+    Inputs:
+        model: tf.keras model with only Dense (and InputLayer) layers.
+        columns: input column names, in training order; enables requests by column name.
+    """
+    arrays, activations = {}, []
+    for i, layer in enumerate(layer for layer in model.layers if layer.get_weights()):
+        if layer.__class__.__name__ != 'Dense':
+            raise ValueError(f'Layer {layer.name} ({layer.__class__.__name__}) cannot be exported')
+        activation = layer.get_config()['activation']
+        if not isinstance(activation, str) or activation not in _ACTIVATIONS:
+            raise ValueError(f'Layer {layer.name}: activation {activation!r} is not supported '
+                             f'(expected one of {sorted(_ACTIVATIONS)})')
+        w, b = layer.get_weights()
+        arrays[f'w{i}'] = w.astype(np.float32)
+        arrays[f'b{i}'] = b.astype(np.float32)
+        activations.append(activation)
+    meta = {'name': model.name, 'activations': activations, 'columns': columns}
+    np.savez(path, meta = np.array(json.dumps(meta)), **arrays)
+
+
+class NumpyModel:
+    """ Framework-free forward pass of an exported dense model. """
+
+    def __init__(self, path: str):
+        with np.load(path) as npz:
+            meta = json.loads(str(npz['meta']))
+            n_layers = len(meta['activations'])
+            self.weights = [npz[f'w{i}'] for i in range(n_layers)]
+            self.biases = [npz[f'b{i}'] for i in range(n_layers)]
+        self.name = meta['name']
+        self.activations = [_ACTIVATIONS[a] for a in meta['activations']]
+        self.columns = meta['columns']
+
+    def to_matrix(self, instances: list) -> np.array:
+        """
+        Converts a list of feature lists or {column: value} dicts into the input matrix.
+        Dicts must have exactly the model columns: missing or unknown columns raise ValueError.
+        """
+        if instances and isinstance(instances[0], dict):
+            if self.columns is None:
+                raise ValueError('Model exported without column names; send feature lists')
+            expected = set(self.columns)
+            for i, inst in enumerate(instances):
+                if not isinstance(inst, dict):
+                    raise ValueError(f'Instance {i} is not a dict; do not mix dicts and feature lists')
+                missing, unknown = expected - set(inst), set(inst) - expected
+                if missing or unknown:
+                    raise ValueError(f'Instance {i}: missing columns {sorted(missing)}, unknown columns {sorted(unknown)}')
+            instances = [[inst[c] for c in self.columns] for inst in instances]
+        X = np.asarray(instances, dtype = np.float32)
+        if X.ndim != 2 or X.shape[1] != self.weights[0].shape[0]:
+            raise ValueError(f'Expected instances with {self.weights[0].shape[0]} features')
+        return X
+
+    def predict(self, X: np.array) -> np.array:
+        h = X
+        for w, b, act in zip(self.weights, self.biases, self.activations):
+            h = act(h @ w + b)
+        return h[:, 0] if h.shape[1] == 1 else h
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests and runs them as one batch, as soon as max_batch_size
+    rows are queued or max_wait_ms has passed since the first queued request.
+    """
+
+    def __init__(self, model: NumpyModel, max_batch_size: int = 256, max_wait_ms: float = 2.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    def submit(self, X: np.array) -> Future:
+        future = Future()
+        self._queue.put((X, future))
+        return future
+
+    def predict(self, X: np.array) -> np.array:
+        return self.submit(X).result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            rows = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while rows < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout = timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += len(item[0])
+
+            try:
+                preds = self.model.predict(np.concatenate([X for X, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for X, future in batch:
+                future.set_result(preds[start:start + len(X)])
+                start += len(X)
+
+
+def make_handler(batcher: MicroBatcher):
+
+    class PredictHandler(BaseHTTPRequestHandler):
+
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._reply(200, {'status': 'ok', 'model': batcher.model.name})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                X = batcher.model.to_matrix(body['instances'])
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            preds = batcher.predict(X)
+            self._reply(200, {'predictions': preds.tolist()})
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictHandler
+
+
+def serve(model_path: str, host: str = '127.0.0.1', port: int = 8080, max_batch_size: int = 256, max_wait_ms: float = 2.0):
+    """ Starts the HTTP prediction service (blocking). """
+    batcher = MicroBatcher(NumpyModel(model_path), max_batch_size, max_wait_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    print(f'Serving {batcher.model.name} on http://{host}:{port}/predict')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'ROAS prediction service')
+    parser.add_argument('model_path')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--max-batch-size', type = int, default = 256)
+    parser.add_argument('--max-wait-ms', type = float, default = 2.0)
+    args = parser.parse_args()
+    serve(args.model_path, args.host, args.port, args.max_batch_size, args.max_wait_ms)
@@ -8,23 +8,95 @@ Created on: 2021-10-01
 Version 2.0 (2021-11-12)
 """
 
-from google.cloud import bigquery as bq
+import io
 import os
+import time
 import pandas as pd
-import pandas_gbq as pb
 import glob
 from datetime import datetime
 
+
+class AcompanhamentoJobs:
+    """
+    Acompanha jobs do BigQuery submetidos de forma assíncrona (client.query / load_table_*):
+    consulta o estado de todos periodicamente até concluírem e reporta, por job,
+    a duração, os bytes processados, o tempo de slot e o erro (se houver).
+    """
+
+    def __init__(self, intervalo = 1.0):
+        self.intervalo = intervalo
+        self.jobs = {}
+        self.relatorio = {}
+        self._inicio = {}
+
+    def submeter(self, nome, job):
+        self.jobs[nome] = job
+        self._inicio[nome] = time.time()
+        return job
+
+    def _registrar(self, nome, job):
+        self.relatorio[nome] = {
+            'ok': job.error_result is None,
+            'duracao_s': round(time.time() - self._inicio[nome], 1),
+            'bytes_processados': getattr(job, 'total_bytes_processed', None) or 0,
+            'slot_ms': getattr(job, 'slot_millis', None) or 0,
+            'erro': job.error_result,
+        }
+        r = self.relatorio[nome]
+        print(f"Job {nome}: {'OK' if r['ok'] else 'ERRO'} | {r['duracao_s']} s | "
+              f"{r['bytes_processados'] / 2**20:.1f} MB processados | {r['slot_ms']} ms de slot")
+
+    def aguardar(self, timeout = None):
+        """
+        Aguarda todos os jobs submetidos terminarem.
+        Saída: dict {nome: {'ok', 'duracao_s', 'bytes_processados', 'slot_ms', 'erro'}}.
+        """
+        pendentes = {nome: job for nome, job in self.jobs.items() if nome not in self.relatorio}
+        limite = time.time() + timeout if timeout is not None else None
+        while pendentes:
+            for nome, job in list(pendentes.items()):
+                if job.done():
+                    self._registrar(nome, job)
+                    del pendentes[nome]
+            if pendentes:
+                if limite is not None and time.time() > limite:
+                    raise TimeoutError(f'Jobs não concluídos: {list(pendentes)}')
+                time.sleep(self.intervalo)
+        return dict(self.relatorio)
+
+
 class shopify:
-    def __init__(self,credentials_path):
+    def __init__(self,credentials_path, client = None):
+        # client: cliente alternativo (ex.: local_warehouse.LocalBigQuery().client); padrão é o do BigQuery.
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path + '\\gcp_evi-stitch-fb_api_privatekey.json'
-        self.client = bq.Client()
-        self.datasets = list(self.client.list_datasets())
-        self.project = self.client.project
+        self._client = client
+        self._datasets = None
         self.dataset_id = 'events_shopify_historico'
         self.temp_table_id = 'sales_campaign_temp'
         self.update_table_id = 'sales_campaign'
 
+    # O cliente do BigQuery e a lista de datasets são obtidos apenas no primeiro uso.
+    # google.cloud.bigquery também só é importado aqui (pandas_gbq é importado pelo próprio DataFrame.to_gbq).
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import bigquery as bq
+            self._client = bq.Client()
+        return self._client
+
+    @property
+    def project(self):
+        return self.client.project
+
+    @property
+    def datasets(self):
+        if self._datasets is None:
+            self._datasets = list(self.client.list_datasets())
+        return self._datasets
+
+    def _tabela(self, tabela):
+        return f'{self.dataset_id}.{tabela}'
+
     # Criação de uma tabela temporária com os últimos 30 dias de transação
     def upload_tabela_temp(self, dataframe):
         try:
@@ -39,19 +111,72 @@ class shopify:
 
     # Update da tabela histórica com a tabela atual.
     # São deletados os registros mais recentes para serem atualizados com a tabela temporária.
+    # Os jobs são acompanhados até o fim: falhas e custos (bytes/slot) passam a ser reportados.
     def update_tabela_historica(self, queries_path):
-        delete_query = 'delete from '+ self.dataset_id + '.' + self.update_table_id + 'where date(`day`) > '\
+        jobs = AcompanhamentoJobs()
+        delete_query = 'delete from '+ self.dataset_id + '.' + self.update_table_id + ' where date(`day`) > '\
             'date_add(current_date(), interval -18 day)'
-        query_job = self.client.query(delete_query)
+        jobs.submeter('delete', self.client.query(delete_query))
+        relatorio = jobs.aguardar()
+        # Sem o delete, o merge duplicaria/misturaria os dias recentes: interrompe e reporta a falha.
+        if not relatorio['delete']['ok']:
+            print('Erro no delete: merge não executado')
+            return relatorio
 
         ### ----------- Loading SQL file with MERGE and run query job -----------------
+        try:
+            jobs.submeter('merge', self.client.query(self._ler_merge(queries_path)))
+            relatorio = jobs.aguardar()
+            print('OK' if relatorio['merge']['ok'] else 'Erro')
+        except Exception as e:
+            # Falha ao submeter ou acompanhar o merge: registrada no relatório para quem chamou.
+            relatorio['merge'] = {'ok': False, 'duracao_s': None, 'bytes_processados': 0, 'slot_ms': 0, 'erro': repr(e)}
+            print('Erro')
+        return relatorio
+
+    # MERGE da tabela temporária na histórica (mapeamento de colunas e upsert definidos no arquivo).
+    def _ler_merge(self, queries_path):
         with open(queries_path + '\\merge_shopify_query.txt') as f:
-            contents = f.read()
-            try:
-                query_job = self.client.query(contents)
-                print('OK')
-            except:
-                print('Erro')
+            return f.read().strip().rstrip(';')
+
+    # Atualização por partição: apaga da tabela histórica apenas os dias presentes no CSV e aplica o MERGE
+    # de merge_shopify_query.txt em uma única transação, de forma que o custo acompanha os dias alterados.
+    def atualizar_particoes(self, dataframe, queries_path):
+        """
+        Função para substituir, de forma atômica, os dias da tabela histórica presentes no DataFrame.
+        Entradas: dataframe (Pandas DataFrame) com a coluna day (datetime);
+                  queries_path (string) com a pasta de merge_shopify_query.txt.
+        Saída: relatório dos jobs (ver AcompanhamentoJobs.aguardar); vazio se o DataFrame não tiver dias.
+        """
+        datas = sorted(pd.to_datetime(dataframe['day']).dt.date.dropna().unique())
+        if not datas:
+            print('Nenhum dia a substituir (CSV vazio)')
+            return {}
+        from google.cloud import bigquery as bq
+        print(f'Dias a substituir: {len(datas)} ({datas[0]} a {datas[-1]})')
+        jobs = AcompanhamentoJobs()
+
+        # Carga da tabela temporária (Parquet em memória), também acompanhada como job.
+        buffer = io.BytesIO()
+        dataframe.to_parquet(buffer, index = False)
+        buffer.seek(0)
+        job_config = bq.LoadJobConfig(source_format = bq.SourceFormat.PARQUET, write_disposition = 'WRITE_TRUNCATE')
+        jobs.submeter('carga_temp', self.client.load_table_from_file(buffer, self._tabela(self.temp_table_id), job_config = job_config))
+        relatorio = jobs.aguardar()
+        if not relatorio['carga_temp']['ok']:
+            return relatorio
+
+        # O MERGE lê apenas a tabela temporária (os dias do CSV), e esses dias acabaram de ser apagados
+        # da histórica: o resultado é a substituição das partições com o mapeamento de colunas do MERGE.
+        transacao = f"""
+            begin transaction;
+            delete from {self._tabela(self.update_table_id)} where date(`day`) in unnest(@datas);
+            {self._ler_merge(queries_path)};
+            commit transaction;
+        """
+        job_config = bq.QueryJobConfig(query_parameters = [bq.ArrayQueryParameter('datas', 'DATE', datas)])
+        jobs.submeter('substituir_particoes', self.client.query(transacao, job_config = job_config))
+        return jobs.aguardar()
 
 if __name__ == '__main__':
     start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -75,9 +200,12 @@ if __name__ == '__main__':
 
     try:
         shp = shopify(credentials_path)
-        shp.upload_tabela_temp(df)
-        shp.update_tabela_historica(queries_path)
-        query_status = 'ok'
+        relatorio = shp.atualizar_particoes(df, queries_path)
+        # Relatório vazio: nenhum job foi executado (CSV sem dias), o que não é reportado como 'ok'.
+        if not relatorio:
+            query_status = 'sem dados'
+        else:
+            query_status = 'ok' if all(job['ok'] for job in relatorio.values()) else 'erro'
     except:
         query_status = 'erro'
 
@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import facebook_diario
+
+
+@pytest.fixture
+def consultas(monkeypatch):
+    # Substitui a consulta ao BigQuery: cada dia tem 100 impressões e custo igual ao número da consulta.
+    chamadas = []
+
+    def consultar(client, data_inicio, data_fim, tabela):
+        chamadas.append((pd.Timestamp(data_inicio).date(), pd.Timestamp(data_fim).date()))
+        dias = pd.date_range(data_inicio, data_fim, freq = 'D', name = 'date_start')
+        return pd.DataFrame({'impressions': 100.0, 'clicks': 1.0, 'cost': float(len(chamadas)), 'cpm_avg': 10.0}, index = dias)
+
+    monkeypatch.setattr(facebook_diario, 'consultar_facebook_diario', consultar)
+    return chamadas
+
+
+def test_exige_a_tabela(tmp_path):
+    with pytest.raises(ValueError):
+        facebook_diario.obter_facebook_diario(None, '2020-01-01', cache_path = str(tmp_path / 'c.parquet'), tabela = None)
+
+
+def test_intervalos():
+    datas = pd.to_datetime(['2023-01-01', '2023-01-02', '2023-01-05', '2023-01-07', '2023-01-08'])
+    assert [(i.day, f.day) for i, f in facebook_diario._intervalos(datas)] == [(1, 2), (5, 5), (7, 8)]
+
+
+def test_consulta_apenas_faltantes_e_dias_recentes(tmp_path, consultas):
+    cache = str(tmp_path / 'c.parquet')
+    hoje = date.today()
+    inicio = hoje - timedelta(days = 100)
+    kwargs = dict(cache_path = cache, tabela = 'ds.ads', janela_recente = 28)
+
+    assert len(facebook_diario.obter_facebook_diario(None, inicio, **kwargs)) == 101
+    assert consultas == [(inicio, hoje)]
+
+    # Segunda execução: só os últimos 28 dias (e hoje) são consultados novamente, e substituem o cache.
+    resultado = facebook_diario.obter_facebook_diario(None, inicio, **kwargs)
+    assert consultas[1] == (hoje - timedelta(days = 28), hoje)
+    assert resultado['cost'].value_counts().to_dict() == {1.0: 72, 2.0: 29}
+
+
+def test_nao_rele_dias_do_cache_entre_intervalos(tmp_path, consultas):
+    cache = str(tmp_path / 'c.parquet')
+    hoje = date.today()
+    kwargs = dict(cache_path = cache, tabela = 'ds.ads', janela_recente = 0)
+    facebook_diario.obter_facebook_diario(None, hoje - timedelta(days = 60), hoje - timedelta(days = 50), **kwargs)
+    facebook_diario.obter_facebook_diario(None, hoje - timedelta(days = 70), hoje - timedelta(days = 40), **kwargs)
+    assert consultas[1:] == [(hoje - timedelta(days = 70), hoje - timedelta(days = 61)),
+                             (hoje - timedelta(days = 49), hoje - timedelta(days = 40))]
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from local_warehouse import LocalBigQuery, _dividir_comandos, traduzir_sql
+
+
+@pytest.mark.parametrize('bigquery, duckdb', [
+    ("split(dInc, '/')[offset(2)]", "str_split(dInc, '/')[3]"),
+    ("parse_date('%d/%m/%Y', dInc)", "strptime(dInc, '%d/%m/%Y')::DATE"),
+    ("date_add(current_date(), interval -18 day)", "(current_date + interval (-18) day)"),
+    ("date(`day`) in unnest(@datas)", 'date("day") in (select unnest(@datas))'),
+    ("select * except (a, b) from t", "select * exclude (a, b) from t"),
+    ("cast(x as STRING), cast(y as INT64), cast(z as FLOAT64)", "cast(x as VARCHAR), cast(y as BIGINT), cast(z as DOUBLE)"),
+])
+def test_traduzir_sql(bigquery, duckdb):
+    assert traduzir_sql(bigquery) == duckdb
+
+
+def test_dividir_comandos_ignora_ponto_e_virgula_em_strings():
+    assert _dividir_comandos("select ';' x; select 2;\n") == ["select ';' x", ' select 2']
+
+
+def test_insert_not_in_e_parametros(tmp_path):
+    gbq = LocalBigQuery(str(tmp_path / 'w.duckdb'))
+    gbq.dataframe_to_bq(pd.DataFrame({'id': [1, 2], 'day': pd.to_datetime(['2023-01-01', '2023-01-02'])}), 'ds', 'hist')
+    gbq.dataframe_to_bq(pd.DataFrame({'id': [2, 3], 'day': pd.to_datetime(['2023-01-02', '2023-01-03'])}), 'ds', 'temp')
+    gbq.executar_query("""
+        insert into ds.hist (select * from ds.temp where id not in (select id from ds.hist));
+        drop table ds.temp
+    """)
+    assert gbq.executar_query('select id from ds.hist order by id')['id'].tolist() == [1, 2, 3]
+
+    gbq.executar_query('delete from ds.hist where date(`day`) in unnest(@datas)',
+                       {'datas': [pd.Timestamp('2023-01-01').date()]})
+    assert gbq.executar_query('select id from ds.hist order by id')['id'].tolist() == [2, 3]
+    assert [c.name for c in gbq.client.get_table('evi-stitch.ds.hist').schema] == ['id', 'day']
+
+
+def test_parametros_nao_alteram_strings(tmp_path):
+    gbq = LocalBigQuery(str(tmp_path / 'w.duckdb'))
+    resultado = gbq.executar_query("select 'contato@evi.com.br' as email, @n + 1 as n", {'n': 1})
+    assert resultado.iloc[0].tolist() == ['contato@evi.com.br', 2]
+
+
+def test_instalar_to_gbq_restaura_o_original(tmp_path):
+    gbq = LocalBigQuery(str(tmp_path / 'w.duckdb'))
+    original = pd.DataFrame.__dict__.get('to_gbq')
+    with gbq.instalar_to_gbq():
+        pd.DataFrame({'id': [1]}).to_gbq('ds.t', 'evi-stitch', if_exists = 'replace')
+    assert pd.DataFrame.__dict__.get('to_gbq') is original
+    assert gbq.executar_query('select id from ds.t')['id'].tolist() == [1]
@@ -0,0 +1,34 @@
+import numpy as np
+
+from nn_cache import TrialCache, dataset_fingerprint, trial_key
+
+SPEC = {'layers': [16, 8], 'input_shape': (4,), 'hidden_layer_activation': 'relu',
+        'num_nodes_at_output': 1, 'output_layer_activation': 'linear'}
+
+
+def test_trial_key_depende_de_tudo_que_define_o_trial():
+    dados = dataset_fingerprint(np.arange(12.0).reshape(3, 4), np.arange(3))
+    chave = trial_key(SPEC, 'adam', 'mse', 20, 0, dados)
+    assert chave == trial_key(dict(SPEC, layers = (16, 8), input_shape = [4]), 'adam', 'mse', 20, 0, dados)
+    assert chave != trial_key(dict(SPEC, layers = [8, 16]), 'adam', 'mse', 20, 0, dados)
+    assert chave != trial_key(SPEC, 'adam', 'mse', 20, 1, dados)
+    assert chave != trial_key(SPEC, 'adam', 'mse', 20, 0, dataset_fingerprint(np.arange(12.0).reshape(4, 3)))
+
+
+def test_fingerprint_considera_o_dtype():
+    assert dataset_fingerprint(np.arange(3)) != dataset_fingerprint(np.arange(3, dtype = np.int32))
+
+
+def test_trial_cache_ida_e_volta(tmp_path):
+    cache = TrialCache(str(tmp_path))
+    chave = trial_key(SPEC, 'adam', 'mse', 20, 0, 'dados')
+    assert chave not in cache and cache.get(chave) is None
+
+    pesos = [np.ones((4, 16)), np.zeros(16)]
+    cache.put(chave, {'val_mse': np.float32(0.25), 'epochs': 20}, pesos)
+    assert chave in cache
+    assert cache.get(chave) == {'val_mse': 0.25, 'epochs': 20}
+    for obtido, esperado in zip(cache.load_weights(chave), pesos):
+        np.testing.assert_array_equal(obtido, esperado)
+    # Apenas os arquivos finais ficam na pasta do trial (sem temporários).
+    assert sorted(p.name for p in (tmp_path / chave[:2] / chave).iterdir()) == ['metrics.json', 'weights.npz']
@@ -0,0 +1,47 @@
+from contextlib import nullcontext
+
+import numpy as np
+import pytest
+
+import nn_scheduler
+from nn_scheduler import _epochs_trained, rank_results
+
+
+def test_epochs_trained_reporta_a_epoca_restaurada():
+    # Parou cedo: restore_best_weights volta para a época de menor val_loss (a 2ª desta execução).
+    assert _epochs_trained(3, [0.5, 0.4, 0.45, 0.46], stopped_early = True) == 5
+    assert _epochs_trained(3, [0.5, 0.4, 0.3], stopped_early = False) == 6
+
+
+def test_rank_results_por_rung_e_metrica():
+    rows = [
+        {'model_name': 'a', 'rung': 0, 'val_mse': 0.1},
+        {'model_name': 'b', 'rung': 2, 'val_mse': 0.5},
+        {'model_name': 'c', 'rung': 2, 'val_mse': 0.2},
+        {'model_name': 'd', 'rung': 1, 'val_f1': 0.9},
+    ]
+    assert rank_results(rows[:3], 'regression')['model_name'].tolist() == ['c', 'b', 'a']
+    f1 = [dict(r, val_f1 = r.pop('val_mse')) for r in (dict(x) for x in rows[:3])]
+    assert rank_results(f1, 'classification')['model_name'].tolist() == ['b', 'c', 'a']
+
+
+def test_sobrevivente_que_parou_cedo_fica_no_topo(monkeypatch):
+    pytest.importorskip('sklearn')
+    # 'best' para cedo no rung 0 (não é retreinado), mas sobrevive a todos os rungs com o melhor val_mse.
+    mse = {'best': 0.01, 'mid': 0.2, 'low': 0.5}
+    mse.update({f'x{i}': 1.0 + i for i in range(6)})
+
+    def iter_completed(executor, fn, jobs, max_pending):
+        for job in jobs:
+            spec, weights, initial_epoch, epochs, patience = job
+            name = spec['model_name']
+            yield job, {'weights': None, 'epochs_trained': epochs, 'epochs_run': epochs - initial_epoch,
+                        'stopped_early': name == 'best', 'val_mse': mse[name], 'test_mse': mse[name]}, None
+
+    monkeypatch.setattr(nn_scheduler, 'make_executor', lambda *args, **kwargs: nullcontext())
+    monkeypatch.setattr(nn_scheduler, 'iter_completed', iter_completed)
+    specs = [{'model_name': name} for name in mse]
+    X, y = np.zeros((10, 2)), np.zeros(10)
+    results = nn_scheduler.successive_halving(specs, X, y, X, y, min_epochs = 1, max_epochs = 9, eta = 3, n_workers = 1)
+    assert results['model_name'].tolist()[:3] == ['best', 'mid', 'low']
+    assert results.set_index('model_name').loc['best', 'rung'] == results['rung'].max()
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+pytest.importorskip('zstandard')
+import omie_arquivo  # noqa: E402
+from omie_arquivo import ArquivoRespostas  # noqa: E402
+
+
+def _nf(id_nf, emissao, valor = 0):
+    return {'compl': {'nIdNF': id_nf}, 'ide': {'dEmi': emissao}, 'total': {'vNF': valor}}
+
+
+@pytest.fixture
+def arquivo(tmp_path):
+    arquivo = ArquivoRespostas(str(tmp_path / 'arquivo'), tamanho_segmento = 200)
+    yield arquivo
+    arquivo.fechar()
+
+
+def test_ida_e_volta(arquivo):
+    pagina = [_nf(1, '01/03/2023', 10.5), _nf(2, '02/03/2023', 20)]
+    arquivo.gravar_pagina('nfCadastro', pagina)
+    assert arquivo.ler('nfCadastro') == pagina
+
+
+def test_novos_segmentos_quando_o_atual_enche(arquivo):
+    for i in range(5):
+        arquivo.gravar_pagina('nfCadastro', [_nf(i, '01/03/2023', 'x' * 100)])
+    assert len(os.listdir(os.path.join(arquivo.root, 'nfCadastro'))) > 1
+    assert [r['compl']['nIdNF'] for r in arquivo.ler('nfCadastro')] == list(range(5))
+
+
+def test_filtro_por_data(arquivo):
+    arquivo.gravar_pagina('nfCadastro', [_nf(1, '28/02/2023'), _nf(2, '01/03/2023'), _nf(3, '05/03/2023')])
+    lidos = arquivo.ler('nfCadastro', data_de = '01/03/2023', data_ate = '2023-03-04')
+    assert [r['compl']['nIdNF'] for r in lidos] == [2]
+
+
+def test_ultima_versao_por_id(arquivo):
+    arquivo.gravar_pagina('nfCadastro', [_nf(1, '01/03/2023', 10), _nf(2, '01/03/2023', 20)])
+    arquivo.gravar_pagina('nfCadastro', [_nf(1, '01/03/2023', 11)])
+    assert [r['total']['vNF'] for r in arquivo.ler('nfCadastro')] == [20, 11]
+    assert len(arquivo.ler('nfCadastro', ultima_versao = False)) == 3
+
+
+def test_registros_sem_id_sao_mantidos(arquivo):
+    sem_id = [{'ide': {'dEmi': '01/03/2023'}, 'n': 1}, {'ide': {'dEmi': '01/03/2023'}, 'n': 2}]
+    arquivo.gravar_pagina('nfCadastro', [_nf(1, '01/03/2023')] + sem_id)
+    lidos = arquivo.ler('nfCadastro')
+    assert len(lidos) == 3
+    assert lidos[1:] == sem_id
+
+
+def test_filtro_por_ids_em_blocos(arquivo, monkeypatch):
+    monkeypatch.setattr(omie_arquivo, 'IDS_POR_CONSULTA', 2)
+    for i in range(6):
+        arquivo.gravar_pagina('nfCadastro', [_nf(i, '01/03/2023')])
+    lidos = arquivo.ler('nfCadastro', ids = [5, 0, 3, 3, 4])
+    assert sorted(r['compl']['nIdNF'] for r in lidos) == [0, 3, 4, 5]
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+pytest.importorskip('requests')
+from benchmark_memoria import gerar_notas_fiscais  # noqa: E402
+from omie import omie  # noqa: E402
+from omie_arrow import achatar_itens, coluna_arrow, para_pandas  # noqa: E402
+from omie_schema import tipar_dataframe  # noqa: E402
+
+SCHEMA = [('nfProdInt_nCodItem', 'INT64'), ('prod_CFOP', 'STRING'), ('prod_NCM', 'STRING'), ('prod_vProd', 'FLOAT64'),
+          ('nIdNF', 'INT64'), ('dEmi', 'DATE'), ('dInc', 'STRING'), ('cnpj_cpf', 'STRING'), ('cUF', 'STRING'),
+          ('vNF', 'FLOAT64'), ('nNF', 'STRING'), ('nao_existe', 'STRING')]
+
+
+class GBQ:
+    """ Apenas o necessário para notas_fiscais_df: as colunas da tabela notas_fiscais. """
+
+    def executar_query(self, query, params = None):
+        return pd.DataFrame(columns = [coluna for coluna, _ in SCHEMA])
+
+
+def _valores(serie):
+    return [None if pd.isna(v) else v for v in serie.astype(object)]
+
+
+def test_notas_fiscais_arrow_igual_a_notas_fiscais_df():
+    cliente = omie('key', 'secret', gbq = GBQ())
+    cliente._schemas['notas_fiscais'] = SCHEMA
+    nfs = gerar_notas_fiscais(30)
+
+    esperado = tipar_dataframe(cliente.notas_fiscais_df(nfs), SCHEMA)
+    obtido = para_pandas(cliente.notas_fiscais_arrow(nfs))
+    assert list(obtido.columns) == list(esperado.columns)
+    assert len(obtido) == len(esperado) == 90
+    for coluna, tipo in SCHEMA:
+        valores = _valores(obtido[coluna])
+        if tipo == 'DATE':
+            valores = [v.date() if v is not None else None for v in valores]
+        assert valores == _valores(esperado[coluna]), coluna
+
+
+def test_achatar_itens_primeira_ocorrencia_prevalece():
+    registros = [{'det': [{'a': {'x': 1}, 'y': 2}], 'm1': {'y': 'meta', 'z': 3}, 'm2': {'z': 4}}]
+    assert list(achatar_itens(registros, ['m1', 'm2'])) == [{'a_x': 1, 'y': 2, 'z': 3}]
+
+
+def test_texto_repetido_vira_dicionario():
+    import pyarrow as pa
+    assert pa.types.is_dictionary(coluna_arrow(['5.102'] * 10, 'STRING').type)
+    assert pa.types.is_string(coluna_arrow([str(i) for i in range(10)], 'STRING').type)
@@ -0,0 +1,105 @@
+import os
+import time
+from datetime import date, timedelta
+
+import pytest
+
+from omie_backfill import BackfillOmie
+
+
+class Resposta:
+    def __init__(self, corpo):
+        self.corpo = corpo
+
+    def json(self):
+        return self.corpo
+
+
+class Omie:
+    """ Conta Omie falsa: `por_dia` NFs por dia entre `inicio` e `fim`, paginadas como em ListarNF. """
+
+    BASE_URL = 'https://app.omie.com.br/api/v1/'
+    dataset = 'omie'
+
+    def __init__(self, inicio, fim, por_dia):
+        self.nfs = []
+        dia = inicio
+        while dia <= fim:
+            self.nfs.extend({'compl': {'nIdNF': f'{dia.isoformat()}-{i}'}, 'dia': dia.isoformat()} for i in range(por_dia))
+            dia += timedelta(days = 1)
+        self.chamadas = []
+        self.arquivadas = 0
+
+    def _requisicao_api(self, url, atributos, chamado):
+        self.chamadas.append(atributos)
+        de = _iso(atributos['filtrar_por_data_de'])
+        ate = _iso(atributos['filtrar_por_data_ate'])
+        nfs = [nf for nf in self.nfs if de <= nf['dia'] <= ate]
+        if not nfs:
+            return Resposta({'faultstring': 'ERROR: Não existem registros para a página [1]!'})
+        n = atributos['registros_por_pagina']
+        inicio = (atributos['pagina'] - 1) * n
+        return Resposta({'nfCadastro': nfs[inicio:inicio + n], 'total_de_registros': len(nfs),
+                         'total_de_paginas': -(-len(nfs) // n)})
+
+    def _arquivar(self, chave, registros):
+        self.arquivadas += len(registros)
+
+
+def _iso(valor):
+    d, m, a = valor.split('/')
+    return f'{a}-{m}-{d}'
+
+
+@pytest.fixture
+def conta():
+    return Omie(date(2023, 1, 1), date(2023, 1, 8), por_dia = 10)
+
+
+def _backfill(conta, pasta, **kwargs):
+    return BackfillOmie(conta, 'notas_fiscais', pasta = str(pasta), max_registros = 25, registros_por_pagina = 7,
+                        n_workers = 2, **kwargs)
+
+
+def test_planejar_divide_janelas_grandes(conta, tmp_path):
+    janelas = _backfill(conta, tmp_path).planejar('01/01/2023', '15/01/2023')
+    assert all(j['registros'] <= 25 for j in janelas)
+    assert sum(j['registros'] for j in janelas) == 80
+    assert janelas[0]['de'] == '2023-01-01' and janelas[-1]['ate'] <= '2023-01-08'
+    # Janelas em ordem e sem sobreposição.
+    assert all(a['ate'] < b['de'] for a, b in zip(janelas, janelas[1:]))
+
+
+def test_executar_baixa_todas_as_paginas(conta, tmp_path):
+    nfs = _backfill(conta, tmp_path).executar('01/01/2023', '08/01/2023')
+    assert sorted(nf['compl']['nIdNF'] for nf in nfs) == sorted(nf['compl']['nIdNF'] for nf in conta.nfs)
+    assert conta.arquivadas == 80
+
+
+def test_retomada_reaproveita_plano_e_checkpoints(conta, tmp_path):
+    _backfill(conta, tmp_path).executar('01/01/2023', '08/01/2023')
+    conta.chamadas.clear()
+    assert len(_backfill(conta, tmp_path).executar('01/01/2023', '08/01/2023')) == 80
+    assert conta.chamadas == []
+
+
+def test_checkpoints_antigos_sao_refeitos(conta, tmp_path):
+    backfill = _backfill(conta, tmp_path, max_idade_horas = 1)
+    backfill.executar('01/01/2023', '08/01/2023')
+    janelas = backfill.planejar('01/01/2023', '08/01/2023')
+    antigo = time.time() - 2 * 3600
+    os.utime(backfill._caminho_janela(janelas[0]), (antigo, antigo))
+    conta.chamadas.clear()
+
+    backfill.executar('01/01/2023', '08/01/2023')
+    consultadas = {(c['filtrar_por_data_de'], c['filtrar_por_data_ate']) for c in conta.chamadas}
+    assert consultadas == {(date.fromisoformat(janelas[0]['de']).strftime('%d/%m/%Y'),
+                            date.fromisoformat(janelas[0]['ate']).strftime('%d/%m/%Y'))}
+
+
+def test_refazer_ignora_o_disco(conta, tmp_path):
+    _backfill(conta, tmp_path).executar('01/01/2023', '08/01/2023')
+    conta.chamadas.clear()
+    _backfill(conta, tmp_path).executar('01/01/2023', '08/01/2023', refazer = True)
+    assert any(c['registros_por_pagina'] == 1 for c in conta.chamadas)
+    assert any(c['registros_por_pagina'] == 7 for c in conta.chamadas)
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+pytest.importorskip('requests')
+from omie import omie  # noqa: E402
+
+
+class Resposta:
+    """ Resposta HTTP mínima (requests.Response). """
+
+    def __init__(self, corpo, status_code = 200):
+        self.corpo = corpo
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = corpo if isinstance(corpo, str) else json.dumps(corpo)
+
+    def json(self):
+        if isinstance(self.corpo, str):
+            raise ValueError('resposta não é JSON')
+        return self.corpo
+
+
+def _omie(resposta):
+    cliente = omie('key', 'secret')
+    cliente._post = lambda url, data: resposta
+    return cliente
+
+
+FALHAS = [
+    Resposta({'faultstring': 'ERROR: Nota fiscal não cadastrada', 'faultcode': 'SOAP-ENV:Client-103'}, 500),
+    Resposta({'faultstring': 'ERROR: Consumo redundante'}),
+    Resposta('<html>Bad Gateway</html>', 502),
+    Resposta({}),
+]
+
+
+@pytest.mark.parametrize('resposta', FALHAS)
+@pytest.mark.parametrize('metodo', ['consultar_nota_fiscal', 'consultar_pedido', 'consultar_cliente'])
+def test_consultas_levantam_erro_em_falhas(metodo, resposta):
+    with pytest.raises(RuntimeError):
+        getattr(_omie(resposta), metodo)(123)
+
+
+def test_consultas_retornam_o_registro():
+    nf = {'compl': {'nIdNF': 1}, 'det': []}
+    assert _omie(Resposta(nf)).consultar_nota_fiscal(1) == nf
+    pedido = {'cabecalho': {'codigo_pedido': 2}, 'det': []}
+    assert _omie(Resposta({'pedido_venda_produto': pedido})).consultar_pedido(2) == pedido
+    cliente = {'codigo_cliente_omie': 3, 'razao_social': 'X'}
+    assert _omie(Resposta(cliente)).consultar_cliente(3) == cliente
@@ -0,0 +1,57 @@
+import json
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('requests')
+from omie import carga_ok, hash_dataframe, omie  # noqa: E402
+
+
+def test_hash_dataframe_independe_da_ordem():
+    df = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', None]})
+    embaralhado = df.iloc[[2, 0, 1]][['b', 'a']]
+    assert hash_dataframe(df) == hash_dataframe(embaralhado)
+    assert hash_dataframe(df) != hash_dataframe(df.assign(b = ['x', 'y', 'z']))
+
+
+def test_carga_ok():
+    assert carga_ok('Adicionar CFOP ao BQ: OK')
+    assert not carga_ok('Adicionar CFOP ao BQ: NÃO OK')
+    assert not carga_ok('Adicionar omie.cfop ao BQ: NÃO OK (ValueError())')
+
+
+@pytest.fixture
+def cliente(tmp_path):
+    cliente = omie('key', 'secret', dataset = 'ds')
+    cliente.HASHES_DIMENSOES_PATH = str(tmp_path / 'hashes.json')
+    return cliente
+
+
+DF = pd.DataFrame({'cod': ['1', '2'], 'descricao': ['a', 'b']})
+
+
+def test_so_recarrega_quando_muda(cliente):
+    cargas = []
+    carregar = lambda df: cargas.append(len(df)) or 'Adicionar ao BQ: OK'
+    cliente._atualizar_dimensao(DF, 'cfop', carregar)
+    assert 'sem alterações' in cliente._atualizar_dimensao(DF, 'cfop', carregar)
+    cliente._atualizar_dimensao(DF.iloc[:1], 'cfop', carregar)
+    cliente._atualizar_dimensao(DF.iloc[:1], 'cfop', carregar, forcar = True)
+    assert cargas == [2, 1, 1]
+
+
+@pytest.mark.parametrize('carregar', [
+    lambda df: 'Adicionar CFOP ao BQ: NÃO OK',
+    lambda df: 1 / 0,
+])
+def test_falha_na_carga_nao_grava_o_hash(cliente, carregar):
+    assert not carga_ok(cliente._atualizar_dimensao(DF, 'cfop', carregar))
+    assert cliente._ler_hashes_dimensoes() == {}
+
+
+def test_arquivo_de_hashes_corrompido_e_ignorado(cliente):
+    with open(cliente.HASHES_DIMENSOES_PATH, 'w') as f:
+        f.write('{"ds.cfop": ')
+    assert carga_ok(cliente._atualizar_dimensao(DF, 'cfop', lambda df: 'OK'))
+    with open(cliente.HASHES_DIMENSOES_PATH) as f:
+        assert json.load(f) == {'ds.cfop': hash_dataframe(DF)}
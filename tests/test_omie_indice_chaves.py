@@ -0,0 +1,47 @@
+import numpy as np
+
+from omie_indice_chaves import IndiceChaves
+
+
+def test_contem_texto_e_nulos(tmp_path):
+    indice = IndiceChaves(str(tmp_path / 'nf.npy'))
+    assert not indice.existe
+    indice.reconstruir(['123' + '00011122233', '456' + '99988877766', None])
+    assert len(indice) == 2
+    assert indice.contem(['12300011122233', '789', None]).tolist() == [True, False, False]
+
+
+def test_inteiro_ignora_nulos_e_nao_numericos(tmp_path):
+    indice = IndiceChaves(str(tmp_path / 'ids.npy'), 'inteiro')
+    indice.adicionar([3, 1.0, float('nan'), None, 'x'])
+    assert indice.chaves.tolist() == [1, 3]
+    assert indice.contem([1, 2, 3, float('nan')]).tolist() == [True, False, True, False]
+
+
+def test_gravacoes_de_instancias_diferentes_sao_unidas(tmp_path):
+    path = str(tmp_path / 'ids.npy')
+    a = IndiceChaves(path, 'inteiro')
+    b = IndiceChaves(path, 'inteiro')
+    a.adicionar([1, 2])
+    b.adicionar([5])
+    a.adicionar([7])
+    assert np.load(path).tolist() == [1, 2, 5, 7]
+    # b relê o arquivo alterado por a antes de consultar.
+    assert b.contem([7]).tolist() == [True]
+    assert IndiceChaves(path, 'inteiro').chaves.tolist() == [1, 2, 5, 7]
+
+
+def test_gravacoes_concorrentes_entre_processos(tmp_path):
+    # Vários processos adicionam chaves ao mesmo arquivo: nenhuma chave é perdida (lock de arquivo).
+    import multiprocessing as mp
+
+    path = str(tmp_path / 'ids.npy')
+    with mp.get_context('spawn').Pool(4) as pool:
+        pool.starmap(_adicionar_chaves, [(path, range(i * 50, (i + 1) * 50)) for i in range(8)])
+    assert IndiceChaves(path, 'inteiro').chaves.tolist() == list(range(400))
+
+
+def _adicionar_chaves(path, chaves):
+    indice = IndiceChaves(path, 'inteiro')
+    for chave in chaves:
+        indice.adicionar([chave])
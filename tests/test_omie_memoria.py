@@ -0,0 +1,81 @@
+import pytest
+
+from omie_memoria import GovernadorMemoria
+
+
+class Memoria:
+    """ Medida de memória controlada pelo teste (substitui rss_mb). """
+
+    def __init__(self, mb):
+        self.mb = mb
+
+    def __call__(self):
+        return self.mb, None
+
+
+def _governador(memoria, **kwargs):
+    governador = GovernadorMemoria(orcamento_mb = 100, paginas_iniciais = 20, **kwargs)
+    governador._medir = memoria
+    governador.iniciar_lote()
+    return governador
+
+
+def _lote(governador, memoria, pico, final = None):
+    # Simula um lote: a memória chega ao pico e termina em `final` (padrão: fica no pico).
+    memoria.mb = pico
+    governador._registrar_amostra()
+    memoria.mb = pico if final is None else final
+    return governador.ajustar()
+
+
+@pytest.mark.parametrize('pico, paginas', [(1010, 30), (1070, 20), (1090, 10)])
+def test_ajustar_pelo_crescimento_no_lote(pico, paginas):
+    # Início do lote em 1000 MB; o orçamento vale para o crescimento (100 MB).
+    memoria = Memoria(1000)
+    assert _lote(_governador(memoria), memoria, pico) == paginas
+
+
+def test_memoria_retida_de_lotes_anteriores_nao_reduz_o_lote():
+    # O RSS continua alto depois de um lote grande, mas o próximo lote quase não cresce.
+    memoria = Memoria(1000)
+    governador = _governador(memoria)
+    assert _lote(governador, memoria, 1090) == 10
+    assert _lote(governador, memoria, 1095) == 15
+
+
+def test_limites_de_paginas():
+    memoria = Memoria(0)
+    governador = _governador(memoria, paginas_min = 2, paginas_max = 40)
+    for _ in range(10):
+        _lote(governador, memoria, 95, final = 0)
+    assert governador.tamanho_lote() == 2
+    for _ in range(10):
+        _lote(governador, memoria, 10, final = 0)
+    assert governador.tamanho_lote() == 40
+
+
+def test_perfil_por_etapa():
+    memoria = Memoria(50)
+    governador = _governador(memoria)
+    with governador.etapa('api', pagina = 1):
+        memoria.mb = 80
+        governador._registrar_amostra()
+    assert governador.perfil[0]['etapa'] == 'api'
+    assert governador.perfil[0]['pagina'] == 1
+    assert governador.perfil[0]['pico_rss_mb'] == 80
+    assert governador.resumo()['api']['execucoes'] == 1
+
+
+def test_memoria_perto_do_teto_reduz_o_lote_mesmo_com_pouco_crescimento():
+    # Cada lote cresce só 10 MB (folga no orçamento), mas a memória retida se aproxima do teto.
+    memoria = Memoria(1000)
+    governador = _governador(memoria, teto_mb = 1300, paginas_min = 4)
+    paginas = [_lote(governador, memoria, pico) for pico in (1010, 1020, 1030, 1040, 1050)]
+    assert paginas == [30, 45, 67, 33, 16]
+    assert [_lote(governador, memoria, pico) for pico in (1060, 1070, 1080)] == [8, 4, 4]
+
+
+def test_sem_teto_o_lote_so_depende_do_crescimento():
+    memoria = Memoria(5000)
+    governador = _governador(memoria)
+    assert _lote(governador, memoria, 5010) == 30
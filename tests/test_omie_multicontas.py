@@ -0,0 +1,28 @@
+import time
+
+from omie_multicontas import OrcamentoRequisicoes
+
+
+def test_rajada_ate_a_capacidade_sem_espera():
+    orcamento = OrcamentoRequisicoes(taxa = 10, capacidade = 5)
+    for _ in range(5):
+        assert orcamento._reservar() == 0
+
+
+def test_espera_acompanha_a_taxa():
+    orcamento = OrcamentoRequisicoes(taxa = 100, capacidade = 1)
+    inicio = time.monotonic()
+    for _ in range(11):
+        orcamento.aguardar()
+    # 1 ficha inicial + 10 fichas a 100/s: pelo menos ~0,1 s.
+    assert time.monotonic() - inicio >= 0.09
+    assert orcamento.espera_total > 0
+
+
+def test_orcamento_pai_e_consumido_por_todas_as_contas():
+    pai = OrcamentoRequisicoes(taxa = 1000, capacidade = 10)
+    contas = [OrcamentoRequisicoes(taxa = 1000, capacidade = 10, pai = pai) for _ in range(2)]
+    for conta in contas:
+        for _ in range(3):
+            conta.aguardar()
+    assert pai._fichas <= 10 - 6 + 1
@@ -0,0 +1,60 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from omie_schema import converter_coluna, tipar_dataframe
+
+
+def test_texto_como_cast_as_string():
+    serie = pd.Series([1.0, 2.5, True, False, None, np.nan, pd.NA, 'abc'], dtype = 'object')
+    assert converter_coluna(serie, 'STRING').tolist() == ['1', '2.5', 'true', 'false', pd.NA, pd.NA, pd.NA, 'abc']
+
+
+def test_inteiros_com_nulos_e_valores_invalidos():
+    serie = pd.Series(['10', 3.0, None, 'x'], dtype = 'object')
+    assert converter_coluna(serie, 'INT64').tolist() == [10, 3, pd.NA, pd.NA]
+    assert str(converter_coluna(serie, 'INT64').dtype) == 'Int64'
+
+
+def test_decimais_e_booleanos():
+    assert converter_coluna(pd.Series(['1,5', '2.5', None]), 'FLOAT64').isna().tolist() == [True, False, True]
+    assert converter_coluna(pd.Series(['S', 'N', 'true', None]), 'BOOL').tolist() == [True, False, True, pd.NA]
+
+
+def test_datas_no_formato_do_omie_e_iso():
+    datas = converter_coluna(pd.Series(['01/03/2023', '2023-03-02', 'x', None]), 'DATE')
+    assert datas.tolist()[:2] == [datetime.date(2023, 3, 1), datetime.date(2023, 3, 2)]
+    assert datas.isna().tolist()[2:] == [True, True]
+
+
+def test_tipar_dataframe_segue_o_schema():
+    df = pd.DataFrame([[1, 'a', 'x', 'y']], columns = ['id', 'nome', 'extra', 'nome'])
+    tipado = tipar_dataframe(df, [('nome', 'STRING'), ('id', 'INT64'), ('ausente', 'DATE')])
+    assert list(tipado.columns) == ['nome', 'id', 'ausente']
+    assert tipado.iloc[0]['nome'] == 'a'
+    assert tipado['ausente'].isna().all()
+
+
+SCHEMA_PEDIDOS = [('codigo_pedido', 'INT64'), ('codigo_item', 'INT64'), ('dInc', 'STRING'),
+                  ('dCan', 'STRING'), ('cImpAPI', 'STRING')]
+
+PEDIDOS = [{
+    'det': [{'ide': {'codigo_item': 1}}, {'ide': {'codigo_item': 2}}],
+    'cabecalho': {'codigo_pedido': 10}, 'total_pedido': {}, 'lista_parcelas': {}, 'frete': {},
+    'infoCadastro': {'dInc': '01/03/2023'}, 'informacoes_adicionais': {}, 'observacoes': {},
+}]
+
+
+def test_pedidos_mantem_nan_como_texto():
+    pytest.importorskip('requests')
+    from omie import omie
+    from omie_arrow import para_pandas
+
+    cliente = omie('key', 'secret', dataset = 'ds')
+    cliente._schemas['pedidos'] = SCHEMA_PEDIDOS
+    for df in (cliente.pedidos_df(PEDIDOS), para_pandas(cliente.pedidos_arrow(PEDIDOS))):
+        assert df['dCan'].astype(str).tolist() == ['nan', 'nan']
+        assert df['cImpAPI'].astype(str).tolist() == ['nan', 'nan']
+        assert df['codigo_pedido'].tolist() == [10, 10]
@@ -0,0 +1,142 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from omie_webhook import LotesWebhook, identificar_evento, make_handler, reproduzir_eventos
+
+
+class OmieFalso:
+    """ Cliente omie mínimo: consultas por id e cargas registradas em memória. """
+
+    app_key = 'K'
+
+    def __init__(self, falhas_carga = 0, ids_com_erro = ()):
+        self.cargas = []
+        self.falhas_carga = falhas_carga
+        self.ids_com_erro = set(ids_com_erro)
+
+    def _arquivar(self, chave, registros):
+        pass
+
+    def consultar_nota_fiscal(self, id_nf):
+        if id_nf in self.ids_com_erro:
+            raise ValueError('consulta')
+        return {'compl': {'nIdNF': id_nf}}
+
+    def consultar_pedido(self, codigo_pedido):
+        return {'cabecalho': {'codigo_pedido': codigo_pedido}}
+
+    def consultar_cliente(self, codigo_cliente_omie):
+        return {'codigo_cliente_omie': codigo_cliente_omie}
+
+    def carregar_notas_fiscais(self, registros, tabela_temp):
+        if self.falhas_carga:
+            self.falhas_carga -= 1
+            return 'Adicionar NF ao BQ: NÃO OK'
+        self.cargas.append(('notas_fiscais', sorted(r['compl']['nIdNF'] for r in registros)))
+        return 'Adicionar NF ao BQ: OK'
+
+    def carregar_pedidos(self, registros, tabela_temp, substituir_existentes = False):
+        self.cargas.append(('pedidos', len(registros), substituir_existentes))
+        return 'Adicionar Pedidos ao BQ: OK'
+
+    def clientes_df(self, registros):
+        return registros
+
+    def carregar_clientes(self, clientes, substituir_existentes = False):
+        self.cargas.append(('clientes', len(clientes), substituir_existentes))
+        return 'Adicionar clientes ao BQ: OK'
+
+
+@pytest.fixture
+def lotes_falsos(tmp_path):
+    def criar(omie, **kwargs):
+        kwargs.setdefault('arquivo_falhas', str(tmp_path / 'falhas.jsonl'))
+        return LotesWebhook(omie, tamanho_max = 100, intervalo_max = 3600, **kwargs)
+    return criar
+
+
+@pytest.mark.parametrize('evento, esperado', [
+    ({'topic': 'NFe.NotaAutorizada', 'event': {'nIdNF': 10}}, ('notas_fiscais', 10)),
+    ({'topic': 'VendaProduto.Alterada', 'event': {'idPedido': 0}}, ('pedidos', 0)),
+    ({'topic': 'ClienteFornecedor.Alterado', 'event': {'codigo_cliente_omie': 7}}, ('clientes', 7)),
+    ({'topic': 'Financas.ContaPagar', 'event': {'id': 1}}, None),
+    ({'ping': 'omie'}, None),
+])
+def test_identificar_evento(evento, esperado):
+    assert identificar_evento(evento) == esperado
+
+
+def test_ids_repetidos_sao_consultados_uma_vez(lotes_falsos):
+    omie = OmieFalso()
+    lotes = lotes_falsos(omie)
+    for id_nf in [1, 2, 1, 3]:
+        lotes.adicionar('notas_fiscais', id_nf)
+    lotes.adicionar('pedidos', 5)
+    lotes.descarregar()
+    assert ('notas_fiscais', [1, 2, 3]) in omie.cargas
+    assert ('pedidos', 1, True) in omie.cargas
+    assert lotes.resumo()['eventos'] == 5
+    assert lotes.pendentes() == {'notas_fiscais': 0, 'pedidos': 0, 'clientes': 0}
+
+
+def test_falha_na_carga_devolve_o_lote(lotes_falsos):
+    omie = OmieFalso(falhas_carga = 1)
+    lotes = lotes_falsos(omie)
+    lotes.adicionar('notas_fiscais', 1)
+    lotes.descarregar()
+    assert omie.cargas == [] and lotes.pendentes()['notas_fiscais'] == 1
+    lotes.descarregar()
+    assert omie.cargas == [('notas_fiscais', [1])]
+    assert lotes.resumo()['erros_carga'] == 1
+
+
+def test_ids_descartados_apos_max_tentativas(lotes_falsos, tmp_path):
+    lotes = lotes_falsos(OmieFalso(ids_com_erro = {9}), max_tentativas = 2)
+    lotes.adicionar('notas_fiscais', 9)
+    lotes.descarregar()
+    lotes.descarregar()
+    assert lotes.pendentes()['notas_fiscais'] == 0
+    assert lotes.resumo()['descartados'] == 1
+    falhas = [json.loads(linha) for linha in open(tmp_path / 'falhas.jsonl')]
+    assert len(falhas) == 1 and falhas[0]['tentativas'] == 2
+    # O arquivo de falhas tem o formato de evento e pode ser reprocessado.
+    assert identificar_evento(falhas[0]) == ('notas_fiscais', 9)
+
+
+def test_servidor_e_reproducao_de_eventos(lotes_falsos, tmp_path):
+    lotes = lotes_falsos(OmieFalso())
+    gravados = tmp_path / 'gravados.jsonl'
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(lotes, str(gravados)))
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    try:
+        eventos = tmp_path / 'eventos.jsonl'
+        with open(eventos, 'w') as f:
+            for evento in [
+                {'topic': 'NFe.NotaAutorizada', 'appKey': 'K', 'event': {'nIdNF': 1}},
+                {'topic': 'ClienteFornecedor.Incluido', 'event': {'codigo_cliente_omie': 2}},
+                {'ping': 'omie'},
+                {'topic': 'NFe.NotaAutorizada', 'appKey': 'outra', 'event': {'nIdNF': 3}},
+            ]:
+                f.write(json.dumps(evento) + '\n')
+            f.write('\n')
+        status = reproduzir_eventos(str(eventos), f'http://127.0.0.1:{server.server_address[1]}/omie/webhook')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert status == {202: 2, 200: 1, 403: 1}
+    assert lotes.pendentes() == {'notas_fiscais': 1, 'pedidos': 0, 'clientes': 1}
+    assert len(open(gravados).readlines()) == 3
+
+
+def test_falha_na_consulta_volta_ao_lote_sem_carga(lotes_falsos):
+    # Uma consulta com faultstring levanta erro (ver omie._consultar_registro): o id não é descartado em silêncio.
+    omie = OmieFalso(ids_com_erro = {4})
+    lotes = lotes_falsos(omie)
+    lotes.adicionar('notas_fiscais', 4)
+    lotes.descarregar()
+    assert omie.cargas == []
+    assert lotes.pendentes()['notas_fiscais'] == 1
+    assert lotes.resumo()['erros_consulta'] == 1
@@ -0,0 +1,86 @@
+import pytest
+
+from shopify import AcompanhamentoJobs, shopify
+
+
+class Job:
+    """Job falso do BigQuery: conclui após `polls` consultas a done()."""
+
+    def __init__(self, polls = 1, erro = None, bytes_processados = 0):
+        self.polls = polls
+        self.error_result = erro
+        self.total_bytes_processed = bytes_processados
+        self.slot_millis = 10
+
+    def done(self):
+        self.polls -= 1
+        return self.polls <= 0
+
+
+class Cliente:
+    def __init__(self, erros = None):
+        self.erros = erros or {}
+        self.queries = []
+
+    def query(self, sql, job_config = None):
+        self.queries.append(sql)
+        nome = 'delete' if sql.lstrip().startswith('delete') else 'merge'
+        return Job(erro = self.erros.get(nome))
+
+
+def test_acompanhamento_aguarda_todos_os_jobs():
+    jobs = AcompanhamentoJobs(intervalo = 0)
+    jobs.submeter('a', Job(polls = 3, bytes_processados = 2**20))
+    jobs.submeter('b', Job(polls = 1, erro = {'reason': 'invalidQuery'}))
+    relatorio = jobs.aguardar()
+    assert relatorio['a']['ok'] and relatorio['a']['bytes_processados'] == 2**20
+    assert not relatorio['b']['ok'] and relatorio['b']['erro'] == {'reason': 'invalidQuery'}
+
+
+def test_acompanhamento_timeout():
+    jobs = AcompanhamentoJobs(intervalo = 0)
+    jobs.submeter('lento', Job(polls = 10**9))
+    with pytest.raises(TimeoutError):
+        jobs.aguardar(timeout = 0)
+
+
+def test_acompanhamento_sem_jobs_devolve_relatorio_vazio():
+    assert AcompanhamentoJobs(intervalo = 0).aguardar() == {}
+
+
+@pytest.fixture
+def queries_path(tmp_path):
+    # O caminho do arquivo é montado com '\\', como no Windows.
+    pasta = tmp_path / 'queries'
+    pasta.mkdir()
+    with open(str(pasta) + '\\merge_shopify_query.txt', 'w') as f:
+        f.write('merge into x using y on x.id = y.id when not matched then insert row;\n')
+    return str(pasta)
+
+
+def _shopify(monkeypatch, cliente):
+    monkeypatch.setenv('GOOGLE_APPLICATION_CREDENTIALS', '')
+    return shopify('cred', client = cliente)
+
+
+def test_merge_apos_delete(monkeypatch, queries_path):
+    cliente = Cliente()
+    relatorio = _shopify(monkeypatch, cliente).update_tabela_historica(queries_path)
+    assert relatorio['delete']['ok'] and relatorio['merge']['ok']
+    assert cliente.queries[1].startswith('merge into x')
+
+
+def test_falha_no_delete_interrompe_o_merge(monkeypatch, queries_path):
+    cliente = Cliente(erros = {'delete': {'reason': 'accessDenied'}})
+    relatorio = _shopify(monkeypatch, cliente).update_tabela_historica(queries_path)
+    assert not relatorio['delete']['ok']
+    assert 'merge' not in relatorio
+    assert len(cliente.queries) == 1
+
+
+def test_csv_sem_dias_nao_executa_jobs(monkeypatch, queries_path):
+    import pandas as pd
+    cliente = Cliente()
+    vazio = pd.DataFrame({'day': pd.to_datetime([])})
+    assert _shopify(monkeypatch, cliente).atualizar_particoes(vazio, queries_path) == {}
+    assert cliente.queries == []
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from trends_feature_store import FeatureStore
+
+
+def _serie(datas, valores, nome = 'x'):
+    return pd.DataFrame({nome: valores}, index = pd.to_datetime(datas))
+
+
+def test_interpolacao_igual_ao_pandas():
+    # Google Trends é semanal: os dias entre observações são interpolados.
+    semanal = _serie(['2023-01-01', '2023-01-08', '2023-01-15'], [10.0, 24.0, 3.0], 'trends')
+    diario = _serie(pd.date_range('2023-01-01', '2023-01-20'), np.arange(20.0), 'cpm')
+    fs = FeatureStore('2023-01-01', capacidade = 4)
+    fs.adicionar('trends', semanal)
+    fs.adicionar('facebook', diario)
+
+    esperado = semanal.reindex(pd.date_range('2023-01-01', '2023-01-20')).interpolate(method = 'linear')['trends']
+    np.testing.assert_allclose(fs.coluna('trends'), esperado.to_numpy())
+    assert len(fs) == 20 and fs.datas[-1] == np.datetime64('2023-01-20')
+
+
+def test_inclusao_incremental_igual_a_inclusao_unica():
+    datas = pd.date_range('2023-01-01', '2023-03-01', freq = '7D')
+    valores = np.linspace(1, 50, len(datas))
+    unica = FeatureStore('2023-01-01')
+    unica.adicionar('trends', _serie(datas, valores))
+    incremental = FeatureStore('2023-01-01', capacidade = 2)
+    for i in range(0, len(datas), 3):
+        incremental.adicionar('trends', _serie(datas[i:i + 3], valores[i:i + 3]))
+    np.testing.assert_allclose(incremental.coluna('x'), unica.coluna('x'))
+
+
+def test_datas_anteriores_ao_inicio_sao_descartadas():
+    fs = FeatureStore('2023-01-05')
+    fs.adicionar('g', _serie(['2023-01-01', '2023-01-06'], [1.0, 2.0]))
+    assert len(fs) == 2
+    assert np.isnan(fs.coluna('x')[0]) and fs.coluna('x')[1] == 2.0
+
+
+def test_consultas_sao_views():
+    fs = FeatureStore('2023-01-01')
+    df = pd.DataFrame({'a': [1.0, 2.0], 'b': [3.0, 4.0]}, index = pd.to_datetime(['2023-01-01', '2023-01-02']))
+    fs.adicionar('g', df, interpolar = False)
+    assert np.shares_memory(fs.grupo('g'), fs._dados)
+    assert np.shares_memory(fs.matriz(['a', 'b']), fs._dados)
+    assert not np.shares_memory(fs.matriz(['b', 'a']), fs._dados)
+    np.testing.assert_array_equal(fs.matriz(['b', 'a']), [[3.0, 4.0], [1.0, 2.0]])
@@ -0,0 +1,142 @@
+"""
+Feature store das séries diárias usadas na análise de CPM x Google Trends.
+Criado por: Danilo Steckelberg
+Criado para: Evi Brasil
+Criado em: 2023-02-13
+
+Todas as séries ficam em um único array float64 (colunas x dias), alinhadas em um
+índice diário contínuo a partir de uma data de início. As séries com observações
+esparsas (Google Trends é semanal) são interpoladas linearmente no momento da inclusão,
+de forma incremental: novos dias só recalculam o trecho após a última observação.
+As consultas devolvem views NumPy (sem cópia) do array interno.
+"""
+
+import numpy as np
+
+
+class FeatureStore:
+
+    def __init__(self, inicio, capacidade = 1024):
+        """
+        Entradas:
+            inicio (str YYYY-MM-DD): primeiro dia do índice. Datas anteriores são descartadas.
+            capacidade (int): quantidade inicial de dias alocados.
+        """
+        self.inicio = np.datetime64(inicio, 'D')
+        self._n = 0
+        self._colunas = {}
+        self._grupos = {}
+        self._interpolar = []
+        self._dados = np.full((0, capacidade), np.nan)
+        self._observado = np.zeros((0, capacidade), dtype = bool)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def colunas(self):
+        return list(self._colunas)
+
+    @property
+    def datas(self):
+        """ Índice diário compartilhado por todas as séries (datetime64[D]). """
+        return self.inicio + np.arange(self._n)
+
+    def _garantir_capacidade(self, n):
+        capacidade = self._dados.shape[1]
+        if n <= capacidade:
+            return
+        while capacidade < n:
+            capacidade *= 2
+        dados = np.full((self._dados.shape[0], capacidade), np.nan)
+        observado = np.zeros((self._dados.shape[0], capacidade), dtype = bool)
+        dados[:, :self._n] = self._dados[:, :self._n]
+        observado[:, :self._n] = self._observado[:, :self._n]
+        self._dados, self._observado = dados, observado
+
+    def _criar_grupo(self, grupo, nomes, interpolar):
+        # As colunas de um grupo ficam em linhas consecutivas, para que o grupo inteiro seja uma view.
+        ini = self._dados.shape[0]
+        extra = len(nomes)
+        self._dados = np.vstack([self._dados, np.full((extra, self._dados.shape[1]), np.nan)])
+        self._observado = np.vstack([self._observado, np.zeros((extra, self._dados.shape[1]), dtype = bool)])
+        for i, nome in enumerate(nomes):
+            self._colunas[nome] = ini + i
+            self._interpolar.append(interpolar)
+        self._grupos[grupo] = (ini, ini + extra)
+
+    def _interpolar_linha(self, linha, ini):
+        # Interpolação linear entre observações a partir da posição ini; após a última observação
+        # o valor é repetido (mesmo comportamento de pandas.interpolate(method='linear')).
+        obs = np.flatnonzero(self._observado[linha, ini:self._n]) + ini
+        if len(obs) == 0:
+            return
+        pos = np.arange(obs[0], self._n)
+        self._dados[linha, obs[0]:self._n] = np.interp(pos, obs, self._dados[linha, obs])
+
+    def adicionar(self, grupo, df, interpolar = True):
+        """
+        Inclui (ou acrescenta) as colunas de um DataFrame indexado por data.
+        Na primeira chamada para um grupo as colunas são criadas; nas seguintes, apenas
+        os dias novos ou alterados são gravados e a interpolação é refeita só no trecho final.
+        Entradas:
+            grupo (str): nome do grupo de séries (ex.: 'facebook', 'ecom').
+            df (pandas.DataFrame): séries numéricas indexadas por data.
+            interpolar (bool): interpola os dias sem observação.
+        """
+        nomes = list(df.columns)
+        if grupo not in self._grupos:
+            self._criar_grupo(grupo, nomes, interpolar)
+
+        pos = (df.index.values.astype('datetime64[D]') - self.inicio).astype(np.int64)
+        validos = pos >= 0
+        pos = pos[validos]
+        if len(pos) == 0:
+            return
+        n_anterior = self._n
+        n = max(self._n, int(pos.max()) + 1)
+        self._garantir_capacidade(n)
+        self._n = n
+
+        valores = df.to_numpy(dtype = np.float64)[validos]
+        for j, nome in enumerate(nomes):
+            linha = self._colunas[nome]
+            obs = ~np.isnan(valores[:, j])
+            ultima = np.flatnonzero(self._observado[linha, :self._n])
+            self._dados[linha, pos[obs]] = valores[obs, j]
+            self._observado[linha, pos[obs]] = True
+            if self._interpolar[linha]:
+                # O trecho anterior à última observação já conhecida não muda, exceto se vierem dados antigos.
+                ini = ultima[-1] if len(ultima) > 0 else 0
+                if obs.any():
+                    ini = min(ini, int(pos[obs].min()))
+                ant = np.flatnonzero(self._observado[linha, :ini])
+                self._interpolar_linha(linha, ant[-1] if len(ant) > 0 else 0)
+
+        # Se o índice cresceu, as demais séries interpoladas repetem o último valor nos dias novos.
+        if n > n_anterior:
+            linhas_grupo = {self._colunas[nome] for nome in nomes}
+            for linha, interpolar_linha in enumerate(self._interpolar):
+                if interpolar_linha and linha not in linhas_grupo:
+                    ultima = np.flatnonzero(self._observado[linha, :self._n])
+                    if len(ultima) > 0:
+                        self._interpolar_linha(linha, ultima[-1])
+
+    def coluna(self, nome):
+        """ View (sem cópia) de uma coluna no índice compartilhado. """
+        return self._dados[self._colunas[nome], :self._n]
+
+    def grupo(self, grupo):
+        """ View (sem cópia) de um grupo, no formato (colunas x dias). """
+        ini, fim = self._grupos[grupo]
+        return self._dados[ini:fim, :self._n]
+
+    def matriz(self, nomes):
+        """
+        Matriz (colunas x dias) com as colunas selecionadas.
+        É uma view quando as colunas são consecutivas no array interno; caso contrário, uma cópia.
+        """
+        linhas = [self._colunas[nome] for nome in nomes]
+        if linhas == list(range(linhas[0], linhas[0] + len(linhas))):
+            return self._dados[linhas[0]:linhas[-1] + 1, :self._n]
+        return self._dados[linhas, :self._n]